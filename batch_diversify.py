@@ -0,0 +1,316 @@
+"""Offline multi-user diversification over one shared catalogue.
+
+Reads a JSONL file of user profiles (preferences, interactions and optional
+options per line), embeds the catalogue, every profile's preference query and
+every interacted entity once in the parent process, then forks a process pool
+that runs the per-user relevance blend, VW training and MMR against the
+parent's arrays, which the children share copy-on-write. Forked workers never
+run the encoder: torch/OpenMP after fork can deadlock, so a profile that
+would need a new embedding fails instead. Results stream to a JSONL file that doubles as the checkpoint:
+re-running the same command skips users already written successfully.
+
+    python batch_diversify.py --input results.json --profiles users.jsonl --output quests.jsonl --workers 8
+"""
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import time
+from typing import Any, Dict, Iterator, List, Optional, Set, Tuple
+
+import numpy as np
+
+from diversification_engine import (
+    DiversificationEngine, _normalize_rows, diversification_parameters, diversification_results
+)
+from diversity_metrics import DiversityColumns
+from encoder_backends import ENCODER_BACKENDS
+from entity_loader import load_entity_store
+from feature_store import EntityFeatureStore
+from selection_strategies import category_codes
+
+logger = logging.getLogger(__name__)
+
+# Set in the parent before forking; children read it without pickling
+_CATALOGUE = None
+
+
+class SharedCatalogue:
+    """Everything per-user scoring needs that does not depend on the user, computed once"""
+
+    def __init__(self, engine: DiversificationEngine, entities: List[Dict[str, Any]]):
+        self.engine = engine
+        self.entities = entities
+        start = time.perf_counter()
+        self.feature_store = EntityFeatureStore(entities)
+        self.raw_embeddings = engine._encode_entities(entities, self.feature_store.feature_texts)
+        self.entity_embeddings = _normalize_rows(self.raw_embeddings)
+        # Compiled before forking so every child shares them
+        self.feature_store.term_index
+        if engine.vw_available:
+            self.feature_store.vw_features(self.raw_embeddings)
+        self.diversity_columns = DiversityColumns(entities, self.entity_embeddings)
+        self.query_embeddings: Dict[str, np.ndarray] = {}
+        self._categories: Dict[str, np.ndarray] = {}
+        logger.info(f"Prepared catalogue of {len(entities)} entities in {time.perf_counter() - start:.2f}s")
+
+    def embed_queries(self, preference_sets: List[List[str]]):
+        """Encode every distinct preference query in one batched pass"""
+        queries = sorted({' '.join(prefs) for prefs in preference_sets} - set(self.query_embeddings))
+        if queries:
+            for query, vector in zip(queries, _normalize_rows(self.engine._encode(queries))):
+                self.query_embeddings[query] = vector
+
+    def categories(self, diversify_by: str) -> np.ndarray:
+        if diversify_by not in self._categories:
+            self._categories[diversify_by] = category_codes(self.entities, diversify_by)
+        return self._categories[diversify_by]
+
+    def diversify(self, profile: Dict[str, Any]) -> Dict[str, Any]:
+        user_preferences = profile_preferences(profile)
+        interactions = profile.get('interactions') or []
+        options = profile.get('options') or {}
+        parameters = diversification_parameters(
+            n_total=int(options.get('nTotal', profile.get('n_total', 8))),
+            n_high_affinity=int(options.get('nHighAffinity', profile.get('n_high_affinity', 3))),
+            lambda_param=float(options.get('lambdaParam', profile.get('lambda_param', 0.7))),
+            diversity_weight=float(options.get('diversityWeight', profile.get('diversity_weight', 0.0))),
+            diversity_target=options.get('diversityTarget', profile.get('diversity_target', 'cuisine_entropy')),
+            selection_strategy=options.get('selectionStrategy', profile.get('selection_strategy', 'two_phase')),
+            diversify_by=options.get('diversifyBy', profile.get('diversify_by', 'primary_cuisine')),
+            diversify_take=int(options.get('diversifyTake', profile.get('diversify_take', 2)))
+        )
+
+        # Each user appears once per file, so a per-user VW model would never be reused: train a throwaway one
+        relevance = self.engine._blend_relevance(
+            self.entities, self.feature_store, self.raw_embeddings, self.entity_embeddings,
+            self.query_embeddings[' '.join(user_preferences)], user_preferences, interactions, user_id=None
+        )
+        selection_strategy = parameters['selection_strategy']
+        diversify_by = parameters['diversify_by']
+        picks = self.engine._select_picks(
+            self.entities, self.entity_embeddings, relevance, parameters['n_total'], parameters['n_high_affinity'],
+            parameters['lambda_param'], parameters['diversity_weight'], parameters['diversity_target'],
+            diversity_columns=self.diversity_columns, selection_strategy=selection_strategy,
+            diversify_by=diversify_by, diversify_take=parameters['diversify_take'],
+            categories=self.categories(diversify_by) if selection_strategy == 'category_quota' else None
+        )
+        return diversification_results(
+            self.engine,
+            self.entities,
+            [self.entities[i] for i in picks],
+            [relevance[i] for i in picks],
+            self.diversity_columns.summarize(np.array(picks, dtype=np.int64)),
+            interactions,
+            parameters
+        )
+
+    def embed_interactions(self, interaction_sets: List[List[Dict[str, Any]]]):
+        """Embed every interacted entity in one batched pass, so VW training in the workers only reads the cache"""
+        if not self.engine.vw_available:
+            return
+        entities, seen = [], set()
+        for interactions in interaction_sets:
+            for interaction in interactions:
+                entity = interaction.get('entity') if isinstance(interaction, dict) else None
+                if not isinstance(entity, dict):
+                    continue
+                key = (str(entity.get('entity_id', '')), self.engine.extract_entity_features(entity))
+                if key not in seen:
+                    seen.add(key)
+                    entities.append(entity)
+        if not entities:
+            return
+        capacity = self.engine.embedding_cache.max_entries
+        if len(entities) + len(self.entities) > capacity:
+            logger.warning(
+                f"{len(entities)} interaction entities plus the catalogue exceed the embedding cache ({capacity}); "
+                "profiles whose embeddings were evicted will fail"
+            )
+        self.engine._encode_entities(entities)
+        logger.info(f"Embedded {len(entities)} interaction entities before forking")
+
+
+class _ParentOnlyEncoder:
+    """Installed in forked workers in place of the sentence model"""
+
+    def encode(self, texts: List[str], batch_size: int = 32):
+        raise RuntimeError(
+            f"Worker needed {len(texts)} new embeddings; everything must be embedded in the parent before forking"
+        )
+
+
+def _init_worker():
+    _CATALOGUE.engine._encoder = _ParentOnlyEncoder()
+
+
+def profile_preferences(profile: Dict[str, Any]) -> List[str]:
+    preferences = profile.get('preferences', profile.get('userPreferences', profile.get('user_preferences')))
+    if not isinstance(preferences, list):
+        raise ValueError("Profile has no preferences array")
+    return preferences
+
+
+def profile_user_id(profile: Dict[str, Any]) -> Optional[str]:
+    user_id = profile.get('user_id', profile.get('userId'))
+    return str(user_id) if user_id is not None else None
+
+
+def diversify_by_paths(profiles: List[Tuple[str, Dict[str, Any]]]) -> Tuple[str, ...]:
+    """Field paths category_quota profiles group by, beyond the built-in primary_cuisine"""
+    paths = set()
+    for _, profile in profiles:
+        options = profile.get('options') or {}
+        if options.get('selectionStrategy', profile.get('selection_strategy')) == 'category_quota':
+            paths.add(options.get('diversifyBy', profile.get('diversify_by', 'primary_cuisine')))
+    return tuple(sorted(paths - {'primary_cuisine'}))
+
+
+def read_profiles(path: str) -> Iterator[Tuple[str, Dict[str, Any]]]:
+    """(key, profile) per non-empty line; the key is the user id, or the line number when there is none"""
+    with open(path, 'r', encoding='utf-8') as f:
+        for line_number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                profile = json.loads(line)
+            except json.JSONDecodeError as e:
+                logger.warning(f"Skipping malformed profile on line {line_number}: {e}")
+                continue
+            yield profile_user_id(profile) or f"line-{line_number}", profile
+
+
+def load_checkpoint(output_path: str) -> Set[str]:
+    """Keys already written successfully; a torn last line from a crash is cut off so appends stay valid JSONL"""
+    done = set()
+    if not os.path.exists(output_path):
+        return done
+    good_bytes = 0
+    with open(output_path, 'rb') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                break
+            good_bytes += len(line)
+            # Failed users are retried on resume
+            if record.get('success'):
+                done.add(record['key'])
+    if good_bytes < os.path.getsize(output_path):
+        logger.warning(f"Truncating partial record at byte {good_bytes} of {output_path}")
+        with open(output_path, 'ab') as f:
+            f.truncate(good_bytes)
+    return done
+
+
+def _run_profile(item: Tuple[str, Dict[str, Any]]) -> Dict[str, Any]:
+    key, profile = item
+    start = time.perf_counter()
+    try:
+        results = _CATALOGUE.diversify(profile)
+        return {'key': key, 'user_id': profile_user_id(profile), 'success': True, 'seconds': round(time.perf_counter() - start, 4), 'data': results}
+    except Exception as e:
+        return {'key': key, 'user_id': profile_user_id(profile), 'success': False, 'error': str(e)}
+
+
+def run_batch(
+    catalogue: SharedCatalogue,
+    profiles: List[Tuple[str, Dict[str, Any]]],
+    output_path: str,
+    workers: int = None,
+    chunksize: int = 16,
+    full_records=None
+) -> Dict[str, Any]:
+    """Diversify every profile not yet in output_path and append one JSON line per user"""
+    global _CATALOGUE
+    done = load_checkpoint(output_path)
+    pending = [(key, profile) for key, profile in profiles if key not in done]
+    logger.info(f"{len(done)} users already done, {len(pending)} to run")
+
+    # Profiles without preferences fail individually in the workers
+    catalogue.embed_queries([
+        profile_preferences(profile) for _, profile in pending
+        if isinstance(profile.get('preferences', profile.get('userPreferences', profile.get('user_preferences'))), list)
+    ])
+    catalogue.embed_interactions([
+        profile.get('interactions') or [] for _, profile in pending if isinstance(profile.get('interactions') or [], list)
+    ])
+    _CATALOGUE = catalogue
+
+    workers = workers or os.cpu_count() or 1
+    start = time.perf_counter()
+    succeeded = failed = 0
+    with open(output_path, 'a', encoding='utf-8') as out:
+        # fork shares the catalogue arrays with the children; elsewhere run in-process
+        if workers > 1 and 'fork' in multiprocessing.get_all_start_methods():
+            pool = multiprocessing.get_context('fork').Pool(workers, initializer=_init_worker)
+            results = pool.imap(_run_profile, pending, chunksize=chunksize)
+        else:
+            pool = None
+            results = map(_run_profile, pending)
+        try:
+            for record in results:
+                if record['success']:
+                    succeeded += 1
+                    if full_records is not None:
+                        record['data']['diversified_recommendations'] = full_records(record['data']['diversified_recommendations'])
+                else:
+                    failed += 1
+                    logger.warning(f"User {record['key']} failed: {record['error']}")
+                out.write(json.dumps(record, ensure_ascii=False, separators=(',', ':'), default=float) + '\n')
+                # One flushed line per user is the checkpoint
+                out.flush()
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
+
+    elapsed = time.perf_counter() - start
+    return {
+        'users_skipped': len(done),
+        'users_succeeded': succeeded,
+        'users_failed': failed,
+        'seconds': round(elapsed, 3),
+        'users_per_second': round((succeeded + failed) / elapsed, 2) if elapsed > 0 else 0.0
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Diversify one catalogue for many users (nightly precomputation)')
+    parser.add_argument('--input', required=True, help='Catalogue JSON file path')
+    parser.add_argument('--profiles', required=True, help='JSONL file of user profiles: {user_id, preferences, interactions, options}')
+    parser.add_argument('--output', required=True, help='JSONL output path; existing successful users are skipped')
+    parser.add_argument('--workers', type=int, help='Worker processes (default: CPU count)')
+    parser.add_argument('--chunksize', type=int, default=16, help='Profiles handed to a worker at a time')
+    parser.add_argument('--full_records', action='store_true', help='Write full input records instead of projected entities')
+    parser.add_argument('--model_path', default="./saved_models/all-MiniLM-L6-v2", help='SentenceTransformer model directory')
+    parser.add_argument('--encoder_backend', default='torch', choices=list(ENCODER_BACKENDS), help='Encoder backend: torch, onnx or onnx-int8')
+    parser.add_argument('--embedding_cache_dir', help='Directory for the persistent entity embedding cache')
+    args = parser.parse_args()
+
+    profiles = list(read_profiles(args.profiles))
+    # category_quota groups by fields the projected catalogue would otherwise drop
+    store = load_entity_store(args.input, keep_paths=diversify_by_paths(profiles))
+    if not store.entities:
+        logger.error("No entities loaded")
+        return
+
+    engine = DiversificationEngine(
+        args.model_path, embedding_cache_dir=args.embedding_cache_dir, encoder_backend=args.encoder_backend
+    )
+    catalogue = SharedCatalogue(engine, store.entities)
+    summary = run_batch(
+        catalogue,
+        profiles,
+        args.output,
+        workers=args.workers,
+        chunksize=args.chunksize,
+        full_records=store.full_records if args.full_records else None
+    )
+    logger.info(f"Embedding cache: {engine.embedding_cache.stats()}")
+    print(json.dumps({'success': True, **summary}))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,402 @@
+"""Reproducible benchmark for the diversification engine.
+
+Generates seeded, Qloo-shaped place catalogues (tags, specialty dishes,
+good_for, price range, rating, geocode) at configurable scale, times the
+engine's hot-path stages and writes throughput, p50/p95/p99 latency and peak
+RSS as JSON. Runs offline against the bundled MiniLM model. Pass --compare
+with an earlier result to flag regressions between commits.
+
+    python benchmark_engine.py --sizes 100 1000 10000 --output bench.json
+    python benchmark_engine.py --sizes 100 1000 --compare bench.json
+    python benchmark_engine.py --sizes 1000 10000 --stages selection_strategies
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+from typing import Any, Callable, Dict, List
+
+import numpy as np
+
+from encoder_backends import ENCODER_BACKENDS
+
+# The bundled model must never trigger a hub lookup while benchmarking
+os.environ.setdefault('HF_HUB_OFFLINE', '1')
+os.environ.setdefault('TRANSFORMERS_OFFLINE', '1')
+
+CUISINES = [
+    'Thai', 'Vietnamese', 'Indian', 'Mexican', 'Tex-Mex', 'Barbecue', 'Italian', 'Japanese',
+    'Sushi', 'Korean', 'Ethiopian', 'Mediterranean', 'Chinese', 'Pizza', 'Cafe', 'Bakery',
+    'Vegan', 'Seafood', 'Burger', 'Dessert Shop', 'Middle Eastern', 'Peruvian', 'Nepalese'
+]
+AMENITIES = [
+    'Seating', 'Debit cards', 'High chairs', 'Wi-Fi', 'Outdoor seating', 'Takeout',
+    'Delivery', 'Free parking', 'Wheelchair accessible', 'Live music', 'Happy hour'
+]
+OFFERINGS = ['Vegetarian Meals', 'Vegan options', 'Halal', 'Comfort food', 'Small plates', 'Late-night food']
+GOOD_FOR = ['Good for kids', 'Groups', 'Date night', 'Solo dining', 'Lunch', 'Brunch', 'Inexpensive']
+DISHES = [
+    'pad thai', 'pho', 'butter chicken', 'brisket', 'tacos al pastor', 'ramen', 'bibimbap',
+    'injera', 'falafel', 'dim sum', 'margherita pizza', 'tiramisu', 'ceviche', 'momo', 'croissant'
+]
+WORDS = [
+    'authentic', 'family-run', 'spot', 'serving', 'classic', 'modern', 'cozy', 'dishes', 'fresh',
+    'local', 'street', 'food', 'counter', 'service', 'spacious', 'patio', 'craft', 'cocktails',
+    'homemade', 'recipes', 'neighborhood', 'favorite', 'casual', 'upscale', 'weekend', 'specials'
+]
+NEIGHBORHOODS = ['Downtown', 'East Austin', 'South Congress', 'Mueller', 'Hyde Park', 'Zilker', 'Domain']
+
+
+def _choice(rng: np.random.Generator, items: List[str], k: int) -> List[str]:
+    return [items[i] for i in rng.choice(len(items), size=min(k, len(items)), replace=False)]
+
+
+def generate_entities(n: int, tags_per_entity: int = 12, seed: int = 0) -> List[Dict[str, Any]]:
+    """Seeded synthetic places shaped like Qloo insights results"""
+    rng = np.random.default_rng(seed)
+    entities = []
+    for i in range(n):
+        cuisines = _choice(rng, CUISINES, int(rng.integers(1, 4)))
+        n_other = max(0, tags_per_entity - len(cuisines))
+        tags = [
+            {'id': f"urn:tag:genre:place:{c.lower()}", 'name': c, 'type': 'urn:tag:genre:place:cuisine'}
+            for c in cuisines
+        ]
+        tags += [
+            {'id': f"urn:tag:amenity:place:{a.lower()}", 'name': a, 'type': 'urn:tag:amenity:place'}
+            for a in _choice(rng, AMENITIES, n_other // 2)
+        ]
+        tags += [
+            {'id': f"urn:tag:offerings:place:{o.lower()}", 'name': o, 'type': 'urn:tag:offerings:place'}
+            for o in _choice(rng, OFFERINGS, n_other - n_other // 2)
+        ]
+        price_from = int(rng.integers(1, 40))
+        lat = 30.2672 + float(rng.normal(0, 0.08))
+        lon = -97.7431 + float(rng.normal(0, 0.08))
+        entities.append({
+            'name': f"{' '.join(_choice(rng, WORDS, 2)).title()} {cuisines[0]} {i}",
+            'entity_id': f"BENCH-{seed:04d}-{i:08d}",
+            'type': 'urn:entity',
+            'subtype': 'urn:entity:place',
+            'properties': {
+                'description': ' '.join(_choice(rng, WORDS, int(rng.integers(6, 16)))),
+                'address': f"{int(rng.integers(100, 9999))} {NEIGHBORHOODS[i % len(NEIGHBORHOODS)]} St Austin, TX",
+                'business_rating': round(float(rng.uniform(2.5, 5.0)), 1),
+                'price_range': {'from': price_from, 'to': price_from + int(rng.integers(5, 60)), 'currency': 'usd'},
+                'specialty_dishes': [{'name': d.title()} for d in _choice(rng, DISHES, int(rng.integers(0, 5)))],
+                'good_for': [{'name': g} for g in _choice(rng, GOOD_FOR, int(rng.integers(0, 4)))],
+                'geocode': {'city': 'Austin', 'country_code': 'US'},
+                'keywords': [{'name': w, 'count': int(rng.integers(1, 50))} for w in _choice(rng, WORDS, 8)]
+            },
+            'location': {'lat': lat, 'lon': lon},
+            'tags': tags
+        })
+    return entities
+
+
+def generate_preferences(n_preferences: int, seed: int = 0) -> List[str]:
+    rng = np.random.default_rng(seed + 1)
+    return _choice(rng, CUISINES + DISHES + GOOD_FOR, n_preferences)
+
+
+def generate_interactions(entities: List[Dict[str, Any]], n: int, seed: int = 0) -> List[Dict[str, Any]]:
+    rng = np.random.default_rng(seed + 2)
+    picks = rng.choice(len(entities), size=min(n, len(entities)), replace=False)
+    return [{'entity': entities[i], 'liked': bool(rng.random() < 0.6)} for i in picks]
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is KiB on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def time_stage(fn: Callable[[], Any], repeats: int, items: int, setup: Callable[[], Any] = None) -> Dict[str, Any]:
+    """Run fn repeats times (setup excluded from timing) and summarize latency and throughput"""
+    latencies = []
+    for _ in range(repeats):
+        if setup is not None:
+            setup()
+        start = time.perf_counter()
+        fn()
+        latencies.append(time.perf_counter() - start)
+    latencies_ms = np.array(latencies) * 1000
+    total = float(np.sum(latencies))
+    return {
+        'repeats': repeats,
+        'items': items,
+        'p50_ms': float(np.percentile(latencies_ms, 50)),
+        'p95_ms': float(np.percentile(latencies_ms, 95)),
+        'p99_ms': float(np.percentile(latencies_ms, 99)),
+        'mean_ms': float(np.mean(latencies_ms)),
+        'throughput_items_per_s': items * repeats / total if total else 0.0,
+        'peak_rss_mb': round(peak_rss_mb(), 1)
+    }
+
+
+def scored_candidates(engine, entities: List[Dict[str, Any]], preferences: List[str],
+                      interactions: List[Dict[str, Any]]):
+    """Unit embeddings and blended relevance as MMR sees them; the one place the harness reaches into the engine"""
+    return engine._score_relevance(entities, preferences, interactions)
+
+
+def run_scenario(engine, size: int, n_preferences: int, n_interactions: int, tags_per_entity: int,
+                 repeats: int, stages: List[str], seed: int) -> Dict[str, Any]:
+    entities = generate_entities(size, tags_per_entity=tags_per_entity, seed=seed)
+    preferences = generate_preferences(n_preferences, seed=seed)
+    interactions = generate_interactions(entities, n_interactions, seed=seed) if n_interactions else []
+    features = [engine.extract_entity_features(entity) for entity in entities]
+    cold = engine.clear_caches
+
+    results = {}
+    if 'extract_entity_features' in stages:
+        results['extract_entity_features'] = time_stage(
+            lambda: [engine.extract_entity_features(entity) for entity in entities], repeats, size
+        )
+    if 'feature_store' in stages:
+        from feature_store import EntityFeatureStore
+        results['feature_store'] = time_stage(lambda: EntityFeatureStore(entities), repeats, size)
+    if 'encode' in stages:
+        results['encode'] = time_stage(lambda: engine.encoder.encode(features), repeats, size)
+    if 'calculate_mmr_scores' in stages:
+        results['calculate_mmr_scores'] = time_stage(
+            lambda: engine.calculate_mmr_scores(entities, preferences, entities[:3], 0.7, interactions),
+            repeats, size, setup=cold
+        )
+    if 'diversify_recommendations' in stages:
+        results['diversify_recommendations'] = time_stage(
+            lambda: engine.diversify_recommendations(entities, preferences, interactions=interactions),
+            repeats, size, setup=cold
+        )
+        engine.diversify_recommendations(entities, preferences, interactions=interactions)
+        results['diversify_recommendations_warm'] = time_stage(
+            lambda: engine.diversify_recommendations(entities, preferences, interactions=interactions),
+            repeats, size
+        )
+    if 'analyze_diversity' in stages:
+        results['analyze_diversity'] = time_stage(lambda: engine.analyze_diversity(entities), repeats, size)
+    if 'selection_strategies' in stages:
+        results.update(compare_strategies(engine, entities, preferences, interactions, repeats))
+
+    return {
+        'size': size,
+        'n_preferences': n_preferences,
+        'n_interactions': n_interactions,
+        'tags_per_entity': tags_per_entity,
+        'stages': results
+    }
+
+
+def compare_strategies(engine, entities: List[Dict[str, Any]], preferences: List[str],
+                       interactions: List[Dict[str, Any]], repeats: int, k: int = 8) -> Dict[str, Any]:
+    """Time each selection strategy on the same scored candidates and report what its picks look like"""
+    from diversity_metrics import DiversityColumns
+    from selection_strategies import SELECTION_STRATEGIES, SimilarityMatrix, category_codes, select
+
+    embeddings, relevance = scored_candidates(engine, entities, preferences, interactions)
+    columns = DiversityColumns(entities, embeddings)
+    categories = category_codes(entities)
+    results = {'similarity_matrix': time_stage(lambda: SimilarityMatrix(embeddings).materialize(), repeats, len(entities))}
+    for strategy in SELECTION_STRATEGIES:
+        # A fresh matrix per run, so every strategy pays for the similarity rows it reads
+        run = lambda: select(strategy, SimilarityMatrix(embeddings), relevance, k, categories=categories)
+        stats = time_stage(run, repeats, len(entities))
+        picks = np.array(run(), dtype=np.int64)
+        metrics = columns.summarize(picks)
+        stats.update({
+            'picks': len(picks),
+            'mean_relevance': float(relevance[picks].mean()) if len(picks) else 0.0,
+            'intra_list_diversity': metrics.get('intra_list_diversity'),
+            'cuisine_entropy': metrics.get('cuisine_entropy'),
+            'unique_cuisines': metrics.get('unique_cuisines')
+        })
+        results[f"strategy_{strategy}"] = stats
+    return results
+
+
+def scenario_key(scenario: Dict[str, Any]) -> str:
+    return (f"n={scenario['size']},prefs={scenario['n_preferences']},"
+            f"interactions={scenario['n_interactions']},tags={scenario['tags_per_entity']}")
+
+
+def compare(current: Dict[str, Any], baseline: Dict[str, Any], tolerance: float) -> List[Dict[str, Any]]:
+    """Stages whose p50 grew by more than tolerance (0.2 = 20%) against the baseline run"""
+    previous = {scenario_key(s): s for s in baseline.get('scenarios', [])}
+    regressions = []
+    for scenario in current['scenarios']:
+        before = previous.get(scenario_key(scenario))
+        if before is None:
+            continue
+        for stage, stats in scenario['stages'].items():
+            old = before['stages'].get(stage)
+            if old and old['p50_ms'] > 0 and stats['p50_ms'] > old['p50_ms'] * (1 + tolerance):
+                regressions.append({
+                    'scenario': scenario_key(scenario),
+                    'stage': stage,
+                    'baseline_p50_ms': old['p50_ms'],
+                    'p50_ms': stats['p50_ms'],
+                    'ratio': stats['p50_ms'] / old['p50_ms']
+                })
+    return regressions
+
+
+def environment_info() -> Dict[str, Any]:
+    try:
+        commit = subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], capture_output=True, text=True, timeout=5,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        ).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        commit = None
+    return {
+        'git_commit': commit,
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z')
+    }
+
+
+_STARTUP_SNIPPETS = {
+    'import_engine': "import diversification_engine",
+    'construct_lazy': "from diversification_engine import DiversificationEngine; DiversificationEngine({model!r}, encoder_backend={backend!r})",
+    'analyze_only': (
+        "from diversification_engine import DiversificationEngine; from benchmark_engine import generate_entities; "
+        "DiversificationEngine({model!r}, encoder_backend={backend!r}).analyze_diversity(generate_entities(100))"
+    ),
+    'construct_eager': "from diversification_engine import DiversificationEngine; DiversificationEngine({model!r}, encoder_backend={backend!r}).warm_up()",
+    'first_encode': "from diversification_engine import DiversificationEngine; DiversificationEngine({model!r}, encoder_backend={backend!r}).encoder.encode(['spicy vegetarian'])"
+}
+
+
+def _timed_subprocess(code: str, env: Dict[str, str] = None) -> float:
+    """Wall seconds of a fresh interpreter running code, so nothing is already imported or loaded"""
+    start = time.perf_counter()
+    subprocess.run([sys.executable, '-c', code], check=True, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return time.perf_counter() - start
+
+
+def startup_profile(model_path: str, encoder_backend: str, repeats: int = 3) -> Dict[str, Any]:
+    """Cold-start cost of each way a process can use the engine, plus the VW probe and the slowest imports"""
+    import tempfile
+
+    report: Dict[str, Any] = {'stages': {}}
+    for name, template in _STARTUP_SNIPPETS.items():
+        code = template.format(model=model_path, backend=encoder_backend)
+        seconds = [_timed_subprocess(code) for _ in range(repeats)]
+        report['stages'][name] = {'p50_ms': float(np.percentile(seconds, 50)) * 1000, 'min_ms': min(seconds) * 1000}
+
+    # The first probe writes the cache file, the second reads it; each is timed inside its own fresh process
+    probe = (
+        "import time; from vw_scorer import probe_vw_backends; start = time.perf_counter(); "
+        "probe_vw_backends(); print((time.perf_counter() - start) * 1000)"
+    )
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(os.environ, VW_PROBE_CACHE=os.path.join(tmp, 'vw_probe.json'))
+        report['vw_probe'] = {
+            label: float(subprocess.run([sys.executable, '-c', probe], env=env, capture_output=True, text=True, check=True).stdout)
+            for label in ('cold_ms', 'warm_ms')
+        }
+
+    # -X importtime prints "self | cumulative | module" per import to stderr
+    completed = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', 'import diversification_engine'],
+        capture_output=True, text=True, check=True
+    )
+    imports = []
+    for line in completed.stderr.splitlines():
+        parts = line.split('|')
+        if len(parts) == 3 and parts[1].strip().isdigit():
+            imports.append({'module': parts[2].strip(), 'cumulative_ms': int(parts[1]) / 1000})
+    report['slowest_imports'] = sorted(imports, key=lambda item: -item['cumulative_ms'])[:10]
+    return report
+
+
+STAGES = [
+    'extract_entity_features', 'feature_store', 'encode', 'calculate_mmr_scores', 'diversify_recommendations',
+    'analyze_diversity', 'selection_strategies'
+]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Diversification engine benchmark')
+    parser.add_argument('--model_path', default='./saved_models/all-MiniLM-L6-v2', help='SentenceTransformer model path')
+    parser.add_argument('--encoder_backend', default='torch', choices=list(ENCODER_BACKENDS), help='Encoder backend: torch, onnx or onnx-int8')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 1000], help='Catalogue sizes (100 to 100000)')
+    parser.add_argument('--preference_counts', type=int, nargs='+', default=[3], help='Preferences per user')
+    parser.add_argument('--interaction_counts', type=int, nargs='+', default=[0, 10], help='Interactions per user (0 = none)')
+    parser.add_argument('--tags_per_entity', type=int, nargs='+', default=[12], help='Tags per synthetic entity')
+    parser.add_argument('--stages', nargs='+', default=STAGES, choices=STAGES, help='Stages to time')
+    parser.add_argument('--repeats', type=int, default=5, help='Timed runs per stage')
+    parser.add_argument('--seed', type=int, default=0, help='Catalogue seed')
+    parser.add_argument('--output', help='Write results JSON here (default: stdout)')
+    parser.add_argument('--compare', help='Baseline results JSON to check for regressions')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='Allowed p50 slowdown against the baseline')
+    parser.add_argument('--startup_profile', action='store_true', help='Profile cold-start import, load and probe costs instead')
+    args = parser.parse_args()
+
+    if args.startup_profile:
+        print(json.dumps(startup_profile(args.model_path, args.encoder_backend, args.repeats), indent=2))
+        return
+
+    from diversification_engine import DiversificationEngine
+
+    load_start = time.perf_counter()
+    engine = DiversificationEngine(args.model_path, encoder_backend=args.encoder_backend)
+    engine.warm_up()
+    load_seconds = time.perf_counter() - load_start
+
+    scenarios = []
+    for size in args.sizes:
+        for n_preferences in args.preference_counts:
+            for n_interactions in args.interaction_counts:
+                for tags_per_entity in args.tags_per_entity:
+                    scenario = run_scenario(
+                        engine, size, n_preferences, n_interactions, tags_per_entity,
+                        args.repeats, args.stages, args.seed
+                    )
+                    print(f"{scenario_key(scenario)}: " + ", ".join(
+                        f"{stage} p50={stats['p50_ms']:.1f}ms" for stage, stats in scenario['stages'].items()
+                    ), file=sys.stderr)
+                    scenarios.append(scenario)
+
+    report = {
+        'environment': environment_info(),
+        'engine': {
+            'model_path': args.model_path,
+            'encoder_backend': args.encoder_backend,
+            'load_seconds': load_seconds,
+            'vw_available': engine.vw_available,
+            'vw_backend': engine.vw_scorer.backend
+        },
+        'repeats': args.repeats,
+        'seed': args.seed,
+        'peak_rss_mb': round(peak_rss_mb(), 1),
+        'scenarios': scenarios
+    }
+
+    exit_code = 0
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            report['regressions'] = compare(report, json.load(f), args.tolerance)
+        for regression in report['regressions']:
+            print(f"REGRESSION {regression['scenario']} {regression['stage']}: "
+                  f"{regression['baseline_p50_ms']:.1f}ms -> {regression['p50_ms']:.1f}ms", file=sys.stderr)
+        exit_code = 1 if report['regressions'] else 0
+
+    payload = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(payload)
+    else:
+        print(payload)
+    sys.exit(exit_code)
+
+
+if __name__ == "__main__":
+    main()
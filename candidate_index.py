@@ -0,0 +1,190 @@
+"""Approximate nearest-neighbour candidate pre-filter for MMR.
+
+A CandidateIndex wraps a vector index over unit-normalized entity embeddings
+and returns a shortlist of the M most query-relevant candidates plus a
+stratified sample across cuisine tags, so MMR cost depends on M rather than
+the catalogue size. The default backend is a pure-NumPy IVF (spherical
+k-means coarse quantizer); other backends can be registered by name.
+"""
+import logging
+import time
+from collections import defaultdict
+from typing import Any, Dict, List, Type
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+class ExactIndex:
+    """Exhaustive inner-product search, also the reference for recall reports"""
+
+    def __init__(self, embeddings: np.ndarray, **kwargs):
+        self.embeddings = embeddings
+
+    def search(self, query: np.ndarray, top_m: int) -> np.ndarray:
+        return _top_m(self.embeddings @ query, np.arange(len(self.embeddings)), top_m)
+
+
+class IVFIndex:
+    """Inverted-file index: candidates are scanned only inside the n_probe nearest k-means lists"""
+
+    def __init__(
+        self,
+        embeddings: np.ndarray,
+        n_lists: int = None,
+        n_probe: int = None,
+        n_iter: int = 10,
+        train_size: int = 20000,
+        seed: int = 0
+    ):
+        self.embeddings = embeddings
+        n = len(embeddings)
+        rng = np.random.default_rng(seed)
+        sample = embeddings[rng.choice(n, size=min(n, train_size), replace=False)]
+        self.n_lists = max(1, min(len(sample), n_lists or int(np.sqrt(n))))
+        self.n_probe = max(1, min(self.n_lists, n_probe or max(1, self.n_lists // 8)))
+
+        centroids = sample[rng.choice(len(sample), size=self.n_lists, replace=False)].copy()
+        for _ in range(n_iter):
+            assignment = self._assign(sample, centroids)
+            sums = np.zeros_like(centroids)
+            np.add.at(sums, assignment, sample)
+            counts = np.bincount(assignment, minlength=self.n_lists)
+            # Empty lists keep their previous centroid
+            moved = counts > 0
+            centroids[moved] = _unit(sums[moved])
+        self.centroids = centroids
+
+        assignment = self._assign(embeddings, centroids)
+        order = np.argsort(assignment, kind='stable')
+        self.list_members = np.split(order, np.cumsum(np.bincount(assignment, minlength=self.n_lists))[:-1])
+
+    @staticmethod
+    def _assign(points: np.ndarray, centroids: np.ndarray, block: int = 8192) -> np.ndarray:
+        return np.concatenate([
+            np.argmax(points[start:start + block] @ centroids.T, axis=1)
+            for start in range(0, len(points), block)
+        ]) if len(points) else np.zeros(0, dtype=np.int64)
+
+    def search(self, query: np.ndarray, top_m: int, n_probe: int = None) -> np.ndarray:
+        centroid_order = np.argsort(-(self.centroids @ query))
+        n_probe = n_probe or self.n_probe
+        # Keep probing until the lists hold at least top_m candidates
+        members = []
+        found = 0
+        for rank, list_id in enumerate(centroid_order):
+            if rank >= n_probe and found >= top_m:
+                break
+            members.append(self.list_members[list_id])
+            found += len(self.list_members[list_id])
+        candidates = np.concatenate(members)
+        return _top_m(self.embeddings[candidates] @ query, candidates, top_m)
+
+
+INDEX_BACKENDS: Dict[str, Type] = {'ivf': IVFIndex, 'exact': ExactIndex}
+
+
+def register_index_backend(name: str, backend: Type):
+    """Backends take (embeddings, **options) and expose search(query, top_m) -> positions"""
+    INDEX_BACKENDS[name] = backend
+
+
+def _unit(matrix: np.ndarray) -> np.ndarray:
+    return matrix / np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), 1e-12)
+
+
+def _top_m(scores: np.ndarray, positions: np.ndarray, top_m: int) -> np.ndarray:
+    if top_m < len(scores):
+        keep = np.argpartition(-scores, top_m - 1)[:top_m]
+        scores, positions = scores[keep], positions[keep]
+    return positions[np.argsort(-scores, kind='stable')]
+
+
+def primary_cuisine(entity: Dict[str, Any]) -> str:
+    """First cuisine/category tag, the same tag types analyze_diversity counts"""
+    for tag in entity.get('tags', []):
+        tag_type = tag.get('type', '')
+        if 'cuisine' in tag_type or 'category' in tag_type:
+            return tag.get('name', '')
+    return ''
+
+
+class CandidateIndex:
+    def __init__(
+        self,
+        embeddings: np.ndarray,
+        categories: List[str],
+        backend: str = 'ivf',
+        seed: int = 0,
+        **backend_options
+    ):
+        self.embeddings = embeddings
+        self.seed = seed
+        start = time.perf_counter()
+        self.index = INDEX_BACKENDS[backend](embeddings, **backend_options)
+        self.backend = backend
+        self.build_seconds = time.perf_counter() - start
+
+        by_category = defaultdict(list)
+        for position, category in enumerate(categories):
+            by_category[category].append(position)
+        self.strata = [np.array(members) for _, members in sorted(by_category.items())]
+        logger.info(f"Built {backend} candidate index over {len(embeddings)} entities in {self.build_seconds:.3f}s")
+
+    def __len__(self) -> int:
+        return len(self.embeddings)
+
+    def shortlist(self, query: np.ndarray, top_m: int, diversity_fraction: float = 0.2) -> np.ndarray:
+        """Positions of the top relevant candidates plus a stratified sample across cuisines, M in total"""
+        top_m = min(top_m, len(self))
+        n_diverse = int(top_m * diversity_fraction)
+        relevant = self.index.search(query, top_m - n_diverse)
+        if n_diverse == 0:
+            return relevant
+
+        # Round-robin over cuisine strata so rare cuisines still reach MMR
+        taken = set(relevant.tolist())
+        rng = np.random.default_rng(self.seed)
+        shuffled = [rng.permutation(members) for members in self.strata]
+        cursors = [0] * len(shuffled)
+        diverse = []
+        while len(diverse) < n_diverse:
+            progressed = False
+            for s, members in enumerate(shuffled):
+                while cursors[s] < len(members) and int(members[cursors[s]]) in taken:
+                    cursors[s] += 1
+                if cursors[s] < len(members):
+                    position = int(members[cursors[s]])
+                    taken.add(position)
+                    diverse.append(position)
+                    progressed = True
+                    if len(diverse) == n_diverse:
+                        break
+            if not progressed:
+                break
+        return np.concatenate([relevant, np.array(diverse, dtype=relevant.dtype)])
+
+    def recall_report(self, queries: np.ndarray, top_m: int) -> Dict[str, Any]:
+        """Recall@M of the backend against exhaustive search, with per-query latency for both"""
+        exact = ExactIndex(self.embeddings)
+        recalls, approx_ms, exact_ms = [], [], []
+        for query in queries:
+            start = time.perf_counter()
+            approx = self.index.search(query, top_m)
+            approx_ms.append((time.perf_counter() - start) * 1000)
+            start = time.perf_counter()
+            reference = exact.search(query, top_m)
+            exact_ms.append((time.perf_counter() - start) * 1000)
+            recalls.append(len(set(approx.tolist()) & set(reference.tolist())) / max(1, len(reference)))
+        return {
+            'backend': self.backend,
+            'catalogue_size': len(self),
+            'top_m': top_m,
+            'queries': len(recalls),
+            'mean_recall': float(np.mean(recalls)) if recalls else 0.0,
+            'min_recall': float(np.min(recalls)) if recalls else 0.0,
+            'approx_ms_mean': float(np.mean(approx_ms)) if approx_ms else 0.0,
+            'exact_ms_mean': float(np.mean(exact_ms)) if exact_ms else 0.0,
+            'build_seconds': round(self.build_seconds, 4)
+        }
@@ -1,169 +1,288 @@
 import json
 import numpy as np
-from sentence_transformers import SentenceTransformer
-from sklearn.metrics.pairwise import cosine_similarity
 import os
 import argparse
-from typing import List, Dict, Any, Tuple
+from typing import List, Dict, Any, Optional, Tuple
 import logging
 import tempfile
-import subprocess
 import hashlib
+import pickle
 import re
 import shutil
+import sys
+import threading
+import time
+from collections import OrderedDict
+
+from candidate_index import CandidateIndex, primary_cuisine
+from diversity_metrics import DiversityColumns, DiversityTracker
+from embedding_cache import EmbeddingCache
+from encoder_backends import ENCODER_BACKENDS, load_encoder
+from encode_batcher import EncodeBatcher
+from entity_loader import load_entity_store
+from feature_store import EntityFeatureStore, entity_feature_text
+from geo_index import GeoIndex
+from pipeline_metrics import PipelineMetrics, count, current_trace, stage
+from result_cache import ResultCache, result_cache_key
+from selection_strategies import SELECTION_STRATEGIES, SimilarityMatrix, category_codes, select
+from vw_scorer import BackgroundTrainer, UserModelStore, VWModel, VWScorer, normalize_vw_scores
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+def _catalogue_fields(entity: Dict[str, Any]) -> tuple:
+    """What feature texts, VW features, primary cuisines and locations are built from"""
+    properties = entity.get('properties') or {}
+    if not isinstance(properties, dict):
+        properties = {}
+    return (
+        entity.get('entity_id'), entity.get('name'), entity.get('type'), entity.get('description'),
+        entity.get('geohash'), entity.get('location'), entity.get('tags'),
+        properties.get('description'), properties.get('address'), properties.get('business_rating'),
+        properties.get('price_range'), properties.get('specialty_dishes'), properties.get('good_for')
+    )
+
+def _normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    return matrix / np.maximum(norms, 1e-12)
+
 class DiversificationEngine:
-    def __init__(self, model_path: str = "./saved_models/all-MiniLM-L6-v2"):
+    def __init__(
+        self,
+        model_path: str = "./saved_models/all-MiniLM-L6-v2",
+        embedding_cache_size: int = 50000,
+        embedding_cache_dir: str = None,
+        max_user_models: int = None,
+        user_model_ttl: float = 3600.0,
+        encode_batch_size: int = None,
+        encode_max_wait_ms: float = 5.0,
+        result_cache_size: int = 1024,
+        result_cache_ttl: float = 600.0,
+        result_cache_path: str = None,
+        encoder_backend: str = 'torch',
+        vw_training: str = 'sync',
+        vw_train_debounce_ms: float = 2000.0,
+        vw_model_dir: str = None
+    ):
         if not os.path.exists(model_path):
             raise FileNotFoundError(f"SentenceTransformer model not found at: {model_path}")
-        self.model = SentenceTransformer(model_path)
-        self.vw_model_path = "/tmp/user_preference_model.vw"
+        # The encoder and its heavy imports load on first encode, see the encoder property
+        self.model_path = model_path
+        self.encoder_backend = encoder_backend
+        self._encoder = None
+        self._encoder_lock = threading.Lock()
+        # Backends produce slightly different vectors, so they must not share cache entries
+        self.model_name = os.path.basename(os.path.normpath(model_path))
+        if encoder_backend != 'torch':
+            self.model_name = f"{self.model_name}@{encoder_backend}"
+        # Concurrent callers (server mode) can share forward passes through a micro-batcher
+        self.encode_batcher = (
+            EncodeBatcher(self._model_encode, max_batch_size=encode_batch_size, max_wait_ms=encode_max_wait_ms)
+            if encode_batch_size else None
+        )
+        self.embedding_cache = EmbeddingCache(
+            self.model_name, max_entries=embedding_cache_size, disk_dir=embedding_cache_dir
+        )
+        # Identical requests (same chips over the same candidates) reuse a whole result
+        self.result_cache = (
+            ResultCache(result_cache_size, ttl_seconds=result_cache_ttl, sqlite_path=result_cache_path)
+            if result_cache_size else None
+        )
         self.vw_temp_dir = tempfile.mkdtemp()
+        self.vw_scorer = VWScorer(self.vw_temp_dir)
+        self._candidate_indexes: "OrderedDict[str, CandidateIndex]" = OrderedDict()
+        self._geo_indexes: "OrderedDict[str, GeoIndex]" = OrderedDict()
+        self._feature_stores: "OrderedDict[str, EntityFeatureStore]" = OrderedDict()
+        self._fingerprints: "OrderedDict[int, Tuple[List[Dict[str, Any]], int, str]]" = OrderedDict()
+        self._candidate_index_lock = threading.Lock()
+        # max_user_models None sizes the model caps by memory, about VW_MODEL_MB per resident model
+        self.user_models = UserModelStore(self.vw_scorer, max_users=max_user_models, ttl_seconds=user_model_ttl)
+        # 'async' never trains a user's model on the request path: requests score with the last snapshot, or fall back until one exists
+        if vw_training not in ('sync', 'async'):
+            raise ValueError(f"Unknown VW training mode: {vw_training} (choose sync or async)")
+        self.vw_trainer = (
+            BackgroundTrainer(
+                self.vw_scorer,
+                debounce_seconds=vw_train_debounce_ms / 1000.0,
+                model_dir=vw_model_dir,
+                max_keys=max_user_models
+            )
+            if vw_training == 'async' else None
+        )
+        # Stage timings and counters of every traced request, for the server's /metrics
+        self.metrics = PipelineMetrics()
         
-        self.vw_available = self._check_vw_availability()
-        
-        logger.info(f"Loaded SentenceTransformer model from disk: {model_path}")
         logger.info(f"VW temp directory: {self.vw_temp_dir}")
-        logger.info(f"VW available: {self.vw_available}")
     
-    def _check_vw_availability(self) -> bool:
-        try:
-            result = subprocess.run(['vw', '--version'], 
-                                  capture_output=True, 
-                                  text=True, 
-                                  timeout=5)
-            return result.returncode == 0
-        except (subprocess.CalledProcessError, FileNotFoundError, subprocess.TimeoutExpired):
-            logger.warning("Vowpal Wabbit (vw) not found. Falling back to embedding-only recommendations.")
-            return False
-    
-    def _vectorize_entity_for_vw(self, entity: Dict[str, Any]) -> str:
+    @property
+    def encoder(self):
+        """Sentence encoder backend, loaded on first use so paths that never encode skip the model import"""
+        if self._encoder is None:
+            with self._encoder_lock:
+                if self._encoder is None:
+                    start = time.perf_counter()
+                    self._encoder = load_encoder(self.encoder_backend, self.model_path)
+                    logger.info(f"Loaded SentenceTransformer model from disk: {self.model_path} (backend: {self.encoder_backend}, {time.perf_counter() - start:.2f}s)")
+        return self._encoder
+    
+    @property
+    def vw_available(self) -> bool:
+        # Probed on first access, with the result cached on disk across runs
+        return self.vw_scorer.available
+    
+    def warm_up(self):
+        """Load the encoder and probe VW now rather than on the first request"""
+        self.encoder
+        self.vw_scorer.backend
+    
+    def _vw_context(self, user_preferences: List[str]) -> str:
+        # Using preferences as context
+        context_features = []
+        for pref in user_preferences:
+            clean_pref = re.sub(r'[^a-zA-Z0-9]', '_', pref.lower())
+            context_features.append(f"pref_{clean_pref}")
+        return " ".join(context_features)
+    
+    def _vectorize_entity_for_vw(self, entity: Dict[str, Any], embedding: np.ndarray = None) -> str:
         """Convert entity to VW feature format with feature engineering"""
         if not self.vw_available:
             return ""
-            
-        features = []
-        
-        # Basic features
-        name = entity.get('name', '').lower()
-        features.append(f"name_len:{len(name)}")
         
         # Embeddings like cuisines' features
-        entity_text = self.extract_entity_features(entity)
-        embedding = self.model.encode([entity_text])[0]
-        
-        # Quantizing embeddings into buckets for VW
-        for i, val in enumerate(embedding[:50]):
-            bucket = int(val * 10)  # Quantized to -10 to 10 range
-            features.append(f"emb_{i}:{bucket}")
-        
-        # Tags being categorical features
-        tags = entity.get('tags', [])
-        for tag in tags:
-            tag_name = re.sub(r'[^a-zA-Z0-9]', '_', tag.get('name', ''))
-            tag_type = re.sub(r'[^a-zA-Z0-9]', '_', tag.get('type', ''))
-            features.append(f"tag_{tag_type}_{tag_name}")
-        
-        # Price and rating buckets
-        props = entity.get('properties', {})
-        rating = props.get('business_rating', 0)
-        if rating > 0:
-            rating_bucket = min(int(rating), 5)
-            features.append(f"rating_bucket:{rating_bucket}")
-        
-        price_range = props.get('price_range', {})
-        if price_range:
-            avg_price = (price_range.get('from', 0) + price_range.get('to', 0)) / 2
-            price_bucket = min(int(avg_price / 10), 10)
-            features.append(f"price_bucket:{price_bucket}")
-        
-        return " ".join(features)
-    
-    def _train_vw_model(self, interactions: List[Dict], user_preferences: List[str]):
+        if embedding is None:
+            embedding = self._encode_entities([entity])[0]
+        return EntityFeatureStore([entity]).vw_features(np.asarray(embedding)[None, :])[0]
+    
+    def _vw_training_lines(self, interactions: List[Dict], user_preferences: List[str]) -> List[str]:
+        if not interactions:
+            return []
+        context_str = self._vw_context(user_preferences)
+        interaction_entities = [interaction.get('entity', {}) for interaction in interactions]
+        store = EntityFeatureStore(interaction_entities)
+        embeddings = self._encode_entities(interaction_entities, store.feature_texts)
+        
+        training_lines = []
+        for interaction, entity_features in zip(interactions, store.vw_features(embeddings)):
+            reward = 1.0 if interaction.get('liked', False) else -0.5
+            # VW format: [reward] |context [context_features] |entity [entity_features]
+            training_lines.append(f"{reward} |context {context_str} |entity {entity_features}")
+        return training_lines
+    
+    def _train_vw_model(self, interactions: List[Dict], user_preferences: List[str]) -> Optional[VWModel]:
         """Train VW model on user interactions with creative contextual bandits"""
         if not self.vw_available:
             logger.info("VW not available, skipping model training")
-            return False
-            
-        training_file = f"{self.vw_temp_dir}/training.vw"
-        
-        with open(training_file, 'w') as f:
-            for interaction in interactions:
-                entity = interaction.get('entity', {})
-                reward = 1.0 if interaction.get('liked', False) else -0.5
-                
-                # Using preferences as context
-                context_features = []
-                for pref in user_preferences:
-                    clean_pref = re.sub(r'[^a-zA-Z0-9]', '_', pref.lower())
-                    context_features.append(f"pref_{clean_pref}")
-                
-                entity_features = self._vectorize_entity_for_vw(entity)
-                context_str = " ".join(context_features)
-                
-                # VW format: [reward] |context [context_features] |entity [entity_features]
-                vw_line = f"{reward} |context {context_str} |entity {entity_features}\n"
-                f.write(vw_line)
-        
-        # Train VW model with hyperparameters
-        cmd = [
-            "vw", 
-            training_file,
-            "--final_regressor", self.vw_model_path,
-            "--loss_function", "squared",
-            "--learning_rate", "0.1",
-            "--l2", "0.001",
-            "--interactions", "ce",  # context-entity interactions
-            "--quiet"
-        ]
+            return None
         
-        try:
-            subprocess.run(cmd, check=True, capture_output=True, timeout=30)
+        model = self.vw_scorer.train(self._vw_training_lines(interactions, user_preferences))
+        if model is not None:
             logger.info("VW model trained successfully")
-            return True
-        except (subprocess.CalledProcessError, subprocess.TimeoutExpired) as e:
-            logger.warning(f"VW training failed: {e}")
-            return False
+        return model
     
-    def _predict_vw_score(self, entity: Dict[str, Any], user_preferences: List[str]) -> float:
-        """Get VW prediction for entity"""
-        if not self.vw_available or not os.path.exists(self.vw_model_path):
-            return 0.5  # Default score between MMR (0) and VW (1)
-        
-        test_file = f"{self.vw_temp_dir}/test.vw"
-        pred_file = f"{self.vw_temp_dir}/predictions.txt"
-        
-        # test instance
-        context_features = []
-        for pref in user_preferences:
-            clean_pref = re.sub(r'[^a-zA-Z0-9]', '_', pref.lower())
-            context_features.append(f"pref_{clean_pref}")
-        
-        entity_features = self._vectorize_entity_for_vw(entity)
-        context_str = " ".join(context_features)
-        
-        with open(test_file, 'w') as f:
-            f.write(f"|context {context_str} |entity {entity_features}\n")
-        
-        # Get prediction
-        cmd = [
-            "vw", 
-            test_file,
-            "--initial_regressor", self.vw_model_path,
-            "--predictions", pred_file,
-            "--quiet"
+    def _predict_vw_scores(
+        self,
+        model: VWModel,
+        feature_store: EntityFeatureStore,
+        user_preferences: List[str],
+        embeddings: np.ndarray
+    ) -> np.ndarray:
+        """Get VW predictions for all candidates in one pass, normalized to 0-1"""
+        context_str = self._vw_context(user_preferences)
+        test_lines = [
+            f"|context {context_str} |entity {entity_features}"
+            for entity_features in feature_store.vw_features(embeddings)
         ]
-        
+        count('vw_predictions', len(test_lines))
         try:
-            subprocess.run(cmd, check=True, capture_output=True, timeout=10)
-            with open(pred_file, 'r') as f:
-                score = float(f.read().strip())
-            return max(0, min(1, (score + 1) / 2))  # Normalize to 0-1
-        except:
-            return 0.5
+            return normalize_vw_scores(model.predict(test_lines))
+        except Exception as e:
+            logger.warning(f"VW prediction failed: {e}")
+            return np.full(len(feature_store), 0.5)  # Default score between MMR (0) and VW (1)
+    
+    def _vw_relevance_scores(
+        self,
+        feature_store: EntityFeatureStore,
+        user_preferences: List[str],
+        interactions: List[Dict],
+        embeddings: np.ndarray,
+        user_id: str = None
+    ) -> Optional[np.ndarray]:
+        """VW scores for all candidates, or None when no model could be trained"""
+        if not user_id:
+            # Anonymous requests get a throwaway model trained on the full history; nobody would read a snapshot of it
+            vw_model = self._train_vw_model(interactions, user_preferences)
+            if vw_model is None:
+                return None
+            try:
+                return self._predict_vw_scores(vw_model, feature_store, user_preferences, embeddings)
+            finally:
+                vw_model.close()
+        
+        if self.vw_trainer is not None:
+            return self._snapshot_vw_scores(feature_store, user_preferences, interactions, embeddings, user_id)
+        
+        with self.user_models.lease(
+            str(user_id),
+            self._vw_context(user_preferences),
+            self._interaction_keys(interactions),
+            lambda start: self._vw_training_lines(interactions[start:], user_preferences)
+        ) as vw_model:
+            if vw_model is None:
+                return None
+            return self._predict_vw_scores(vw_model, feature_store, user_preferences, embeddings)
+    
+    def _interaction_keys(self, interactions: List[Dict]) -> List[str]:
+        return [
+            f"{interaction.get('entity', {}).get('entity_id') or interaction.get('entity', {}).get('name', '')}\t{bool(interaction.get('liked', False))}"
+            for interaction in interactions
+        ]
+    
+    def _snapshot_vw_scores(
+        self,
+        feature_store: EntityFeatureStore,
+        user_preferences: List[str],
+        interactions: List[Dict],
+        embeddings: np.ndarray,
+        user_id: str
+    ) -> Optional[np.ndarray]:
+        """Scores from the user's last published model while a retrain on the latest history is scheduled, never awaited"""
+        interaction_keys = self._interaction_keys(interactions)
+        key = str(user_id)
+        # Copied so later mutation by the caller cannot change what the worker trains on
+        interactions = list(interactions)
+        context = self._vw_context(user_preferences)
+        with self.vw_trainer.lease(key) as snapshot:
+            self.vw_trainer.schedule(
+                key,
+                context,
+                interaction_keys,
+                lambda start: self._vw_training_lines(interactions[start:], user_preferences)
+            )
+            if snapshot is None:
+                count('vw_snapshot_misses')
+                return None
+            count('vw_snapshot_hits')
+            # Scores from an older history are served, but must not be cached under this one
+            if not snapshot.covers(context, interaction_keys):
+                count('vw_snapshot_stale')
+            return self._predict_vw_scores(snapshot.model, feature_store, user_preferences, embeddings)
+    
+    def finish_background_training(self, timeout: float = None) -> bool:
+        """Run any debounced VW retraining now (e.g. before a one-shot process exits)"""
+        if self.vw_trainer is None:
+            return True
+        return self.vw_trainer.drain(timeout)
+    
+    def clear_caches(self):
+        """Drop cached embeddings, results and every per-catalogue fingerprint, feature store and index"""
+        self.embedding_cache.clear()
+        if self.result_cache is not None:
+            self.result_cache.clear()
+        with self._candidate_index_lock:
+            self._fingerprints.clear()
+            self._feature_stores.clear()
+            self._candidate_indexes.clear()
+            self._geo_indexes.clear()
     
     def _fallback_preference_scoring(self, entity: Dict[str, Any], user_preferences: List[str]) -> float:
         """Fallback scoring when VW is not available"""
@@ -195,51 +314,228 @@ class DiversificationEngine:
         return min(1.0, jaccard_score + tag_boost)
     
     def extract_entity_features(self, entity: Dict[str, Any]) -> str:
-        features = []
-        
-        name = entity.get('name', '')
-        features.append(name)
+        """Text the encoder embeds for one entity; catalogues are compiled once through feature_store_for"""
+        return entity_feature_text(entity)
+    
+    def feature_store_for(self, entities: List[Dict[str, Any]], fingerprint: str = None) -> EntityFeatureStore:
+        """Compiled features of a candidate list, cached per catalogue like the indexes"""
+        with stage('feature_store'):
+            return self._cached_index(self._feature_stores, entities, EntityFeatureStore, fingerprint)
+    
+    def _model_encode(self, texts: List[str]) -> np.ndarray:
+        batch_size = max(32, self.encode_batcher.max_batch_size) if self.encode_batcher else 32
+        return self.encoder.encode(texts, batch_size=batch_size)
+    
+    def _encode(self, texts: List[str]) -> np.ndarray:
+        """Single entry point to the sentence encoder, always returning a float32 matrix"""
+        count('encode_calls')
+        count('encoded_texts', len(texts))
+        with stage('encode'):
+            if self.encode_batcher is not None:
+                return self.encode_batcher.encode(texts)
+            return self._model_encode(texts)
+    
+    def _encode_entities(self, entities: List[Dict[str, Any]], entity_features: List[str] = None) -> np.ndarray:
+        """Entity embeddings through the content-addressed cache, encoding only unseen (entity_id, text) pairs"""
+        if entity_features is None:
+            entity_features = [self.extract_entity_features(entity) for entity in entities]
+        entity_ids = [entity.get('entity_id', '') for entity in entities]
+        misses = []
+        
+        def encode_misses(texts: List[str]) -> np.ndarray:
+            misses.append(len(texts))
+            return self._encode(texts)
+        
+        with stage('embed_entities'):
+            embeddings = self.embedding_cache.get_or_encode(entity_ids, entity_features, encode_misses)
+        count('embedding_cache_hits', len(entities) - sum(misses))
+        count('embedding_cache_misses', sum(misses))
+        return embeddings
+    
+    def _score_relevance(
+        self,
+        entities: List[Dict[str, Any]],
+        user_preferences: List[str],
+        interactions: List[Dict] = None,
+        user_id: str = None,
+        feature_store: EntityFeatureStore = None
+    ) -> Tuple[np.ndarray, np.ndarray]:
+        """Embed candidates and query once; returns unit-normalized entity embeddings and blended relevance"""
+        feature_store = feature_store or self.feature_store_for(entities)
+        user_query = ' '.join(user_preferences)
         
-        description = (
-            entity.get('properties', {}).get('description', '') or 
-            entity.get('description', '')
+        # Generate embeddings
+        raw_embeddings = self._encode_entities(entities, feature_store.feature_texts)
+        entity_embeddings = _normalize_rows(raw_embeddings)
+        with stage('embed_query'):
+            user_embedding = _normalize_rows(self._encode([user_query]))
+        
+        relevance = self._blend_relevance(
+            entities, feature_store, raw_embeddings, entity_embeddings, user_embedding[0],
+            user_preferences, interactions, user_id
         )
-        features.append(description)
         
-        tags = entity.get('tags', [])
-        if tags:
-            cuisine_tags = [
-                tag.get('name', '') for tag in tags 
-                if 'cuisine' in tag.get('type', '') or 'category' in tag.get('type', '')
-            ]
-            features.extend(cuisine_tags)
-            
-            amenity_tags = [
-                tag.get('name', '') for tag in tags 
-                if 'amenity' in tag.get('type', '') or 'offerings' in tag.get('type', '')
-            ]
-            features.extend(amenity_tags)
-        
-        properties = entity.get('properties', {})
-        specialty_dishes = properties.get('specialty_dishes', [])
-        if specialty_dishes:
-            dish_names = [dish.get('name', '') for dish in specialty_dishes]
-            features.extend(dish_names)
-        
-        good_for = properties.get('good_for', [])
-        if good_for:
-            good_for_tags = [item.get('name', '') for item in good_for]
-            features.extend(good_for_tags)
-        
-        address = properties.get('address', '')
-        if address:
-            features.append(address)
-        
-        entity_type = entity.get('type', '')
-        if entity_type:
-            features.append(entity_type)
-        
-        return ' '.join(filter(None, features))
+        return entity_embeddings, relevance
+    
+    def _blend_relevance(
+        self,
+        entities: List[Dict[str, Any]],
+        feature_store: EntityFeatureStore,
+        raw_embeddings: np.ndarray,
+        entity_embeddings: np.ndarray,
+        user_embedding: np.ndarray,
+        user_preferences: List[str],
+        interactions: List[Dict] = None,
+        user_id: str = None
+    ) -> np.ndarray:
+        """Embedding similarity blended with VW or fallback preference scores; embeddings and features come from the caller"""
+        # Calculate relevance scores
+        base_relevance = (entity_embeddings @ user_embedding).astype(np.float64)
+        
+        # Enhanced with VW predictions / scoring
+        vw_scores = None
+        if self.vw_available and interactions and len(interactions) > 2:
+            with stage('vw_scoring'):
+                vw_scores = self._vw_relevance_scores(feature_store, user_preferences, interactions, raw_embeddings, user_id)
+        
+        if vw_scores is not None:
+            # Blending embedding similarity with personalized VW score
+            relevance = 0.6 * base_relevance + 0.4 * vw_scores
+            # Guarded so the per-entity f-strings are not built when debug logging is off
+            for i, entity in enumerate(entities if logger.isEnabledFor(logging.DEBUG) else []):
+                logger.debug(f"Entity {entity.get('name', '')}: base={base_relevance[i]:.3f}, vw={vw_scores[i]:.3f}, blended={relevance[i]:.3f}")
+        else:
+            # Fallback preference scoring, vectorized over the whole pool
+            with stage('fallback_scoring'):
+                fallback_scores = feature_store.term_index.score(user_preferences)
+            relevance = 0.7 * base_relevance + 0.3 * fallback_scores
+            for i, entity in enumerate(entities if logger.isEnabledFor(logging.DEBUG) else []):
+                logger.debug(f"Entity {entity.get('name', '')}: base={base_relevance[i]:.3f}, fallback={fallback_scores[i]:.3f}, blended={relevance[i]:.3f}")
+        
+        return relevance
+    
+    def build_candidate_index(
+        self,
+        entities: List[Dict[str, Any]],
+        backend: str = 'ivf',
+        **backend_options
+    ) -> CandidateIndex:
+        """Vector index over the cached entity embeddings of a catalogue, positions matching entities"""
+        embeddings = _normalize_rows(self._encode_entities(entities, self.feature_store_for(entities).feature_texts))
+        categories = [primary_cuisine(entity) for entity in entities]
+        return CandidateIndex(embeddings, categories, backend=backend, **backend_options)
+    
+    def _catalogue_fingerprint(self, entities: List[Dict[str, Any]]) -> str:
+        """Content hash of every field the per-catalogue caches read, so edited entities under unchanged ids get fresh ones.
+        
+        Memoized per list object, so a catalogue held across calls (batch, benchmarks, a loaded file) is hashed
+        once; a list must not be edited in place after it has been scored.
+        """
+        with self._candidate_index_lock:
+            memo = self._fingerprints.get(id(entities))
+            # The memo holds the list itself, so its id cannot be reused by another list while it is cached
+            if memo is not None and memo[0] is entities and memo[1] == len(entities):
+                self._fingerprints.move_to_end(id(entities))
+                return memo[2]
+        with stage('catalogue_fingerprint'):
+            fingerprint = hashlib.sha1(pickle.dumps(
+                [_catalogue_fields(entity) for entity in entities], protocol=pickle.HIGHEST_PROTOCOL
+            )).hexdigest()
+        with self._candidate_index_lock:
+            self._fingerprints[id(entities)] = (entities, len(entities), fingerprint)
+            while len(self._fingerprints) > 4:
+                self._fingerprints.popitem(last=False)
+        return fingerprint
+    
+    def _cached_index(self, cache: OrderedDict, entities: List[Dict[str, Any]], build, fingerprint: str = None):
+        # Server mode sees the same city catalogue repeatedly, so indexes are kept per catalogue
+        fingerprint = fingerprint or self._catalogue_fingerprint(entities)
+        with self._candidate_index_lock:
+            index = cache.get(fingerprint)
+            if index is not None:
+                cache.move_to_end(fingerprint)
+                return index
+        index = build(entities)
+        with self._candidate_index_lock:
+            cache[fingerprint] = index
+            while len(cache) > 4:
+                cache.popitem(last=False)
+        return index
+    
+    def _candidate_index_for(self, entities: List[Dict[str, Any]], fingerprint: str = None) -> CandidateIndex:
+        return self._cached_index(self._candidate_indexes, entities, self.build_candidate_index, fingerprint)
+    
+    def _cached_feature_store(self, entities: List[Dict[str, Any]], fingerprint: str = None) -> Optional[EntityFeatureStore]:
+        fingerprint = fingerprint or self._catalogue_fingerprint(entities)
+        with self._candidate_index_lock:
+            return self._feature_stores.get(fingerprint)
+    
+    def geo_index_for(self, entities: List[Dict[str, Any]]) -> GeoIndex:
+        """Spatial index over a catalogue's entity locations, cached like the candidate index"""
+        return self._cached_index(self._geo_indexes, entities, GeoIndex)
+    
+    def nearby_entities(
+        self,
+        entities: List[Dict[str, Any]],
+        lat: float,
+        lon: float,
+        k: int = 10,
+        radius_km: float = None,
+        geo_index: GeoIndex = None
+    ) -> List[Dict[str, Any]]:
+        """k nearest entities to a point (e.g. photo GPS), each with its distance_km"""
+        index = geo_index or self.geo_index_for(entities)
+        return [
+            {'entity': entities[position], 'distance_km': distance}
+            for position, distance in index.query(lat, lon, k, radius_km)
+        ]
+    
+    def _geo_filter(
+        self,
+        entities: List[Dict[str, Any]],
+        near: Tuple[float, float],
+        radius_km: float,
+        geo_index: GeoIndex = None
+    ) -> np.ndarray:
+        """Sorted positions of the entities within radius_km of near"""
+        with stage('geo_filter'):
+            index = geo_index or self.geo_index_for(entities)
+            if index.size != len(entities):
+                raise ValueError(f"Geo index covers {index.size} entities but {len(entities)} were given")
+            kept = index.within(near[0], near[1], radius_km)
+        logger.info(f"Geo pre-filter kept {len(kept)} of {len(entities)} entities within {radius_km}km")
+        return kept
+    
+    def _prefilter_candidates(
+        self,
+        entities: List[Dict[str, Any]],
+        user_preferences: List[str],
+        top_m: int,
+        candidate_index: CandidateIndex = None,
+        fingerprint: str = None
+    ) -> np.ndarray:
+        """Sorted positions of the top_m shortlist"""
+        with stage('candidate_prefilter'):
+            index = candidate_index or self._candidate_index_for(entities, fingerprint)
+            if len(index) != len(entities):
+                raise ValueError(f"Candidate index covers {len(index)} entities but {len(entities)} were given")
+            query = _normalize_rows(self._encode([' '.join(user_preferences)]))[0]
+            # Original order keeps MMR tie-breaking identical to an exhaustive run
+            shortlist = np.sort(index.shortlist(query, top_m))
+        logger.info(f"Candidate pre-filter kept {len(shortlist)} of {len(entities)} entities")
+        return shortlist
+    
+    def candidate_recall_report(
+        self,
+        entities: List[Dict[str, Any]],
+        preference_sets: List[List[str]],
+        top_m: int,
+        candidate_index: CandidateIndex = None
+    ) -> Dict[str, Any]:
+        """Recall of the candidate index against exhaustive search for the given preference sets"""
+        index = candidate_index or self._candidate_index_for(entities)
+        queries = _normalize_rows(self._encode([' '.join(prefs) for prefs in preference_sets]))
+        return index.recall_report(queries, top_m)
     
     def calculate_mmr_scores(
         self, 
@@ -247,59 +543,22 @@ class DiversificationEngine:
         user_preferences: List[str],
         selected_entities: List[Dict[str, Any]] = None,
         lambda_param: float = 0.7,
-        interactions: List[Dict] = None
+        interactions: List[Dict] = None,
+        user_id: str = None
     ) -> List[Tuple[int, float]]:
         """Enhanced MMR with VW predictions or fallback scoring"""
-        if selected_entities is None:
-            selected_entities = []
-        
-        # Train VW model
-        vw_trained = False
-        if self.vw_available and interactions and len(interactions) > 2:
-            vw_trained = self._train_vw_model(interactions, user_preferences)
-        
-        entity_features = [self.extract_entity_features(entity) for entity in entities]
-        user_query = ' '.join(user_preferences)
-        
-        # Generate embeddings
-        entity_embeddings = self.model.encode(entity_features)
-        user_embedding = self.model.encode([user_query])
-        
-        # Calculate relevance scores
-        base_relevance = cosine_similarity(entity_embeddings, user_embedding).flatten()
-        
-        mmr_scores = []
-        
-        for i, entity in enumerate(entities):
-            # Base relevance from embeddings
-            relevance = base_relevance[i]
-            
-            # Enhanced with VW predictions / scoring
-            if vw_trained:
-                vw_score = self._predict_vw_score(entity, user_preferences)
-                # Blending embedding similarity with personalized VW score
-                relevance = 0.6 * relevance + 0.4 * vw_score
-                logger.debug(f"Entity {entity.get('name', '')}: base={base_relevance[i]:.3f}, vw={vw_score:.3f}, blended={relevance:.3f}")
-            else:
-                # Fallback preference scoring
-                fallback_score = self._fallback_preference_scoring(entity, user_preferences)
-                relevance = 0.7 * relevance + 0.3 * fallback_score
-                logger.debug(f"Entity {entity.get('name', '')}: base={base_relevance[i]:.3f}, fallback={fallback_score:.3f}, blended={relevance:.3f}")
-            
-            # Diversity penalty
-            if selected_entities:
-                selected_features = [self.extract_entity_features(sel) for sel in selected_entities]
-                selected_embeddings = self.model.encode(selected_features)
-                similarities = cosine_similarity([entity_embeddings[i]], selected_embeddings).flatten()
-                max_similarity = np.max(similarities) if similarities.size > 0 else 0
-            else:
-                max_similarity = 0
-            
-            # MMR formula
-            mmr_score = lambda_param * relevance - (1 - lambda_param) * max_similarity
-            mmr_scores.append((i, mmr_score))
-        
-        return mmr_scores
+        entity_embeddings, relevance = self._score_relevance(entities, user_preferences, interactions, user_id)
+        
+        # Diversity penalty, with the selected set encoded once rather than per candidate
+        if selected_entities:
+            selected_embeddings = _normalize_rows(self._encode_entities(selected_entities))
+            max_similarity = (entity_embeddings @ selected_embeddings.T).max(axis=1)
+        else:
+            max_similarity = np.zeros(len(entities))
+        
+        # MMR formula
+        mmr_scores = lambda_param * relevance - (1 - lambda_param) * max_similarity
+        return [(i, float(score)) for i, score in enumerate(mmr_scores)]
     
     def diversify_recommendations(
         self,
@@ -308,84 +567,110 @@ class DiversificationEngine:
         n_total: int = 8,
         n_high_affinity: int = 3,
         lambda_param: float = 0.7,
-        interactions: List[Dict] = None
+        interactions: List[Dict] = None,
+        user_id: str = None,
+        candidate_top_m: int = None,
+        candidate_index: CandidateIndex = None,
+        near: Tuple[float, float] = None,
+        radius_km: float = None,
+        geo_index: GeoIndex = None,
+        diversity_weight: float = 0.0,
+        diversity_target: str = 'cuisine_entropy',
+        selection_strategy: str = 'two_phase',
+        diversify_by: str = 'primary_cuisine',
+        diversify_take: int = 2,
+        return_scores: bool = False
     ) -> List[Dict[str, Any]]:
-        """Diversification: Instead of always returning top-n by affinity or similarity: Use Maximum Marginal Relevance (MMR) & VW to diversify recommendations. Like picking 3 high-affinity entities + 2 serendipitous ones from new cuisines."""
+        """Diversification: Instead of always returning top-n by affinity or similarity: Use Maximum Marginal Relevance (MMR) & VW to diversify recommendations. Like picking 3 high-affinity entities + 2 serendipitous ones from new cuisines.
+        
+        selection_strategy picks the top-k scheme (see selection_strategies.py); diversify_by and
+        diversify_take configure category_quota. With return_scores, returns (entities, blended
+        relevance of each pick) instead.
+        """
         if not entities:
-            return []
+            return ([], []) if return_scores else []
         
         enhancement_type = "VW" if self.vw_available else "fallback"
         logger.info(f"Diversifying {len(entities)} entities with {enhancement_type} enhancement (interactions: {len(interactions) if interactions else 0})")
         
-        selected = []
-        remaining = entities.copy()
+        # Optional radius filter around a point, e.g. the GPS of an uploaded photo
+        if near is not None and radius_km is not None:
+            entities = [entities[i] for i in self._geo_filter(entities, near, radius_km, geo_index)]
+            # A caller-supplied candidate index covers the unfiltered catalogue
+            candidate_index = None
+            if not entities:
+                return ([], []) if return_scores else []
+        
+        # Optional retrieval stage: only a top-M shortlist goes through MMR
+        feature_store = None
+        if candidate_top_m and len(entities) > candidate_top_m:
+            # Hashed once for both catalogue cache lookups
+            fingerprint = self._catalogue_fingerprint(entities) if candidate_index is None else None
+            shortlist = self._prefilter_candidates(entities, user_preferences, candidate_top_m, candidate_index, fingerprint)
+            # Building the candidate index compiled the catalogue's features; the shortlist reuses their rows
+            catalogue_store = self._cached_feature_store(entities, fingerprint)
+            feature_store = catalogue_store.take(shortlist) if catalogue_store is not None else None
+            entities = [entities[i] for i in shortlist]
+        
+        entity_embeddings, relevance = self._score_relevance(
+            entities, user_preferences, interactions, user_id, feature_store=feature_store
+        )
         
-        # Phase 1: High-affinity items
-        for _ in range(min(n_high_affinity, len(remaining))):
-            mmr_scores = self.calculate_mmr_scores(
-                remaining, user_preferences, selected, lambda_param, interactions
-            )
-            mmr_scores.sort(key=lambda x: x[1], reverse=True)
-            if mmr_scores:
-                best_idx = mmr_scores[0][0]
-                selected.append(remaining.pop(best_idx))
-        
-        # Phase 2: Diversity focused items
-        diversity_lambda = 0.3
-        while len(selected) < min(n_total, len(entities)) and remaining:
-            mmr_scores = self.calculate_mmr_scores(
-                remaining, user_preferences, selected, diversity_lambda, interactions
+        picks = self._select_picks(
+            entities, entity_embeddings, relevance, n_total, n_high_affinity, lambda_param,
+            diversity_weight, diversity_target, selection_strategy=selection_strategy,
+            diversify_by=diversify_by, diversify_take=diversify_take
+        )
+        if return_scores:
+            return [entities[i] for i in picks], [float(relevance[i]) for i in picks]
+        return [entities[i] for i in picks]
+    
+    def _select_picks(
+        self,
+        entities: List[Dict[str, Any]],
+        entity_embeddings: np.ndarray,
+        relevance: np.ndarray,
+        n_total: int = 8,
+        n_high_affinity: int = 3,
+        lambda_param: float = 0.7,
+        diversity_weight: float = 0.0,
+        diversity_target: str = 'cuisine_entropy',
+        diversity_columns: DiversityColumns = None,
+        selection_strategy: str = 'two_phase',
+        diversify_by: str = 'primary_cuisine',
+        diversify_take: int = 2,
+        categories: np.ndarray = None
+    ) -> List[int]:
+        with stage('mmr_select'):
+            # Optionally optimise directly against a diversity metric as items are picked
+            tracker = None
+            if diversity_weight:
+                columns = diversity_columns or DiversityColumns(entities, entity_embeddings)
+                tracker = DiversityTracker(columns, diversity_target)
+            return select(
+                selection_strategy,
+                SimilarityMatrix(entity_embeddings),
+                relevance,
+                n_total,
+                n_high_affinity=n_high_affinity,
+                lambda_param=lambda_param,
+                tracker=tracker,
+                diversity_weight=diversity_weight,
+                categories=(
+                    categories if categories is not None or selection_strategy != 'category_quota'
+                    else category_codes(entities, diversify_by)
+                ),
+                diversify_take=diversify_take
             )
-            mmr_scores.sort(key=lambda x: x[1], reverse=True)
-            if mmr_scores:
-                best_idx = mmr_scores[0][0]
-                selected.append(remaining.pop(best_idx))
-            else:
-                break
-        return selected
-    
-    def analyze_diversity(self, entities: List[Dict[str, Any]]) -> Dict[str, Any]:
+    
+    def analyze_diversity(self, entities: List[Dict[str, Any]], embeddings: np.ndarray = None) -> Dict[str, Any]:
+        """Cuisine, type, price and rating spread, cuisine entropy/Gini and geo spread; intra-list diversity when embeddings are given"""
         if not entities:
             return {}
         
-        cuisines = set()
-        price_ranges = []
-        ratings = []
-        entity_types = set()
-        
-        for entity in entities:
-            tags = entity.get('tags', [])
-            for tag in tags:
-                tag_type = tag.get('type', '')
-                if 'cuisine' in tag_type or 'category' in tag_type:
-                    cuisines.add(tag.get('name', ''))
-            
-            entity_type = entity.get('type', '')
-            if entity_type:
-                entity_types.add(entity_type)
-            
-            properties = entity.get('properties', {})
-            price_range = properties.get('price_range', {})
-            if price_range and isinstance(price_range, dict):
-                price_from = price_range.get('from', 0)
-                price_to = price_range.get('to', 0)
-                if price_from or price_to:
-                    price_ranges.append((price_from + price_to) / 2)
-            
-            rating = properties.get('business_rating', 0)
-            if rating and rating > 0:
-                ratings.append(rating)
-        
-        return {
-            'unique_cuisines': len(cuisines),
-            'cuisine_types': list(cuisines),
-            'unique_entity_types': len(entity_types),
-            'entity_types': list(entity_types),
-            'price_range_std': np.std(price_ranges) if price_ranges else 0,
-            'rating_range': (min(ratings), max(ratings)) if ratings else (0, 0),
-            'avg_rating': np.mean(ratings) if ratings else 0,
-            'total_entities': len(entities)
-        }
+        # Never encodes: analyze-only runs must not pay for loading the model
+        with stage('analyze_diversity'):
+            return DiversityColumns(entities, embeddings).summarize()
 
 def load_data(file_path: str) -> List[Dict[str, Any]]:
     try:
@@ -408,6 +693,153 @@ def load_data(file_path: str) -> List[Dict[str, Any]]:
         logger.error(f"Error loading data from {file_path}: {e}")
         return []
 
+def diversification_parameters(
+    n_total: int = 8,
+    n_high_affinity: int = 3,
+    lambda_param: float = 0.7,
+    candidate_top_m: int = None,
+    near: Tuple[float, float] = None,
+    radius_km: float = None,
+    diversity_weight: float = 0.0,
+    diversity_target: str = 'cuisine_entropy',
+    selection_strategy: str = 'two_phase',
+    diversify_by: str = 'primary_cuisine',
+    diversify_take: int = 2
+) -> Dict[str, Any]:
+    return {
+        'n_total': n_total,
+        'n_high_affinity': n_high_affinity,
+        'lambda_param': lambda_param,
+        'candidate_top_m': candidate_top_m,
+        'near': list(near) if near is not None else None,
+        'radius_km': radius_km,
+        'diversity_weight': diversity_weight,
+        'diversity_target': diversity_target,
+        'selection_strategy': selection_strategy,
+        'diversify_by': diversify_by,
+        'diversify_take': diversify_take
+    }
+
+def diversification_results(
+    engine: DiversificationEngine,
+    entities: List[Dict[str, Any]],
+    diversified: List[Dict[str, Any]],
+    scores: List[float],
+    diversity_metrics: Dict[str, Any],
+    interactions: List[Dict],
+    parameters: Dict[str, Any]
+) -> Dict[str, Any]:
+    """The results payload of one request, shared by the CLI, server and batch modes"""
+    return {
+        'diversified_recommendations': diversified,
+        'scores': [round(float(score), 6) for score in scores],
+        'diversity_metrics': diversity_metrics,
+        'total_original': len(entities),
+        'total_selected': len(diversified),
+        'vw_enhanced': engine.vw_available and len(interactions) > 0,
+        'enhancement_type': 'vw' if engine.vw_available else 'fallback',
+        'parameters': parameters
+    }
+
+def run_diversification(
+    engine: DiversificationEngine,
+    entities: List[Dict[str, Any]],
+    user_preferences: List[str],
+    interactions: List[Dict] = None,
+    n_total: int = 8,
+    n_high_affinity: int = 3,
+    lambda_param: float = 0.7,
+    user_id: str = None,
+    candidate_top_m: int = None,
+    near: Tuple[float, float] = None,
+    radius_km: float = None,
+    diversity_weight: float = 0.0,
+    diversity_target: str = 'cuisine_entropy',
+    trace_id: str = None,
+    selection_strategy: str = 'two_phase',
+    diversify_by: str = 'primary_cuisine',
+    diversify_take: int = 2
+) -> Dict[str, Any]:
+    """Diversify and analyze one request, returning the results payload shared by the CLI and server mode.
+    
+    The payload's metadata block carries the request's trace id, per-stage timings and counters.
+    """
+    interactions = interactions or []
+    parameters = diversification_parameters(
+        n_total, n_high_affinity, lambda_param, candidate_top_m, near, radius_km,
+        diversity_weight, diversity_target, selection_strategy, diversify_by, diversify_take
+    )
+    
+    with engine.metrics.trace(trace_id) as trace:
+        results = _traced_diversification(
+            engine, entities, user_preferences, interactions, parameters, user_id, near, radius_km
+        )
+    # Added after caching, so a hit reports its own (cheap) trace rather than the original's
+    results['metadata'] = trace.as_dict()
+    return results
+
+def _traced_diversification(
+    engine: DiversificationEngine,
+    entities: List[Dict[str, Any]],
+    user_preferences: List[str],
+    interactions: List[Dict],
+    parameters: Dict[str, Any],
+    user_id: str = None,
+    near: Tuple[float, float] = None,
+    radius_km: float = None
+) -> Dict[str, Any]:
+    cache = engine.result_cache
+    if cache is not None:
+        with stage('result_cache_lookup'):
+            cache_key = result_cache_key(
+                engine._catalogue_fingerprint(entities), user_preferences, parameters,
+                f"{engine.model_name}:{engine.vw_scorer.backend}", interactions
+            )
+            cached = cache.get(cache_key)
+        if cached is not None:
+            count('result_cache_hits')
+            # Picks are cached as positions, so a hit returns the caller's own entity dicts
+            cached['diversified_recommendations'] = [entities[i] for i in cached.pop('positions')]
+            cached['result_cache'] = {'hit': True, **cache.stats()}
+            return cached
+        count('result_cache_misses')
+    
+    diversified, scores = engine.diversify_recommendations(
+        entities=entities,
+        user_preferences=user_preferences,
+        n_total=parameters['n_total'],
+        n_high_affinity=parameters['n_high_affinity'],
+        lambda_param=parameters['lambda_param'],
+        interactions=interactions,
+        user_id=user_id,
+        candidate_top_m=parameters['candidate_top_m'],
+        near=near,
+        radius_km=radius_km,
+        diversity_weight=parameters['diversity_weight'],
+        diversity_target=parameters['diversity_target'],
+        selection_strategy=parameters['selection_strategy'],
+        diversify_by=parameters['diversify_by'],
+        diversify_take=parameters['diversify_take'],
+        return_scores=True
+    )
+    
+    # The selected entities were just scored, so their embeddings are cache hits
+    diversity_metrics = engine.analyze_diversity(
+        diversified, engine._encode_entities(diversified) if diversified else None
+    )
+    
+    results = diversification_results(engine, entities, diversified, scores, diversity_metrics, interactions, parameters)
+    if cache is not None:
+        # A fallback or stale-snapshot result served while the user's VW model retrains must not outlive the retrain
+        counters = current_trace().counters
+        if not counters.get('vw_snapshot_misses') and not counters.get('vw_snapshot_stale'):
+            position_of = {id(entity): i for i, entity in enumerate(entities)}
+            cached = {key: value for key, value in results.items() if key != 'diversified_recommendations'}
+            cached['positions'] = [position_of[id(entity)] for entity in diversified]
+            cache.put(cache_key, cached)
+        results['result_cache'] = {'hit': False, **cache.stats()}
+    return results
+
 def main():
     parser = argparse.ArgumentParser(description='Smart Diversification Engine with VW Enhancement')
     parser.add_argument('--input', required=True, help='Input JSON file path')
@@ -417,14 +849,43 @@ def main():
     parser.add_argument('--n_total', type=int, default=8, help='Total number of recommendations')
     parser.add_argument('--n_high_affinity', type=int, default=3, help='Number of high-affinity items')
     parser.add_argument('--lambda_param', type=float, default=0.7, help='MMR lambda parameter')
+    parser.add_argument('--candidate_top_m', type=int, help='Shortlist size for the ANN candidate pre-filter (default: all candidates)')
+    parser.add_argument('--candidate_recall_report', action='store_true', help='Log recall of the candidate pre-filter against exhaustive search')
+    parser.add_argument('--near_lat', type=float, help='Latitude for the radius pre-filter (e.g. from extract_gps.py)')
+    parser.add_argument('--near_lon', type=float, help='Longitude for the radius pre-filter')
+    parser.add_argument('--radius_km', type=float, help='Only diversify entities within this many km of --near_lat/--near_lon')
+    parser.add_argument('--diversity_weight', type=float, default=0.0, help='Weight of the per-pick diversity gain added to MMR scores')
+    parser.add_argument('--diversity_target', default='cuisine_entropy', choices=DiversityTracker.TARGETS, help='Metric the diversity gain optimises')
+    parser.add_argument('--selection_strategy', default='two_phase', choices=list(SELECTION_STRATEGIES), help='Top-k selection scheme over the scored candidates')
+    parser.add_argument('--diversify_by', default='primary_cuisine', help='Category for category_quota: primary_cuisine or a dotted field path such as properties.geocode.city')
+    parser.add_argument('--diversify_take', type=int, default=2, help='Max picks per category for category_quota')
+    parser.add_argument('--user_id', help='User id for the per-user preference model')
+    parser.add_argument('--embedding_cache_dir', help='Directory for the persistent entity embedding cache')
+    parser.add_argument('--encoder_backend', default='torch', choices=list(ENCODER_BACKENDS), help='Sentence encoder backend: float torch, ONNX Runtime or int8-quantized ONNX')
+    parser.add_argument('--result_cache_path', help='SQLite file shared by processes for whole-request result caching')
+    parser.add_argument('--result_cache_ttl', type=float, default=600.0, help='Seconds a cached result stays valid')
+    parser.add_argument('--trace_id', help='Trace id reported in the results metadata (default: random)')
+    parser.add_argument('--vw_training', default='sync', choices=['sync', 'async'], help='async scores with the last VW snapshot and trains after responding')
+    parser.add_argument('--vw_model_dir', help='Directory where async VW snapshots are published for later runs')
     
     args = parser.parse_args()
     
     # initialize engine (will check VW availability automatically)
-    engine = DiversificationEngine()
+    engine = DiversificationEngine(
+        embedding_cache_dir=args.embedding_cache_dir,
+        result_cache_path=args.result_cache_path,
+        result_cache_ttl=args.result_cache_ttl,
+        encoder_backend=args.encoder_backend,
+        vw_training=args.vw_training,
+        vw_model_dir=args.vw_model_dir
+    )
+    if args.vw_training == 'async' and not args.vw_model_dir:
+        logger.warning("--vw_training async without --vw_model_dir: snapshots trained by this run are discarded at exit")
     
-    # Load entities
-    entities = load_data(args.input)
+    # Stream entities, keeping only the fields the engine scores on and any field category_quota groups by
+    keep_paths = (args.diversify_by,) if args.selection_strategy == 'category_quota' and args.diversify_by != 'primary_cuisine' else ()
+    store = load_entity_store(args.input, keep_paths=keep_paths)
+    entities = store.entities
     if not entities:
         logger.error("No entities loaded")
         return
@@ -444,46 +905,53 @@ def main():
         except json.JSONDecodeError:
             logger.warning("Invalid interactions JSON, proceeding without")
     
-    # Run diversification
-    diversified = engine.diversify_recommendations(
+    results = run_diversification(
+        engine,
         entities=entities,
         user_preferences=user_preferences,
+        interactions=interactions,
         n_total=args.n_total,
         n_high_affinity=args.n_high_affinity,
         lambda_param=args.lambda_param,
-        interactions=interactions
+        user_id=args.user_id,
+        candidate_top_m=args.candidate_top_m,
+        near=(args.near_lat, args.near_lon) if args.near_lat is not None and args.near_lon is not None else None,
+        radius_km=args.radius_km,
+        diversity_weight=args.diversity_weight,
+        diversity_target=args.diversity_target,
+        trace_id=args.trace_id,
+        selection_strategy=args.selection_strategy,
+        diversify_by=args.diversify_by,
+        diversify_take=args.diversify_take
     )
     
-    # Analyze diversity
-    diversity_metrics = engine.analyze_diversity(diversified)
+    if args.candidate_recall_report and args.candidate_top_m:
+        report = engine.candidate_recall_report(entities, [user_preferences], args.candidate_top_m)
+        logger.info(f"Candidate pre-filter recall: {json.dumps(report)}")
     
-    # Results
-    results = {
-        'diversified_recommendations': diversified,
-        'diversity_metrics': diversity_metrics,
-        'total_original': len(entities),
-        'total_selected': len(diversified),
-        'vw_enhanced': engine.vw_available and len(interactions) > 0,
-        'enhancement_type': 'vw' if engine.vw_available else 'fallback',
-        'parameters': {
-            'n_total': args.n_total,
-            'n_high_affinity': args.n_high_affinity,
-            'lambda_param': args.lambda_param
-        }
-    }
+    # Full records for the selected entities are re-read from the input by byte offset
+    results['diversified_recommendations'] = store.full_records(results['diversified_recommendations'])
     
     with open(args.output, 'w', encoding='utf-8') as f:
-        json.dump(results, f, indent=2, ensure_ascii=False)
+        json.dump(results, f, ensure_ascii=False, separators=(',', ':'))
     
     logger.info(f"Diversified results saved to {args.output}")
+    logger.info(f"Embedding cache: {engine.embedding_cache.stats()}")
     print(json.dumps({
         'success': True,
-        'total_original': len(entities),
-        'total_selected': len(diversified),
-        'diversity_score': diversity_metrics.get('unique_cuisines', 0),
-        'vw_enhanced': engine.vw_available and len(interactions) > 0,
-        'enhancement_type': 'vw' if engine.vw_available else 'fallback'
+        'total_original': results['total_original'],
+        'total_selected': results['total_selected'],
+        'diversity_score': results['diversity_metrics'].get('unique_cuisines', 0),
+        'vw_enhanced': results['vw_enhanced'],
+        'enhancement_type': results['enhancement_type'],
+        'result_cache_hit': results.get('result_cache', {}).get('hit', False),
+        'trace': results['metadata']
     }))
+    
+    # The caller can read the output now; a one-shot run trains the next VW snapshot before exiting
+    sys.stdout.flush()
+    if not engine.finish_background_training(timeout=25.0):
+        logger.warning("Background VW training did not finish before exit")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
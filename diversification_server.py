@@ -0,0 +1,520 @@
+"""Long-lived server mode for the diversification engine.
+
+Keeps one warm DiversificationEngine in memory so requests stop paying for
+interpreter startup, model loading and the VW probe. Serves either HTTP
+(POST /diversify, POST /analyze, POST /nearby, GET /healthz, GET /readyz,
+GET /metrics in Prometheus text format) or a stdio JSON-lines protocol where
+each line is a request object with an optional "id" and an "op" of diversify,
+analyze, nearby, health, ready or metrics. A diversify request's traceId (or
+the X-Trace-Id header) is echoed in the results metadata with stage timings.
+
+--frames serves the same request objects as length-prefixed JSON or
+MessagePack frames over stdin/stdout, and --socket over a Unix socket (see
+wire_protocol.py). Framed diversify replies are compact by default: selected
+entity ids, positions and scores instead of the entities themselves. Any
+diversify request can ask for that shape with "compact": true.
+"""
+import argparse
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, List, Optional, Tuple
+
+from diversification_engine import DiversificationEngine, run_diversification
+from encoder_backends import ENCODER_BACKENDS
+from wire_protocol import FrameError, compact_results, decode_body, encode_frame, read_frame
+
+logger = logging.getLogger(__name__)
+
+
+class ServiceNotReady(RuntimeError):
+    pass
+
+
+class DiversificationService:
+    def __init__(
+        self,
+        model_path: str = "./saved_models/all-MiniLM-L6-v2",
+        embedding_cache_dir: str = None,
+        encode_batch_size: int = 64,
+        encode_max_wait_ms: float = 5.0,
+        result_cache_path: str = None,
+        result_cache_ttl: float = 600.0,
+        encoder_backend: str = 'torch',
+        vw_training: str = 'async',
+        vw_train_debounce_ms: float = 2000.0,
+        vw_model_dir: str = None
+    ):
+        self.model_path = model_path
+        self.vw_training = vw_training
+        self.vw_train_debounce_ms = vw_train_debounce_ms
+        self.vw_model_dir = vw_model_dir
+        self.encoder_backend = encoder_backend
+        self.embedding_cache_dir = embedding_cache_dir
+        self.encode_batch_size = encode_batch_size
+        self.encode_max_wait_ms = encode_max_wait_ms
+        self.result_cache_path = result_cache_path
+        self.result_cache_ttl = result_cache_ttl
+        self.engine = None
+        self.load_error = None
+        self.started_at = time.time()
+        self._ready = threading.Event()
+        self._stats_lock = threading.Lock()
+        self.requests_served = 0
+        self.requests_failed = 0
+        self.inflight = 0
+
+    def start(self, background: bool = True):
+        """Load the engine, optionally on a background thread so health checks answer during warm-up"""
+        if background:
+            threading.Thread(target=self._load_engine, name="engine-loader", daemon=True).start()
+        else:
+            self._load_engine()
+
+    def _load_engine(self):
+        try:
+            self.engine = DiversificationEngine(
+                self.model_path,
+                embedding_cache_dir=self.embedding_cache_dir,
+                encode_batch_size=self.encode_batch_size,
+                encode_max_wait_ms=self.encode_max_wait_ms,
+                result_cache_path=self.result_cache_path,
+                result_cache_ttl=self.result_cache_ttl,
+                encoder_backend=self.encoder_backend,
+                vw_training=self.vw_training,
+                vw_train_debounce_ms=self.vw_train_debounce_ms,
+                vw_model_dir=self.vw_model_dir
+            )
+            # Ready means the model is loaded, not merely that the engine object exists
+            self.engine.warm_up()
+            self._ready.set()
+            logger.info(f"Engine ready after {time.time() - self.started_at:.2f}s")
+        except Exception as e:
+            self.load_error = str(e)
+            logger.error(f"Engine failed to load: {e}")
+
+    @property
+    def ready(self) -> bool:
+        return self._ready.is_set()
+
+    def health(self) -> Dict[str, Any]:
+        return {
+            'status': 'ok' if self.load_error is None else 'error',
+            'uptime_s': round(time.time() - self.started_at, 3),
+            'requests_served': self.requests_served,
+            'requests_failed': self.requests_failed,
+            'inflight': self.inflight,
+            'embedding_cache': self.engine.embedding_cache.stats() if self.engine else None,
+            'user_models': self.engine.user_models.stats() if self.engine else None,
+            'encode_batcher': self.engine.encode_batcher.stats() if self.engine and self.engine.encode_batcher else None,
+            'result_cache': self.engine.result_cache.stats() if self.engine and self.engine.result_cache else None,
+            'vw_trainer': self.engine.vw_trainer.stats() if self.engine and self.engine.vw_trainer else None,
+            'pipeline': self.engine.metrics.stats() if self.engine else None
+        }
+
+    def prometheus_metrics(self) -> str:
+        """Service gauges and counters followed by the engine's per-stage pipeline metrics"""
+        lines = [
+            "# HELP cultour_server_requests_served_total Requests answered successfully.",
+            "# TYPE cultour_server_requests_served_total counter",
+            f"cultour_server_requests_served_total {self.requests_served}",
+            "# HELP cultour_server_requests_failed_total Requests that raised an error.",
+            "# TYPE cultour_server_requests_failed_total counter",
+            f"cultour_server_requests_failed_total {self.requests_failed}",
+            "# HELP cultour_server_inflight_requests Requests being processed right now.",
+            "# TYPE cultour_server_inflight_requests gauge",
+            f"cultour_server_inflight_requests {self.inflight}",
+            "# HELP cultour_server_ready Whether the engine has finished loading.",
+            "# TYPE cultour_server_ready gauge",
+            f"cultour_server_ready {int(self.ready)}"
+        ]
+        text = "\n".join(lines) + "\n"
+        return text + self.engine.metrics.prometheus_text() if self.engine else text
+
+    def readiness(self) -> Dict[str, Any]:
+        return {
+            'ready': self.ready,
+            'error': self.load_error,
+            'vw_available': self.engine.vw_available if self.engine else None
+        }
+
+    def handle(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        """Dispatch one request object and return its JSON-serializable response"""
+        op = request.get('op', 'diversify')
+        if op == 'health':
+            return self.health()
+        if op == 'ready':
+            return self.readiness()
+        if op == 'metrics':
+            return {'pipeline': self.engine.metrics.stats() if self.engine else None}
+        if op not in ('diversify', 'analyze', 'nearby'):
+            raise ValueError(f"Unknown op: {op}")
+        if not self.ready:
+            raise ServiceNotReady(self.load_error or "Engine is still loading")
+
+        with self._stats_lock:
+            self.inflight += 1
+        try:
+            if op == 'diversify':
+                response = self._diversify(request)
+            elif op == 'nearby':
+                response = self._nearby(request)
+            else:
+                response = self._analyze(request)
+            with self._stats_lock:
+                self.requests_served += 1
+            return response
+        except Exception:
+            with self._stats_lock:
+                self.requests_failed += 1
+            raise
+        finally:
+            with self._stats_lock:
+                self.inflight -= 1
+
+    def _diversify(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        entities = _require_list(request, 'entities')
+        # Accept both the route.ts body shape and the CLI argument names
+        user_preferences = request.get('userPreferences', request.get('user_preferences'))
+        if not isinstance(user_preferences, list):
+            raise ValueError("User preferences array is required")
+        interactions = request.get('interactions') or []
+        options = request.get('options') or {}
+        near = options.get('near', request.get('near'))
+        radius_km = options.get('radiusKm', request.get('radius_km'))
+
+        results = run_diversification(
+            self.engine,
+            entities=entities,
+            user_preferences=user_preferences,
+            interactions=interactions,
+            n_total=int(options.get('nTotal', request.get('n_total', 8))),
+            n_high_affinity=int(options.get('nHighAffinity', request.get('n_high_affinity', 3))),
+            lambda_param=float(options.get('lambdaParam', request.get('lambda_param', 0.7))),
+            user_id=request.get('userId', request.get('user_id')),
+            candidate_top_m=_candidate_top_m(options, request),
+            near=_parse_point(near) if near is not None else None,
+            radius_km=float(radius_km) if radius_km is not None else None,
+            diversity_weight=float(options.get('diversityWeight', request.get('diversity_weight', 0.0))),
+            diversity_target=options.get('diversityTarget', request.get('diversity_target', 'cuisine_entropy')),
+            trace_id=request.get('traceId', request.get('trace_id')),
+            selection_strategy=options.get('selectionStrategy', request.get('selection_strategy', 'two_phase')),
+            diversify_by=options.get('diversifyBy', request.get('diversify_by', 'primary_cuisine')),
+            diversify_take=int(options.get('diversifyTake', request.get('diversify_take', 2)))
+        )
+        if request.get('compact'):
+            results = compact_results(results, entities)
+        return {'success': True, 'data': results}
+
+    def _nearby(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        """k nearest entities to a photo's GPS point, so uploads need no extra upstream query"""
+        entities = _require_list(request, 'entities')
+        lat, lon = _parse_point(request)
+        radius_km = request.get('radiusKm', request.get('radius_km'))
+        places = self.engine.nearby_entities(
+            entities,
+            lat,
+            lon,
+            k=int(request.get('k', 10)),
+            radius_km=float(radius_km) if radius_km is not None else None
+        )
+        return {'success': True, 'places': places}
+
+    def _analyze(self, request: Dict[str, Any]) -> Dict[str, Any]:
+        entities = _require_list(request, 'entities')
+        return {'success': True, 'diversity_metrics': self.engine.analyze_diversity(entities)}
+
+
+def _require_list(request: Dict[str, Any], key: str) -> List[Any]:
+    value = request.get(key)
+    if not isinstance(value, list) or not value:
+        raise ValueError(f"{key.capitalize()} array is required")
+    return value
+
+
+def _candidate_top_m(options: Dict[str, Any], request: Dict[str, Any]) -> Optional[int]:
+    """candidateTopM when the request sets it; an explicit null or a non-integer is a client error"""
+    if 'candidateTopM' in options:
+        value = options['candidateTopM']
+    elif 'candidate_top_m' in request:
+        value = request['candidate_top_m']
+    else:
+        return None
+    try:
+        if isinstance(value, bool) or value is None:
+            raise ValueError
+        top_m = int(value)
+    except ValueError:
+        raise ValueError(f"candidateTopM must be a positive integer, got {value!r}") from None
+    if top_m < 1:
+        raise ValueError(f"candidateTopM must be a positive integer, got {value!r}")
+    return top_m
+
+
+def _parse_point(point: Any) -> Tuple[float, float]:
+    """Accept {latitude, longitude} (extract_gps.py output), {lat, lon} or [lat, lon]"""
+    if isinstance(point, dict):
+        lat = point.get('latitude', point.get('lat'))
+        lon = point.get('longitude', point.get('lon'))
+    elif isinstance(point, (list, tuple)) and len(point) == 2:
+        lat, lon = point
+    else:
+        lat = lon = None
+    if lat is None or lon is None:
+        raise ValueError("A point needs latitude and longitude")
+    return float(lat), float(lon)
+
+
+def _error_status(error: Exception) -> int:
+    if isinstance(error, ServiceNotReady):
+        return 503
+    if isinstance(error, (ValueError, TypeError, json.JSONDecodeError, FrameError)):
+        return 400
+    return 500
+
+
+def _to_json(payload: Dict[str, Any]) -> bytes:
+    return json.dumps(payload, ensure_ascii=False, default=_json_default).encode('utf-8')
+
+
+def _json_default(value: Any) -> Any:
+    # NumPy scalars/arrays leak out of the metrics
+    if hasattr(value, 'tolist'):
+        return value.tolist()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def make_http_handler(service: DiversificationService):
+    routes = {'/diversify': 'diversify', '/analyze': 'analyze', '/nearby': 'nearby'}
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path == '/healthz':
+                self._send(200, service.health())
+            elif self.path == '/readyz':
+                readiness = service.readiness()
+                self._send(200 if readiness['ready'] else 503, readiness)
+            elif self.path == '/metrics':
+                body = service.prometheus_metrics().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+            else:
+                self._send(404, {'error': f"Not found: {self.path}"})
+
+        def do_POST(self):
+            op = routes.get(self.path)
+            if op is None:
+                self._send(404, {'error': f"Not found: {self.path}"})
+                return
+            try:
+                length = int(self.headers.get('Content-Length', 0))
+                request = json.loads(self.rfile.read(length) or b'{}')
+                request['op'] = op
+                if self.headers.get('X-Trace-Id') and 'traceId' not in request:
+                    request['traceId'] = self.headers['X-Trace-Id']
+                self._send(200, service.handle(request))
+            except Exception as e:
+                status = _error_status(e)
+                if status == 500:
+                    logger.exception(f"Request to {self.path} failed")
+                self._send(status, {'success': False, 'error': str(e)})
+
+        def _send(self, status: int, payload: Dict[str, Any]):
+            body = _to_json(payload)
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            logger.debug(format % args)
+
+    return Handler
+
+
+def serve_http(service: DiversificationService, host: str, port: int):
+    server = ThreadingHTTPServer((host, port), make_http_handler(service))
+    server.daemon_threads = True
+    logger.info(f"Diversification server listening on http://{host}:{port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+def serve_stdio(service: DiversificationService, max_workers: int, stdin=None, stdout=None):
+    """JSON-lines over stdin/stdout; responses may come back out of order, matched by "id" """
+    stdin = stdin or sys.stdin
+    stdout = stdout or sys.stdout
+    write_lock = threading.Lock()
+
+    def respond(request_id: Any, payload: Dict[str, Any], status: int = 200):
+        payload = dict(payload, id=request_id, status_code=status)
+        line = _to_json(payload).decode('utf-8')
+        with write_lock:
+            stdout.write(line + "\n")
+            stdout.flush()
+
+    def process(line: str):
+        request_id = None
+        try:
+            request = json.loads(line)
+            request_id = request.get('id')
+            respond(request_id, service.handle(request))
+        except Exception as e:
+            status = _error_status(e)
+            if status == 500:
+                logger.exception("stdio request failed")
+            respond(request_id, {'success': False, 'error': str(e)}, status)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        for line in stdin:
+            line = line.strip()
+            if line:
+                pool.submit(process, line)
+
+
+def serve_frames(service: DiversificationService, max_workers: int, read, write):
+    """Length-prefixed request frames in, reply frames out in the request's codec, matched by "id" """
+    write_lock = threading.Lock()
+
+    def respond(request_id: Any, payload: Dict[str, Any], codec: str, status: int = 200):
+        frame = encode_frame(dict(payload, id=request_id, status_code=status), codec)
+        with write_lock:
+            write(frame)
+
+    def process(body: bytes):
+        request_id = None
+        codec = 'json'
+        try:
+            request, codec = decode_body(body)
+            request_id = request.get('id')
+            # Framed clients hold the entities they sent, so only ids and scores come back
+            request.setdefault('compact', True)
+            respond(request_id, service.handle(request), codec)
+        except Exception as e:
+            status = _error_status(e)
+            if status == 500:
+                logger.exception("Framed request failed")
+            respond(request_id, {'success': False, 'error': str(e)}, codec, status)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        while True:
+            try:
+                body = read_frame(read)
+            except FrameError as e:
+                # The stream cannot be resynchronised after a torn frame
+                logger.error(f"Closing framed stream: {e}")
+                break
+            if body is None:
+                break
+            pool.submit(process, body)
+
+
+def serve_framed_stdio(service: DiversificationService, max_workers: int):
+    stdin = sys.stdin.buffer
+    stdout = sys.stdout.buffer
+
+    def read(size: int) -> bytes:
+        chunks = []
+        while size > 0:
+            chunk = stdin.read(size)
+            if not chunk:
+                break
+            chunks.append(chunk)
+            size -= len(chunk)
+        return b''.join(chunks)
+
+    def write(data: bytes):
+        stdout.write(data)
+        stdout.flush()
+
+    serve_frames(service, max_workers, read, write)
+
+
+def serve_socket(service: DiversificationService, path: str, max_workers: int):
+    """The same framing over a Unix socket, one thread per connection"""
+    import socketserver
+
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self):
+            def write(data: bytes):
+                self.wfile.write(data)
+                self.wfile.flush()
+
+            serve_frames(service, max_workers, self.rfile.read, write)
+
+    if os.path.exists(path):
+        os.remove(path)
+    with socketserver.ThreadingUnixStreamServer(path, Handler) as server:
+        server.daemon_threads = True
+        logger.info(f"Diversification server listening on unix:{path}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+
+
+def parse_args(argv: List[str] = None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description='Persistent Diversification Engine server')
+    parser.add_argument('--model_path', default='./saved_models/all-MiniLM-L6-v2', help='SentenceTransformer model path')
+    parser.add_argument('--encoder_backend', default='torch', choices=list(ENCODER_BACKENDS), help='Encoder backend: torch, onnx or onnx-int8')
+    parser.add_argument('--embedding_cache_dir', help='Directory for the persistent entity embedding cache')
+    parser.add_argument('--encode_batch_size', type=int, default=64, help='Max texts per merged encoder batch (0 disables micro-batching)')
+    parser.add_argument('--encode_max_wait_ms', type=float, default=5.0, help='Max time a request waits for others to join its encoder batch')
+    parser.add_argument('--result_cache_path', help='SQLite file so several server processes share cached results')
+    parser.add_argument('--result_cache_ttl', type=float, default=600.0, help='Seconds a cached result stays valid')
+    parser.add_argument('--vw_training', default='async', choices=['sync', 'async'], help='async never trains VW on the request path')
+    parser.add_argument('--vw_train_debounce_ms', type=float, default=2000.0, help='Quiet period after a user\'s last interaction before retraining')
+    parser.add_argument('--vw_model_dir', help='Publish VW snapshots here so restarts and other processes reuse them')
+    parser.add_argument('--stdio', action='store_true', help='Serve JSON-lines over stdin/stdout instead of HTTP')
+    parser.add_argument('--frames', action='store_true', help='Serve length-prefixed JSON/MessagePack frames over stdin/stdout')
+    parser.add_argument('--socket', help='Serve length-prefixed frames on this Unix socket path')
+    parser.add_argument('--host', default='127.0.0.1', help='HTTP bind address')
+    parser.add_argument('--port', type=int, default=8765, help='HTTP port')
+    parser.add_argument('--workers', type=int, default=4, help='Concurrent requests in stdio, frames and socket modes')
+    return parser.parse_args(argv)
+
+
+def main():
+    args = parse_args()
+    service = DiversificationService(
+        args.model_path,
+        embedding_cache_dir=args.embedding_cache_dir,
+        encode_batch_size=args.encode_batch_size,
+        encode_max_wait_ms=args.encode_max_wait_ms,
+        result_cache_path=args.result_cache_path,
+        result_cache_ttl=args.result_cache_ttl,
+        encoder_backend=args.encoder_backend,
+        vw_training=args.vw_training,
+        vw_train_debounce_ms=args.vw_train_debounce_ms,
+        vw_model_dir=args.vw_model_dir
+    )
+    if args.stdio or args.frames:
+        # stdio clients expect the first answer to come from a ready engine
+        service.start(background=False)
+        if args.frames:
+            serve_framed_stdio(service, args.workers)
+        else:
+            serve_stdio(service, args.workers)
+    elif args.socket:
+        service.start(background=True)
+        serve_socket(service, args.socket, args.workers)
+    else:
+        service.start(background=True)
+        serve_http(service, args.host, args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,235 @@
+"""Columnar diversity metrics for result lists.
+
+DiversityColumns pulls the tag, type, price, rating, location and embedding
+fields out of a list of entities once into NumPy arrays; summarize() then
+computes the analyze_diversity metrics for any subset of rows with array
+operations, so offline evaluation can score many result lists against one
+extracted catalogue. DiversityTracker keeps running sums as items are picked,
+which lets greedy MMR add a diversity-gain term without rescanning the list.
+"""
+import logging
+import math
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from candidate_index import primary_cuisine
+from geo_index import EARTH_RADIUS_KM, entity_coordinates
+
+logger = logging.getLogger(__name__)
+
+
+def _codes(labels: List[str], vocabulary: Dict[str, int]) -> np.ndarray:
+    return np.array([vocabulary.setdefault(label, len(vocabulary)) for label in labels], dtype=np.int64)
+
+
+def _entropy(counts: np.ndarray) -> float:
+    """Shannon entropy in bits of a count vector"""
+    total = counts.sum()
+    if total == 0:
+        return 0.0
+    p = counts[counts > 0] / total
+    return float(-(p * np.log2(p)).sum())
+
+
+def _gini_impurity(counts: np.ndarray) -> float:
+    """Gini-Simpson index 1 - sum(p^2): chance two random picks have different cuisines"""
+    total = counts.sum()
+    if total == 0:
+        return 0.0
+    p = counts / total
+    return float(1.0 - (p * p).sum())
+
+
+def _intra_list_diversity(vector_sum: np.ndarray, count: int) -> float:
+    """Mean pairwise cosine distance of unit vectors, from their sum alone"""
+    if count < 2:
+        return 0.0
+    pair_similarity = (float(vector_sum @ vector_sum) - count) / 2
+    return 1.0 - pair_similarity / (count * (count - 1) / 2)
+
+
+def _n_log_n(n: float) -> float:
+    return n * math.log2(n) if n > 0 else 0.0
+
+
+def _unit_xyz(lats: np.ndarray, lons: np.ndarray) -> np.ndarray:
+    lats, lons = np.radians(lats), np.radians(lons)
+    return np.column_stack([np.cos(lats) * np.cos(lons), np.cos(lats) * np.sin(lons), np.sin(lats)])
+
+
+def _geo_spread_km(xyz: np.ndarray) -> float:
+    """Mean great-circle distance from the points' spherical centroid"""
+    if len(xyz) < 2:
+        return 0.0
+    centroid = xyz.sum(axis=0)
+    norm = np.linalg.norm(centroid)
+    if norm < 1e-12:
+        return math.pi / 2 * EARTH_RADIUS_KM
+    return float(np.mean(np.arccos(np.clip(xyz @ (centroid / norm), -1.0, 1.0))) * EARTH_RADIUS_KM)
+
+
+class DiversityColumns:
+    def __init__(self, entities: List[Dict[str, Any]], embeddings: Optional[np.ndarray] = None):
+        n = len(entities)
+        self.size = n
+        self.cuisine_vocabulary: Dict[str, int] = {}
+        self.type_vocabulary: Dict[str, int] = {}
+
+        # All cuisine/category tags per entity as CSR, as analyze_diversity counts them
+        cuisine_indptr = [0]
+        cuisine_labels = []
+        types, primaries = [], []
+        self.prices = np.full(n, np.nan)
+        self.ratings = np.full(n, np.nan)
+        self.lats = np.full(n, np.nan)
+        self.lons = np.full(n, np.nan)
+        for i, entity in enumerate(entities):
+            for tag in entity.get('tags', []):
+                tag_type = tag.get('type', '')
+                if 'cuisine' in tag_type or 'category' in tag_type:
+                    cuisine_labels.append(tag.get('name', ''))
+            cuisine_indptr.append(len(cuisine_labels))
+            types.append(entity.get('type', ''))
+            primaries.append(primary_cuisine(entity))
+
+            properties = entity.get('properties', {})
+            price_range = properties.get('price_range', {})
+            if price_range and isinstance(price_range, dict):
+                price_from = price_range.get('from', 0)
+                price_to = price_range.get('to', 0)
+                if price_from or price_to:
+                    self.prices[i] = (price_from + price_to) / 2
+            rating = properties.get('business_rating', 0)
+            if rating and rating > 0:
+                self.ratings[i] = rating
+
+            coordinates = entity_coordinates(entity)
+            if coordinates is not None:
+                self.lats[i], self.lons[i] = coordinates
+
+        self.cuisine_indptr = np.array(cuisine_indptr, dtype=np.int64)
+        self.cuisine_codes = _codes(cuisine_labels, self.cuisine_vocabulary)
+        self.type_codes = _codes(types, self.type_vocabulary)
+        # Entities without a cuisine tag get -1 and are left out of entropy/Gini
+        self.primary_codes = np.array([
+            self.cuisine_vocabulary.setdefault(label, len(self.cuisine_vocabulary)) if label else -1
+            for label in primaries
+        ], dtype=np.int64)
+        self.cuisine_names = list(self.cuisine_vocabulary)
+        self.type_names = list(self.type_vocabulary)
+        self.has_location = ~np.isnan(self.lats)
+        self.xyz = _unit_xyz(np.nan_to_num(self.lats), np.nan_to_num(self.lons))
+
+        self.embeddings = None
+        if embeddings is not None and len(embeddings):
+            embeddings = np.asarray(embeddings, dtype=np.float64)
+            self.embeddings = embeddings / np.maximum(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12)
+
+    def __len__(self) -> int:
+        return self.size
+
+    def _cuisine_rows(self, rows: np.ndarray) -> np.ndarray:
+        """Cuisine codes of all tags on the given rows, gathered from the CSR arrays without a Python loop"""
+        starts = self.cuisine_indptr[rows]
+        lengths = self.cuisine_indptr[rows + 1] - starts
+        output_starts = np.cumsum(lengths) - lengths
+        positions = np.repeat(starts - output_starts, lengths) + np.arange(lengths.sum())
+        return self.cuisine_codes[positions]
+
+    def summarize(self, rows: Optional[np.ndarray] = None) -> Dict[str, Any]:
+        """analyze_diversity metrics for the given rows (default: all), plus embedding, cuisine-balance and geo metrics"""
+        rows = np.arange(self.size) if rows is None else np.asarray(rows, dtype=np.int64)
+        if not len(rows):
+            return {}
+
+        cuisine_codes = np.unique(self._cuisine_rows(rows))
+        type_codes = np.unique(self.type_codes[rows])
+        entity_types = [self.type_names[c] for c in type_codes if self.type_names[c]]
+        prices = self.prices[rows]
+        prices = prices[~np.isnan(prices)]
+        ratings = self.ratings[rows]
+        ratings = ratings[~np.isnan(ratings)]
+        primary = self.primary_codes[rows]
+        cuisine_counts = np.bincount(primary[primary >= 0], minlength=len(self.cuisine_names))
+        located = rows[self.has_location[rows]]
+
+        metrics = {
+            'unique_cuisines': len(cuisine_codes),
+            'cuisine_types': [self.cuisine_names[c] for c in cuisine_codes],
+            'unique_entity_types': len(entity_types),
+            'entity_types': entity_types,
+            'price_range_std': float(np.std(prices)) if len(prices) else 0,
+            'rating_range': (float(ratings.min()), float(ratings.max())) if len(ratings) else (0, 0),
+            'avg_rating': float(np.mean(ratings)) if len(ratings) else 0,
+            'total_entities': len(rows),
+            'cuisine_entropy': _entropy(cuisine_counts),
+            'cuisine_gini': _gini_impurity(cuisine_counts),
+            'geo_spread_km': _geo_spread_km(self.xyz[located])
+        }
+        if self.embeddings is not None:
+            metrics['intra_list_diversity'] = _intra_list_diversity(self.embeddings[rows].sum(axis=0), len(rows))
+        return metrics
+
+
+class DiversityTracker:
+    """Running diversity state of a growing selection over one DiversityColumns.
+
+    gain() returns, for every row, how much the target metric would change if
+    that row were picked next: 'cuisine_entropy' or 'intra_list_diversity'.
+    """
+
+    TARGETS = ('cuisine_entropy', 'intra_list_diversity')
+
+    def __init__(self, columns: DiversityColumns, target: str = 'cuisine_entropy'):
+        if target not in self.TARGETS:
+            raise ValueError(f"Unknown diversity target: {target}")
+        if target == 'intra_list_diversity' and columns.embeddings is None:
+            raise ValueError("intra_list_diversity needs embedding columns")
+        self.columns = columns
+        self.target = target
+        self.rows: List[int] = []
+        self.cuisine_counts = np.zeros(len(columns.cuisine_names), dtype=np.int64)
+        # sum of n*log2(n) over cuisine counts, so entropy updates in O(1)
+        self._count_log_sum = 0.0
+        self._cuisine_total = 0
+        self.vector_sum = np.zeros(columns.embeddings.shape[1]) if columns.embeddings is not None else None
+
+    def add(self, row: int):
+        self.rows.append(row)
+        code = self.columns.primary_codes[row]
+        if code >= 0:
+            count = self.cuisine_counts[code]
+            self._count_log_sum += _n_log_n(count + 1) - _n_log_n(count)
+            self.cuisine_counts[code] += 1
+            self._cuisine_total += 1
+        if self.vector_sum is not None:
+            self.vector_sum += self.columns.embeddings[row]
+
+    def entropy(self) -> float:
+        total = self._cuisine_total
+        return math.log2(total) - self._count_log_sum / total if total else 0.0
+
+    def gain(self) -> np.ndarray:
+        """Change of the target metric for each row if it were picked next"""
+        if self.target == 'intra_list_diversity':
+            k = len(self.rows)
+            current = _intra_list_diversity(self.vector_sum, k)
+            if k == 0:
+                return np.zeros(self.columns.size)
+            pair_similarity = (float(self.vector_sum @ self.vector_sum) - k) / 2
+            after = 1.0 - (pair_similarity + self.columns.embeddings @ self.vector_sum) / (k * (k + 1) / 2)
+            return after - current
+
+        codes = self.columns.primary_codes
+        total = self._cuisine_total + 1
+        counts = self.cuisine_counts[np.maximum(codes, 0)].astype(np.float64)
+        # (n+1)log(n+1) - n log n, with 0 log 0 = 0
+        delta = (counts + 1) * np.log2(counts + 1) - counts * np.log2(np.maximum(counts, 1))
+        count_log_sum = self._count_log_sum + delta
+        after = np.log2(total) - count_log_sum / total
+        # Rows without a cuisine leave the distribution unchanged
+        return np.where(codes >= 0, after - self.entropy(), 0.0)
+
+    def metrics(self) -> Dict[str, Any]:
+        return self.columns.summarize(np.array(self.rows, dtype=np.int64))
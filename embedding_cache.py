@@ -0,0 +1,224 @@
+"""Content-addressed cache for entity embeddings.
+
+Keys combine the encoder model name, the entity_id and a hash of the feature
+text, so an entity whose description or tags change is simply re-encoded.
+An in-memory LRU tier sits in front of an optional on-disk tier made of a
+memory-mapped float32 matrix plus an append-only index file, which survives
+restarts. The disk tier assumes a single writing process per directory.
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+def embedding_key(model_name: str, entity_id: str, text: str) -> str:
+    text_hash = hashlib.sha1(text.encode('utf-8')).hexdigest()
+    return hashlib.sha1(f"{model_name}\0{entity_id}\0{text_hash}".encode('utf-8')).hexdigest()
+
+
+class _DiskTier:
+    """Memory-mapped float32 matrix (embeddings.f32) addressed by an index of key -> row (index.tsv)"""
+
+    def __init__(self, directory: str, model_name: str):
+        os.makedirs(directory, exist_ok=True)
+        self.matrix_path = os.path.join(directory, 'embeddings.f32')
+        self.index_path = os.path.join(directory, 'index.tsv')
+        self.meta_path = os.path.join(directory, 'meta.json')
+        self.model_name = model_name
+        self.dim = None
+        self.rows: Dict[str, int] = {}
+        self._matrix = None
+        self._capacity = 0
+
+        if os.path.exists(self.meta_path):
+            with open(self.meta_path, 'r', encoding='utf-8') as f:
+                self.dim = json.load(f)['dim']
+            self._open_matrix()
+            self._load_index()
+
+    def _open_matrix(self):
+        size = os.path.getsize(self.matrix_path) if os.path.exists(self.matrix_path) else 0
+        self._capacity = size // (4 * self.dim)
+        self._matrix = (
+            np.memmap(self.matrix_path, dtype=np.float32, mode='r+', shape=(self._capacity, self.dim))
+            if self._capacity else None
+        )
+
+    def _load_index(self):
+        if not os.path.exists(self.index_path):
+            return
+        with open(self.index_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                parts = line.rstrip('\n').split('\t')
+                # Skip a torn last line or rows beyond the matrix after a crash
+                if len(parts) == 2 and parts[1].isdigit() and int(parts[1]) < self._capacity:
+                    self.rows[parts[0]] = int(parts[1])
+
+    def _ensure_capacity(self, needed: int):
+        if needed <= self._capacity:
+            return
+        new_capacity = max(1024, needed, self._capacity * 2)
+        if self._matrix is not None:
+            self._matrix.flush()
+            self._matrix = None
+        with open(self.matrix_path, 'ab') as f:
+            f.truncate(new_capacity * self.dim * 4)
+        self._open_matrix()
+
+    def get(self, key: str) -> Optional[np.ndarray]:
+        row = self.rows.get(key)
+        if row is None:
+            return None
+        return np.array(self._matrix[row])
+
+    def put_many(self, keys: List[str], vectors: np.ndarray):
+        if self.dim is None:
+            self.dim = int(vectors.shape[1])
+            with open(self.meta_path, 'w', encoding='utf-8') as f:
+                json.dump({'dim': self.dim, 'model_name': self.model_name}, f)
+        elif vectors.shape[1] != self.dim:
+            raise ValueError(f"Embedding dim {vectors.shape[1]} does not match disk cache dim {self.dim}")
+
+        new = [(key, vector) for key, vector in zip(keys, vectors) if key not in self.rows]
+        if not new:
+            return
+        start = len(self.rows)
+        self._ensure_capacity(start + len(new))
+        for offset, (_, vector) in enumerate(new):
+            self._matrix[start + offset] = vector
+        # Rows are flushed before the index lines that point at them
+        self._matrix.flush()
+        with open(self.index_path, 'a', encoding='utf-8') as f:
+            for offset, (key, _) in enumerate(new):
+                f.write(f"{key}\t{start + offset}\n")
+                self.rows[key] = start + offset
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+
+class EmbeddingCache:
+    def __init__(self, model_name: str, max_entries: int = 50000, disk_dir: Optional[str] = None):
+        self.model_name = model_name
+        self.max_entries = max_entries
+        self._memory: "OrderedDict[str, np.ndarray]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._disk = None
+        if disk_dir:
+            try:
+                self._disk = _DiskTier(disk_dir, model_name)
+                logger.info(f"Embedding disk cache at {disk_dir} ({len(self._disk)} entries)")
+            except (OSError, ValueError, KeyError) as e:
+                logger.warning(f"Embedding disk cache unavailable ({e}), using memory only")
+
+        self.hits = 0
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.encode_seconds = 0.0
+        self.encoded_texts = 0
+
+    def key(self, entity_id: str, text: str) -> str:
+        return embedding_key(self.model_name, entity_id or '', text)
+
+    def get_many(self, keys: List[str]) -> List[Optional[np.ndarray]]:
+        results = []
+        with self._lock:
+            for key in keys:
+                vector = self._memory.get(key)
+                if vector is not None:
+                    self._memory.move_to_end(key)
+                    self.memory_hits += 1
+                elif self._disk is not None:
+                    vector = self._disk.get(key)
+                    if vector is not None:
+                        self.disk_hits += 1
+                        self._remember(key, vector)
+                if vector is None:
+                    self.misses += 1
+                else:
+                    self.hits += 1
+                results.append(vector)
+        return results
+
+    def put_many(self, keys: List[str], vectors: np.ndarray):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        with self._lock:
+            for key, vector in zip(keys, vectors):
+                self._remember(key, vector.copy())
+            if self._disk is not None:
+                try:
+                    self._disk.put_many(keys, vectors)
+                except (OSError, ValueError) as e:
+                    logger.warning(f"Embedding disk cache write failed ({e}), disabling disk tier")
+                    self._disk = None
+
+    def _remember(self, key: str, vector: np.ndarray):
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+            self.evictions += 1
+
+    def get_or_encode(self, entity_ids: List[str], texts: List[str], encode) -> np.ndarray:
+        """Look up every (entity_id, text) pair and encode only the misses in one batch"""
+        keys = [self.key(entity_id, text) for entity_id, text in zip(entity_ids, texts)]
+        cached = self.get_many(keys)
+        missing = [i for i, vector in enumerate(cached) if vector is None]
+
+        if missing:
+            # Duplicate candidates in one request are encoded once
+            unique_rows: Dict[str, int] = {}
+            for i in missing:
+                unique_rows.setdefault(keys[i], len(unique_rows))
+            unique_texts = [None] * len(unique_rows)
+            for i in missing:
+                unique_texts[unique_rows[keys[i]]] = texts[i]
+
+            start = time.perf_counter()
+            encoded = np.asarray(encode(unique_texts), dtype=np.float32)
+            with self._lock:
+                self.encode_seconds += time.perf_counter() - start
+                self.encoded_texts += len(unique_texts)
+            self.put_many(list(unique_rows), encoded)
+            for i in missing:
+                cached[i] = encoded[unique_rows[keys[i]]]
+
+        if not cached:
+            return np.zeros((0, 0), dtype=np.float32)
+        return np.vstack(cached)
+
+    def clear(self):
+        """Drop the memory tier and counters; the disk tier is left alone"""
+        with self._lock:
+            self._memory.clear()
+            self.hits = self.memory_hits = self.disk_hits = self.misses = self.evictions = 0
+            self.encode_seconds = 0.0
+            self.encoded_texts = 0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            per_text = self.encode_seconds / self.encoded_texts if self.encoded_texts else 0.0
+            return {
+                'hits': self.hits,
+                'memory_hits': self.memory_hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'memory_entries': len(self._memory),
+                'disk_entries': len(self._disk) if self._disk is not None else 0,
+                'encode_seconds': round(self.encode_seconds, 4),
+                'estimated_seconds_saved': round(self.hits * per_text, 4)
+            }
@@ -0,0 +1,152 @@
+"""Micro-batching scheduler in front of the sentence encoder.
+
+Concurrent requests each submit their own small list of feature texts. A
+single worker thread merges whatever is queued, up to max_batch_size texts or
+max_wait_ms after the first request arrives, runs one encode, and scatters the
+rows back to each caller. Queue depth and batch sizes are recorded as
+power-of-two histograms for tuning.
+"""
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, Dict, List, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+
+def _bucket(value: int) -> str:
+    """Power-of-two histogram bucket label: 1, 2, 4, 8, ..."""
+    upper = 1
+    while upper < value:
+        upper *= 2
+    return str(upper)
+
+
+class EncodeBatcher:
+    def __init__(
+        self,
+        encode_fn: Callable[[List[str]], np.ndarray],
+        max_batch_size: int = 64,
+        max_wait_ms: float = 5.0
+    ):
+        self.encode_fn = encode_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self._queue: "queue.Queue[Tuple[List[str], Future]]" = queue.Queue()
+        self._stats_lock = threading.Lock()
+        self.batches = 0
+        self.requests = 0
+        self.texts = 0
+        self.encode_seconds = 0.0
+        self.batch_size_histogram: Dict[str, int] = {}
+        self.requests_per_batch_histogram: Dict[str, int] = {}
+        self.queue_depth_histogram: Dict[str, int] = {}
+        self._dim = None
+        self._closed = False
+        self._worker = threading.Thread(target=self._run, name="encode-batcher", daemon=True)
+        self._worker.start()
+
+    def encode(self, texts: List[str]) -> np.ndarray:
+        """Blocking encode that shares a forward pass with other callers"""
+        if not texts:
+            return np.zeros((0, self._dimension()), dtype=np.float32)
+        if self._closed:
+            raise RuntimeError("EncodeBatcher is closed")
+        future: Future = Future()
+        self._queue.put((list(texts), future))
+        return future.result()
+
+    def _dimension(self) -> int:
+        """Embedding width, from the last batch or one probe encode; some encoders return shape (0,) for no texts"""
+        if self._dim is None:
+            self._dim = int(np.asarray(self.encode_fn([''])).shape[-1])
+        return self._dim
+
+    def _collect(self) -> List[Tuple[List[str], Future]]:
+        first = self._queue.get()
+        if first is None:
+            return []
+        pending = [first]
+        size = len(first[0])
+        deadline = time.monotonic() + self.max_wait
+        while size < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is None:
+                # Close requested: finish this batch, then stop
+                self._queue.put(None)
+                break
+            pending.append(item)
+            size += len(item[0])
+        return pending
+
+    def _run(self):
+        while True:
+            pending = self._collect()
+            if not pending:
+                return
+            # Everything drained into this batch plus whatever queued up behind it
+            depth = len(pending) + self._queue.qsize()
+            texts = [text for request_texts, _ in pending for text in request_texts]
+            start = time.perf_counter()
+            try:
+                embeddings = np.asarray(self.encode_fn(texts), dtype=np.float32)
+            except Exception as e:
+                for _, future in pending:
+                    future.set_exception(e)
+                continue
+            elapsed = time.perf_counter() - start
+            self._dim = embeddings.shape[-1]
+
+            offset = 0
+            for request_texts, future in pending:
+                future.set_result(embeddings[offset:offset + len(request_texts)])
+                offset += len(request_texts)
+
+            with self._stats_lock:
+                self.batches += 1
+                self.requests += len(pending)
+                self.texts += len(texts)
+                self.encode_seconds += elapsed
+                for histogram, value in (
+                    (self.batch_size_histogram, len(texts)),
+                    (self.requests_per_batch_histogram, len(pending)),
+                    (self.queue_depth_histogram, depth)
+                ):
+                    key = _bucket(value)
+                    histogram[key] = histogram.get(key, 0) + 1
+
+    def queue_depth(self) -> int:
+        return self._queue.qsize()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._stats_lock:
+            return {
+                'max_batch_size': self.max_batch_size,
+                'max_wait_ms': self.max_wait * 1000,
+                'queue_depth': self._queue.qsize(),
+                'batches': self.batches,
+                'requests': self.requests,
+                'texts': self.texts,
+                'mean_batch_size': self.texts / self.batches if self.batches else 0.0,
+                'mean_requests_per_batch': self.requests / self.batches if self.batches else 0.0,
+                'encode_seconds': round(self.encode_seconds, 4),
+                'batch_size_histogram': dict(self.batch_size_histogram),
+                'requests_per_batch_histogram': dict(self.requests_per_batch_histogram),
+                'queue_depth_histogram': dict(self.queue_depth_histogram)
+            }
+
+    def close(self):
+        if not self._closed:
+            self._closed = True
+            self._queue.put(None)
+            self._worker.join(timeout=5)
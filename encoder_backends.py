@@ -0,0 +1,284 @@
+"""Pluggable CPU encoder backends for the sentence model.
+
+Every backend exposes encode(texts, batch_size) -> float32 matrix:
+
+    torch       the SentenceTransformer model as saved (reference)
+    onnx        ONNX Runtime over an export of the same transformer
+    onnx-int8   the ONNX export with dynamically int8-quantized weights
+
+The ONNX backends tokenize with the model's tokenizer.json, then apply the
+mean pooling and normalisation the SentenceTransformer modules describe. The
+export and the quantized copy are written once under <model_path>/onnx. Run
+this module to check a backend's parity against the torch model:
+
+    python encoder_backends.py --backend onnx-int8 --texts sample_texts.txt
+"""
+import argparse
+import json
+import logging
+import os
+import resource
+import tempfile
+import time
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+_SAMPLE_TEXTS = [
+    "Thai restaurant with spicy curries and pad thai",
+    "Family-run taqueria serving tacos al pastor",
+    "Cozy cafe with homemade pastries and espresso",
+    "Texas barbecue joint known for brisket",
+    "Vegan bakery with gluten free options",
+    "Late-night ramen counter",
+    "Ethiopian injera platters for groups",
+    "Upscale sushi omakase, date night",
+    "Live music bar with craft cocktails",
+    "Nepalese momo and dal bhat",
+    "spicy vegetarian",
+    "brunch patio dog friendly"
+]
+
+
+class TorchEncoder:
+    """The float SentenceTransformer model, as the engine always loaded it"""
+
+    def __init__(self, model_path: str, **kwargs):
+        from sentence_transformers import SentenceTransformer
+        self.model = SentenceTransformer(model_path)
+
+    def encode(self, texts: List[str], batch_size: int = 32) -> np.ndarray:
+        if not texts:
+            return np.zeros((0, self.model.get_sentence_embedding_dimension()), dtype=np.float32)
+        return np.asarray(self.model.encode(texts, batch_size=batch_size), dtype=np.float32)
+
+
+class OnnxEncoder:
+    """ONNX Runtime session over the exported transformer, pooled like the SentenceTransformer modules"""
+
+    def __init__(
+        self,
+        model_path: str,
+        quantized: bool = False,
+        onnx_dir: Optional[str] = None,
+        num_threads: Optional[int] = None
+    ):
+        import onnxruntime
+        from tokenizers import Tokenizer
+
+        self.model_path = model_path
+        self.onnx_dir = onnx_dir or os.path.join(model_path, 'onnx')
+        self.max_seq_length, self.normalize = _read_pipeline_config(model_path)
+
+        self.tokenizer = Tokenizer.from_file(os.path.join(model_path, 'tokenizer.json'))
+        self.tokenizer.enable_truncation(max_length=self.max_seq_length)
+        pad_token = _read_json(os.path.join(model_path, 'tokenizer_config.json')).get('pad_token', '[PAD]')
+        self.tokenizer.enable_padding(pad_id=self.tokenizer.token_to_id(pad_token) or 0, pad_token=pad_token)
+
+        onnx_path = export_onnx(model_path, self.onnx_dir)
+        if quantized:
+            onnx_path = quantize_onnx(onnx_path)
+        options = onnxruntime.SessionOptions()
+        options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        self.session = onnxruntime.InferenceSession(onnx_path, options, providers=['CPUExecutionProvider'])
+        self.input_names = {node.name for node in self.session.get_inputs()}
+        self.onnx_path = onnx_path
+        logger.info(f"Loaded ONNX encoder from {onnx_path}")
+
+    def encode(self, texts: List[str], batch_size: int = 32) -> np.ndarray:
+        if not texts:
+            dim = self.session.get_outputs()[0].shape[-1]
+            return np.zeros((0, dim if isinstance(dim, int) else 0), dtype=np.float32)
+        # Length-sorted batches keep padding small, as SentenceTransformer.encode does
+        order = np.argsort([-len(text) for text in texts], kind='stable')
+        output = [None] * len(texts)
+        for start in range(0, len(texts), batch_size):
+            batch = [texts[i] for i in order[start:start + batch_size]]
+            for i, vector in zip(order[start:start + batch_size], self._encode_batch(batch)):
+                output[i] = vector
+        return np.vstack(output).astype(np.float32)
+
+    def _encode_batch(self, texts: List[str]) -> np.ndarray:
+        encodings = self.tokenizer.encode_batch(texts)
+        feed = {
+            'input_ids': np.array([e.ids for e in encodings], dtype=np.int64),
+            'attention_mask': np.array([e.attention_mask for e in encodings], dtype=np.int64),
+            'token_type_ids': np.array([e.type_ids for e in encodings], dtype=np.int64)
+        }
+        token_embeddings = self.session.run(None, {k: v for k, v in feed.items() if k in self.input_names})[0]
+        return mean_pool(token_embeddings, feed['attention_mask'], self.normalize)
+
+
+def mean_pool(token_embeddings: np.ndarray, attention_mask: np.ndarray, normalize: bool = True) -> np.ndarray:
+    """Mask-weighted mean over tokens, optionally L2-normalized (Pooling + Normalize modules)"""
+    mask = attention_mask[..., None].astype(np.float32)
+    pooled = (token_embeddings * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1e-9)
+    if normalize:
+        pooled = pooled / np.maximum(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12)
+    return pooled
+
+
+def _read_json(path: str) -> Dict[str, Any]:
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _read_pipeline_config(model_path: str):
+    """max_seq_length and whether a Normalize module follows pooling; only mean pooling is reproduced"""
+    max_seq_length = _read_json(os.path.join(model_path, 'sentence_bert_config.json')).get('max_seq_length', 256)
+    modules = _read_json(os.path.join(model_path, 'modules.json')) or []
+    normalize = any(module.get('type', '').endswith('Normalize') for module in modules)
+    for module in modules:
+        if module.get('type', '').endswith('Pooling'):
+            pooling = _read_json(os.path.join(model_path, module.get('path', ''), 'config.json'))
+            if not pooling.get('pooling_mode_mean_tokens', True):
+                raise ValueError(f"ONNX backend only supports mean pooling, {model_path} uses another mode")
+    return max_seq_length, normalize
+
+
+def _temp_path(directory: str) -> str:
+    fd, path = tempfile.mkstemp(suffix='.onnx.tmp', dir=directory)
+    os.close(fd)
+    return path
+
+
+def export_onnx(model_path: str, onnx_dir: str, opset: int = 14) -> str:
+    """Export the transformer to onnx_dir/model.onnx once; needs torch and transformers only for the export"""
+    onnx_path = os.path.join(onnx_dir, 'model.onnx')
+    if os.path.exists(onnx_path):
+        return onnx_path
+
+    import torch
+    from transformers import AutoModel, AutoTokenizer
+
+    logger.info(f"Exporting {model_path} to ONNX at {onnx_path}")
+    os.makedirs(onnx_dir, exist_ok=True)
+    model = AutoModel.from_pretrained(model_path).eval()
+    tokenizer = AutoTokenizer.from_pretrained(model_path)
+    sample = tokenizer(["an example sentence"], return_tensors='pt')
+    input_names = [name for name in ('input_ids', 'attention_mask', 'token_type_ids') if name in sample]
+    dynamic_axes = {name: {0: 'batch', 1: 'sequence'} for name in input_names}
+    dynamic_axes['last_hidden_state'] = {0: 'batch', 1: 'sequence'}
+
+    # Written beside the final name so a crashed export never leaves a truncated model.onnx, under a
+    # unique name so processes exporting concurrently on first start never write into each other's file
+    tmp_path = _temp_path(onnx_dir)
+    try:
+        with torch.no_grad():
+            torch.onnx.export(
+                model,
+                tuple(sample[name] for name in input_names),
+                tmp_path,
+                input_names=input_names,
+                output_names=['last_hidden_state'],
+                dynamic_axes=dynamic_axes,
+                opset_version=opset
+            )
+        os.replace(tmp_path, onnx_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return onnx_path
+
+
+def quantize_onnx(onnx_path: str) -> str:
+    """Dynamic int8 weight quantization of an exported model, written once beside it"""
+    quantized_path = onnx_path.replace('.onnx', '_int8.onnx')
+    if os.path.exists(quantized_path):
+        return quantized_path
+
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    logger.info(f"Quantizing {onnx_path} to int8 at {quantized_path}")
+    tmp_path = _temp_path(os.path.dirname(quantized_path))
+    try:
+        quantize_dynamic(onnx_path, tmp_path, weight_type=QuantType.QInt8)
+        os.replace(tmp_path, quantized_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return quantized_path
+
+
+ENCODER_BACKENDS: Dict[str, Callable[..., Any]] = {
+    'torch': TorchEncoder,
+    'onnx': lambda model_path, **kwargs: OnnxEncoder(model_path, quantized=False, **kwargs),
+    'onnx-int8': lambda model_path, **kwargs: OnnxEncoder(model_path, quantized=True, **kwargs)
+}
+
+
+def load_encoder(backend: str, model_path: str, **kwargs):
+    if backend not in ENCODER_BACKENDS:
+        raise ValueError(f"Unknown encoder backend: {backend} (choose from {', '.join(ENCODER_BACKENDS)})")
+    return ENCODER_BACKENDS[backend](model_path, **kwargs)
+
+
+def parity_report(
+    reference,
+    candidate,
+    texts: List[str],
+    min_cosine: float = 0.99,
+    batch_size: int = 32
+) -> Dict[str, Any]:
+    """Compare a backend's embeddings and cosine scores with the reference model on the same texts"""
+    start = time.perf_counter()
+    expected = reference.encode(texts, batch_size=batch_size)
+    reference_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    actual = candidate.encode(texts, batch_size=batch_size)
+    candidate_seconds = time.perf_counter() - start
+
+    expected = expected / np.maximum(np.linalg.norm(expected, axis=1, keepdims=True), 1e-12)
+    actual = actual / np.maximum(np.linalg.norm(actual, axis=1, keepdims=True), 1e-12)
+    cosine = (expected * actual).sum(axis=1)
+    # What MMR actually consumes: the pairwise cosine scores and who is whose nearest neighbour
+    expected_scores = expected @ expected.T
+    actual_scores = actual @ actual.T
+    np.fill_diagonal(expected_scores, -np.inf)
+    np.fill_diagonal(actual_scores, -np.inf)
+    finite = np.isfinite(expected_scores)
+    return {
+        'texts': len(texts),
+        'min_cosine': float(cosine.min()),
+        'mean_cosine': float(cosine.mean()),
+        'max_score_abs_diff': float(np.abs(expected_scores[finite] - actual_scores[finite]).max()) if finite.any() else 0.0,
+        'nearest_neighbour_agreement': float(np.mean(expected_scores.argmax(axis=1) == actual_scores.argmax(axis=1))),
+        'reference_seconds': round(reference_seconds, 4),
+        'candidate_seconds': round(candidate_seconds, 4),
+        'speedup': round(reference_seconds / candidate_seconds, 2) if candidate_seconds > 0 else None,
+        'passed': bool(cosine.min() >= min_cosine)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check an encoder backend against the float torch model')
+    parser.add_argument('--model_path', default="./saved_models/all-MiniLM-L6-v2", help='SentenceTransformer model directory')
+    parser.add_argument('--backend', default='onnx-int8', choices=list(ENCODER_BACKENDS), help='Backend to check')
+    parser.add_argument('--texts', help='File with one text per line (default: a small built-in sample)')
+    parser.add_argument('--min_cosine', type=float, default=0.99, help='Lowest per-text cosine to the reference that passes')
+    args = parser.parse_args()
+
+    texts = _SAMPLE_TEXTS
+    if args.texts:
+        with open(args.texts, 'r', encoding='utf-8') as f:
+            texts = [line.strip() for line in f if line.strip()]
+
+    reference = load_encoder('torch', args.model_path)
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    candidate = load_encoder(args.backend, args.model_path)
+    report = parity_report(reference, candidate, texts, args.min_cosine)
+    report['backend'] = args.backend
+    report['peak_rss_growth_mb'] = round((resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss_before) / 1024, 1)
+    print(json.dumps(report, indent=2))
+    raise SystemExit(0 if report['passed'] else 1)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
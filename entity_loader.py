@@ -0,0 +1,254 @@
+"""Streaming, schema-tolerant loader for Qloo result dumps.
+
+Reads the `entities`, `results.entities` or top-level list shapes element by
+element instead of json.load-ing the whole file, projects each entity down to
+the fields the engine reads (feature text, VW features, diversity metrics),
+and remembers each entity's byte span so full records can be re-read from
+disk for the output.
+"""
+import json
+import logging
+import sys
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+_CHUNK_SIZE = 1 << 20
+_WHITESPACE = ' \t\n\r'
+
+
+def _intern(value: Any) -> Any:
+    return sys.intern(value) if isinstance(value, str) else value
+
+
+def _project_named(items: Any, keys: Tuple[str, ...]) -> Any:
+    if not isinstance(items, list):
+        return items
+    # Tag names and types repeat across the catalogue, so share one string object each
+    return [
+        {key: _intern(item[key]) for key in keys if key in item} if isinstance(item, dict) else item
+        for item in items
+    ]
+
+
+def _keep_path(source: Dict[str, Any], target: Dict[str, Any], keys: List[str]):
+    """Copy source's value at the dotted path keys into target; lists and leaves are copied whole"""
+    key = keys[0]
+    if not isinstance(source, dict) or key not in source:
+        return
+    value = source[key]
+    if len(keys) == 1 or not isinstance(value, dict):
+        target[key] = value
+        return
+    child = target.get(key)
+    if not isinstance(child, dict):
+        child = target[key] = {}
+    _keep_path(value, child, keys[1:])
+
+
+def project_entity(entity: Dict[str, Any], keep_paths: Tuple[str, ...] = ()) -> Dict[str, Any]:
+    """Keep only what extract_entity_features, _vectorize_entity_for_vw, analyze_diversity and GeoIndex read,
+    plus any dotted keep_paths (e.g. a diversify_by field such as properties.geocode.city)"""
+    projected = {key: entity[key] for key in ('name', 'entity_id', 'type', 'description', 'geohash') if key in entity}
+    location = entity.get('location')
+    if isinstance(location, dict):
+        projected['location'] = {key: location[key] for key in ('lat', 'lon', 'geohash') if key in location}
+    if 'tags' in entity:
+        projected['tags'] = _project_named(entity['tags'], ('name', 'type'))
+
+    properties = entity.get('properties')
+    if isinstance(properties, dict):
+        kept = {
+            key: properties[key]
+            for key in ('description', 'address', 'business_rating', 'price_range')
+            if key in properties
+        }
+        for key in ('specialty_dishes', 'good_for'):
+            if key in properties:
+                kept[key] = _project_named(properties[key], ('name',))
+        projected['properties'] = kept
+    elif 'properties' in entity:
+        projected['properties'] = properties
+    for path in keep_paths:
+        _keep_path(entity, projected, path.split('.'))
+    return projected
+
+
+class _JSONStream:
+    """Incremental reader over a UTF-8 JSON file that tracks byte offsets"""
+
+    def __init__(self, f):
+        self.f = f
+        self.buf = ''
+        self.pos = 0
+        # buf[mark_pos] sits at byte mark_bytes of the file; the mark only moves forward
+        self.mark_pos = 0
+        self.mark_bytes = 0
+        self.eof = False
+        self.decoder = json.JSONDecoder()
+
+    def _fill(self) -> bool:
+        if self.eof:
+            return False
+        chunk = self.f.read(_CHUNK_SIZE)
+        if not chunk:
+            self.eof = True
+            return False
+        # Drop the consumed prefix so the buffer stays around one entity in size
+        if self.pos:
+            self.byte_offset()
+            self.buf = self.buf[self.pos:]
+            self.pos = 0
+            self.mark_pos = 0
+        self.buf += chunk
+        return True
+
+    def byte_offset(self) -> int:
+        self.mark_bytes += len(self.buf[self.mark_pos:self.pos].encode('utf-8'))
+        self.mark_pos = self.pos
+        return self.mark_bytes
+
+    def peek(self) -> Optional[str]:
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos] in _WHITESPACE:
+                self.pos += 1
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self._fill():
+                return None
+
+    def expect(self, char: str):
+        if self.peek() != char:
+            raise ValueError(f"Expected '{char}' at byte {self.byte_offset()}")
+        self.pos += 1
+
+    def value(self) -> Tuple[Any, int, int]:
+        """Decode the next value, returning it with its byte offset and byte length"""
+        self.peek()
+        while True:
+            try:
+                value, end = self.decoder.raw_decode(self.buf, self.pos)
+                # A value ending exactly at the buffer edge may be a truncated number
+                if end < len(self.buf) or self.eof:
+                    break
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            self._fill()
+        start = self.byte_offset()
+        length = len(self.buf[self.pos:end].encode('utf-8'))
+        self.pos = end
+        return value, start, length
+
+    def array_items(self) -> Iterator[Tuple[Any, int, int]]:
+        self.expect('[')
+        if self.peek() == ']':
+            self.pos += 1
+            return
+        while True:
+            yield self.value()
+            separator = self.peek()
+            self.pos += 1
+            if separator == ']':
+                return
+            if separator != ',':
+                raise ValueError(f"Expected ',' or ']' at byte {self.byte_offset()}")
+
+    def find_key(self, wanted: Tuple[str, ...]) -> Optional[str]:
+        """Advance inside an object to the value of the first key in wanted, skipping other members"""
+        self.expect('{')
+        while self.peek() not in ('}', None):
+            key, _, _ = self.value()
+            self.expect(':')
+            if key in wanted:
+                return key
+            self.value()
+            if self.peek() == ',':
+                self.pos += 1
+        return None
+
+
+def iter_entity_spans(file_path: str) -> Iterator[Tuple[Dict[str, Any], int, int]]:
+    """Stream (entity, byte_offset, byte_length) from any supported dump shape"""
+    # newline='' keeps '\r\n' intact, so the byte spans match the file on disk
+    with open(file_path, 'r', encoding='utf-8', newline='') as f:
+        stream = _JSONStream(f)
+        head = stream.peek()
+        if head == '{':
+            key = stream.find_key(('entities', 'results'))
+            if key == 'results':
+                if stream.peek() != '{' or stream.find_key(('entities',)) is None:
+                    return
+            elif key is None:
+                return
+        if stream.peek() != '[':
+            return
+        for entity, offset, length in stream.array_items():
+            if isinstance(entity, dict):
+                yield entity, offset, length
+
+
+class EntityStore:
+    """Projected entities for scoring, with full records re-read from disk by entity_id or object"""
+
+    def __init__(self, file_path: str, keep_paths: Tuple[str, ...] = ()):
+        self.file_path = file_path
+        self.keep_paths = tuple(keep_paths)
+        self.entities: List[Dict[str, Any]] = []
+        self._spans: List[Tuple[int, int]] = []
+        self._by_entity_id: Dict[str, int] = {}
+        self._by_object: Dict[int, int] = {}
+
+    @classmethod
+    def load(cls, file_path: str, keep_paths: Tuple[str, ...] = ()) -> "EntityStore":
+        store = cls(file_path, keep_paths)
+        for entity, offset, length in iter_entity_spans(file_path):
+            store._add(project_entity(entity, store.keep_paths), offset, length)
+        return store
+
+    def _add(self, projected: Dict[str, Any], offset: int, length: int):
+        position = len(self.entities)
+        self.entities.append(projected)
+        self._spans.append((offset, length))
+        self._by_object[id(projected)] = position
+        entity_id = projected.get('entity_id')
+        if entity_id is not None:
+            self._by_entity_id.setdefault(entity_id, position)
+
+    def __len__(self) -> int:
+        return len(self.entities)
+
+    def _read(self, positions: List[int]) -> List[Dict[str, Any]]:
+        records = []
+        with open(self.file_path, 'rb') as f:
+            for position in positions:
+                offset, length = self._spans[position]
+                f.seek(offset)
+                records.append(json.loads(f.read(length)))
+        return records
+
+    def get_full(self, entity_id: str) -> Optional[Dict[str, Any]]:
+        position = self._by_entity_id.get(entity_id)
+        return self._read([position])[0] if position is not None else None
+
+    def full_records(self, entities: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Swap projected entities (as returned by the engine) for their full records"""
+        positions = []
+        for entity in entities:
+            position = self._by_object.get(id(entity))
+            if position is None:
+                position = self._by_entity_id.get(entity.get('entity_id'))
+            if position is None:
+                raise KeyError(f"Entity not from this store: {entity.get('name', '')}")
+            positions.append(position)
+        return self._read(positions)
+
+
+def load_entity_store(file_path: str, keep_paths: Tuple[str, ...] = ()) -> EntityStore:
+    try:
+        store = EntityStore.load(file_path, keep_paths)
+        logger.info(f"Streamed {len(store)} entities from {file_path}")
+        return store
+    except Exception as e:
+        logger.error(f"Error loading data from {file_path}: {e}")
+        return EntityStore(file_path, keep_paths)
@@ -1,8 +1,36 @@
-from PIL import Image
-import piexif
 import os
 import sys
 import json
+import struct
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import BinaryIO, Dict, Iterable, List, Optional
+
+# EXIF/TIFF tags needed to reach the GPS coordinates
+GPS_IFD_POINTER = 0x8825
+GPS_LATITUDE_REF = 1
+GPS_LATITUDE = 2
+GPS_LONGITUDE_REF = 3
+GPS_LONGITUDE = 4
+
+# TIFF field type -> (struct format, size in bytes)
+TIFF_TYPES = {
+    1: ('B', 1),   # BYTE
+    2: ('c', 1),   # ASCII
+    3: ('H', 2),   # SHORT
+    4: ('L', 4),   # LONG
+    5: ('LL', 8),  # RATIONAL
+    7: ('B', 1),   # UNDEFINED
+    9: ('l', 4),   # SLONG
+    10: ('ll', 8)  # SRATIONAL
+}
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.tif', '.tiff', '.png', '.webp', '.heic', '.heif')
+
+
+class ExifNotFound(Exception):
+    pass
+
 
 def get_decimal_from_dms(dms, ref):
     """Convert EXIF DMS format to decimal degrees"""
@@ -14,57 +42,321 @@ def get_decimal_from_dms(dms, ref):
         decimal = -decimal
     return decimal
 
+
+def _read_exact(f: BinaryIO, size: int) -> bytes:
+    data = f.read(size)
+    if len(data) != size:
+        raise ExifNotFound("Truncated image")
+    return data
+
+
+def _find_jpeg_exif(f: BinaryIO) -> Optional[bytes]:
+    """Seek marker to marker through the JPEG header and return the Exif APP1 payload"""
+    while True:
+        marker = f.read(2)
+        if len(marker) < 2 or marker[0] != 0xFF:
+            return None
+        # Fill bytes (0xFF padding) before a marker
+        while marker[1] == 0xFF:
+            marker = marker[1:] + _read_exact(f, 1)
+        code = marker[1]
+        if code in (0xD8, 0x01) or 0xD0 <= code <= 0xD7:
+            continue  # markers without a length field
+        if code in (0xDA, 0xD9):
+            return None  # image data starts, EXIF always comes before it
+        length = struct.unpack('>H', _read_exact(f, 2))[0]
+        if code == 0xE1:
+            payload = _read_exact(f, length - 2)
+            if payload.startswith(b'Exif\x00\x00'):
+                return payload[6:]
+        else:
+            f.seek(length - 2, os.SEEK_CUR)
+
+
+def _find_png_exif(f: BinaryIO) -> Optional[bytes]:
+    while True:
+        header = f.read(8)
+        if len(header) < 8:
+            return None
+        length, chunk_type = struct.unpack('>I4s', header)
+        if chunk_type == b'eXIf':
+            return _read_exact(f, length)
+        if chunk_type in (b'IDAT', b'IEND'):
+            return None
+        f.seek(length + 4, os.SEEK_CUR)  # data + CRC
+
+
+def _find_webp_exif(f: BinaryIO) -> Optional[bytes]:
+    while True:
+        header = f.read(8)
+        if len(header) < 8:
+            return None
+        chunk_type, length = struct.unpack('<4sI', header)
+        if chunk_type == b'EXIF':
+            payload = _read_exact(f, length)
+            return payload[6:] if payload.startswith(b'Exif\x00\x00') else payload
+        f.seek(length + (length & 1), os.SEEK_CUR)  # chunks are padded to even sizes
+
+
+def find_exif_block(f: BinaryIO) -> Optional[bytes]:
+    """Return the raw TIFF-structured EXIF block of a JPEG, TIFF, PNG or WebP without decoding pixels"""
+    head = f.read(12)
+    if head[:2] == b'\xff\xd8':
+        f.seek(2)
+        return _find_jpeg_exif(f)
+    if head[:4] in (b'II*\x00', b'MM\x00*'):
+        f.seek(0)
+        return f.read()
+    if head[:8] == b'\x89PNG\r\n\x1a\n':
+        f.seek(8)
+        return _find_png_exif(f)
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return _find_webp_exif(f)
+    raise ExifNotFound("Unsupported image format")
+
+
+def _read_ifd(tiff: bytes, offset: int, endian: str) -> Dict[int, object]:
+    """Decode one IFD into {tag: value}; rationals come back as (numerator, denominator) tuples"""
+    count = struct.unpack_from(endian + 'H', tiff, offset)[0]
+    entries = {}
+    for i in range(count):
+        entry = offset + 2 + i * 12
+        tag, field_type, n = struct.unpack_from(endian + 'HHL', tiff, entry)
+        if field_type not in TIFF_TYPES:
+            continue
+        fmt, size = TIFF_TYPES[field_type]
+        total = size * n
+        data_offset = entry + 8 if total <= 4 else struct.unpack_from(endian + 'L', tiff, entry + 8)[0]
+        if data_offset + total > len(tiff):
+            continue
+        raw = tiff[data_offset:data_offset + total]
+        if field_type == 2:
+            entries[tag] = raw.split(b'\x00', 1)[0]
+        elif field_type in (5, 10):
+            values = struct.unpack(endian + fmt * n, raw)
+            entries[tag] = tuple(zip(values[0::2], values[1::2]))
+        else:
+            values = struct.unpack(endian + fmt * n, raw)
+            entries[tag] = values[0] if n == 1 else values
+    return entries
+
+
+def parse_gps_ifd(tiff: bytes) -> Dict[int, object]:
+    """Walk IFD0 to the GPS IFD of a TIFF-structured EXIF block"""
+    if len(tiff) < 8:
+        return {}
+    endian = '<' if tiff[:2] == b'II' else '>'
+    ifd0 = _read_ifd(tiff, struct.unpack_from(endian + 'L', tiff, 4)[0], endian)
+    gps_offset = ifd0.get(GPS_IFD_POINTER)
+    if not gps_offset:
+        return {}
+    return _read_ifd(tiff, gps_offset, endian)
+
+
+def _gps_result(gps_info: Dict[int, object]) -> Dict[str, object]:
+    if not gps_info:
+        return {"error": "No GPS metadata found"}
+
+    # Extract GPS coordinates
+    gps_latitude = gps_info.get(GPS_LATITUDE)
+    gps_latitude_ref = gps_info.get(GPS_LATITUDE_REF)
+    gps_longitude = gps_info.get(GPS_LONGITUDE)
+    gps_longitude_ref = gps_info.get(GPS_LONGITUDE_REF)
+
+    if not all([gps_latitude, gps_latitude_ref, gps_longitude, gps_longitude_ref]):
+        return {"error": "Incomplete GPS EXIF data"}
+
+    # Decode reference if it's bytes
+    if isinstance(gps_latitude_ref, bytes):
+        gps_latitude_ref = gps_latitude_ref.decode()
+    if isinstance(gps_longitude_ref, bytes):
+        gps_longitude_ref = gps_longitude_ref.decode()
+
+    lat = get_decimal_from_dms(gps_latitude, gps_latitude_ref)
+    lon = get_decimal_from_dms(gps_longitude, gps_longitude_ref)
+
+    return {
+        "latitude": lat,
+        "longitude": lon,
+        "success": True
+    }
+
+
+def _extract_with_pillow(f: BinaryIO) -> Dict[str, object]:
+    """Fallback for formats the marker parser does not handle (e.g. HEIC with a Pillow plugin)"""
+    from PIL import Image
+    import piexif
+
+    f.seek(0)
+    exif_data = Image.open(f).info.get("exif")
+    if not exif_data:
+        return {"error": "No EXIF data found"}
+    gps = piexif.load(exif_data).get("GPS") or {}
+    return _gps_result({
+        GPS_LATITUDE: gps.get(piexif.GPSIFD.GPSLatitude),
+        GPS_LATITUDE_REF: gps.get(piexif.GPSIFD.GPSLatitudeRef),
+        GPS_LONGITUDE: gps.get(piexif.GPSIFD.GPSLongitude),
+        GPS_LONGITUDE_REF: gps.get(piexif.GPSIFD.GPSLongitudeRef)
+    } if gps else {})
+
+
+def extract_gps_from_stream(f: BinaryIO) -> Dict[str, object]:
+    """Extract GPS coordinates from a seekable binary stream, reading only the EXIF segment"""
+    try:
+        try:
+            exif_block = find_exif_block(f)
+        except ExifNotFound as e:
+            if str(e) != "Unsupported image format":
+                raise
+            return _extract_with_pillow(f)
+
+        if not exif_block:
+            return {"error": "No EXIF data found"}
+        return _gps_result(parse_gps_ifd(exif_block))
+
+    except Exception as e:
+        return {"error": f"Error processing image: {str(e)}"}
+
+
+def extract_gps_from_bytes(data: bytes) -> Dict[str, object]:
+    """Extract GPS coordinates from an in-memory image buffer, no temp file needed"""
+    import io
+    return extract_gps_from_stream(io.BytesIO(data))
+
+
 def extract_gps_from_image(image_path):
     """Extract GPS coordinates from image EXIF data"""
     if not os.path.exists(image_path):
         return {"error": f"Image not found: {image_path}"}
 
-    try:
-        img = Image.open(image_path)
-        exif_data = img.info.get("exif")
-        
-        if not exif_data:
-            return {"error": "No EXIF data found"}
+    with open(image_path, 'rb') as f:
+        return extract_gps_from_stream(f)
 
-        exif_dict = piexif.load(exif_data)
-        gps_info = exif_dict.get("GPS")
 
-        if not gps_info:
-            return {"error": "No GPS metadata found"}
+def extract_gps_batch(image_paths: Iterable[str], workers: int = 8) -> List[Dict[str, object]]:
+    """Extract GPS for many images on a worker pool, results in input order with their path"""
+    paths = list(image_paths)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        results = pool.map(extract_gps_from_image, paths)
+        return [dict(result, path=path) for path, result in zip(paths, results)]
 
-        # Extract GPS coordinates
-        gps_latitude = gps_info.get(piexif.GPSIFD.GPSLatitude)
-        gps_latitude_ref = gps_info.get(piexif.GPSIFD.GPSLatitudeRef)
-        gps_longitude = gps_info.get(piexif.GPSIFD.GPSLongitude)
-        gps_longitude_ref = gps_info.get(piexif.GPSIFD.GPSLongitudeRef)
 
-        if not all([gps_latitude, gps_latitude_ref, gps_longitude, gps_longitude_ref]):
-            return {"error": "Incomplete GPS EXIF data"}
+def iter_image_paths(directory: str) -> Iterable[str]:
+    for root, _, files in os.walk(directory):
+        for name in sorted(files):
+            if name.lower().endswith(IMAGE_EXTENSIONS):
+                yield os.path.join(root, name)
 
-        # Decode reference if it's bytes
-        if isinstance(gps_latitude_ref, bytes):
-            gps_latitude_ref = gps_latitude_ref.decode()
-        if isinstance(gps_longitude_ref, bytes):
-            gps_longitude_ref = gps_longitude_ref.decode()
 
-        lat = get_decimal_from_dms(gps_latitude, gps_latitude_ref)
-        lon = get_decimal_from_dms(gps_longitude, gps_longitude_ref)
+def serve_frames(read, write, workers: int = 4):
+    """Persistent mode: each request is a 4-byte big-endian length followed by the image bytes.
+
+    Images are processed concurrently; one JSON line per request is written back
+    in request order.
+    """
+    pending = []
+    condition = threading.Condition()
+    done = object()
+
+    def writer():
+        while True:
+            with condition:
+                while not pending:
+                    condition.wait()
+                future = pending.pop(0)
+            if future is done:
+                return
+            write((json.dumps(future.result()) + "\n").encode('utf-8'))
+
+    writer_thread = threading.Thread(target=writer, daemon=True)
+    writer_thread.start()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        while True:
+            header = read(4)
+            if len(header) < 4:
+                break
+            length = struct.unpack('>I', header)[0]
+            data = read(length)
+            future = pool.submit(extract_gps_from_bytes, data) if len(data) == length else None
+            with condition:
+                if future is None:
+                    break
+                pending.append(future)
+                condition.notify()
+    with condition:
+        pending.append(done)
+        condition.notify()
+    writer_thread.join()
+
+
+def serve_stdio(workers: int = 4):
+    stdin = sys.stdin.buffer
+    stdout = sys.stdout.buffer
+
+    def read(size: int) -> bytes:
+        chunks = []
+        while size > 0:
+            chunk = stdin.read(size)
+            if not chunk:
+                break
+            chunks.append(chunk)
+            size -= len(chunk)
+        return b''.join(chunks)
+
+    def write(data: bytes):
+        stdout.write(data)
+        stdout.flush()
+
+    serve_frames(read, write, workers)
+
+
+def serve_socket(path: str, workers: int = 4):
+    """Same framing over a Unix socket, one thread per connection"""
+    import socketserver
+
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self):
+            def read(size: int) -> bytes:
+                return self.rfile.read(size)
+
+            def write(data: bytes):
+                self.wfile.write(data)
+                self.wfile.flush()
+
+            serve_frames(read, write, workers)
+
+    if os.path.exists(path):
+        os.remove(path)
+    with socketserver.ThreadingUnixStreamServer(path, Handler) as server:
+        server.daemon_threads = True
+        server.serve_forever()
 
-        return {
-            "latitude": lat,
-            "longitude": lon,
-            "success": True
-        }
-        
-    except Exception as e:
-        return {"error": f"Error processing image: {str(e)}"}
 
 if __name__ == "__main__":
-    if len(sys.argv) != 2:
-        result = {"error": "Usage: python extract_gps.py <image_path>"}
+    import argparse
+
+    parser = argparse.ArgumentParser(description='Extract GPS coordinates from image EXIF data')
+    parser.add_argument('image_path', nargs='?', help='Image path, or - to read the image bytes from stdin')
+    parser.add_argument('--serve', action='store_true', help='Persistent mode: length-prefixed images on stdin, JSON lines on stdout')
+    parser.add_argument('--socket', help='Persistent mode on this Unix socket path instead of stdin/stdout')
+    parser.add_argument('--batch', help='Extract every image under this directory, one JSON line per image')
+    parser.add_argument('--workers', type=int, default=4, help='Worker threads for persistent and batch modes')
+    args = parser.parse_args()
+
+    if args.serve:
+        serve_stdio(args.workers)
+    elif args.socket:
+        serve_socket(args.socket, args.workers)
+    elif args.batch:
+        for result in extract_gps_batch(iter_image_paths(args.batch), args.workers):
+            print(json.dumps(result))
     else:
-        img_path = sys.argv[1]
-        result = extract_gps_from_image(img_path)
-    
-    # Always output valid JSON
-    print(json.dumps(result))
\ No newline at end of file
+        if not args.image_path:
+            result = {"error": "Usage: python extract_gps.py <image_path>"}
+        elif args.image_path == '-':
+            result = extract_gps_from_bytes(sys.stdin.buffer.read())
+        else:
+            result = extract_gps_from_image(args.image_path)
+
+        # Always output valid JSON
+        print(json.dumps(result))
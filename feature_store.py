@@ -0,0 +1,182 @@
+"""Compiled, array-backed features of a candidate list.
+
+EntityFeatureStore walks the nested Qloo entity dicts once: feature texts for
+the sentence encoder, tags interned as (type, name) ids in CSR int arrays,
+rating and price columns, and the static part of each entity's VW feature
+line. The scorers read rows from it by position instead of re-walking JSON
+and re-running tag regexes per call. take(rows) gives the store of a
+shortlist without recompiling anything.
+"""
+import logging
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from fallback_scorer import FallbackTermIndex, take_csr_rows
+
+logger = logging.getLogger(__name__)
+
+_NON_ALNUM = re.compile(r'[^a-zA-Z0-9]')
+# The VW line quantizes the first embedding dimensions into integer buckets
+VW_EMBEDDING_DIMS = 50
+_VW_EMBEDDING_PREFIXES = [f"emb_{i}:" for i in range(VW_EMBEDDING_DIMS)]
+
+
+def entity_feature_text(entity: Dict[str, Any]) -> str:
+    """Name, description, cuisine/amenity tags, dishes, good_for, address and type as one text to embed"""
+    features = []
+
+    name = entity.get('name', '')
+    features.append(name)
+
+    description = (
+        entity.get('properties', {}).get('description', '') or
+        entity.get('description', '')
+    )
+    features.append(description)
+
+    tags = entity.get('tags', [])
+    if tags:
+        cuisine_tags = [
+            tag.get('name', '') for tag in tags
+            if 'cuisine' in tag.get('type', '') or 'category' in tag.get('type', '')
+        ]
+        features.extend(cuisine_tags)
+
+        amenity_tags = [
+            tag.get('name', '') for tag in tags
+            if 'amenity' in tag.get('type', '') or 'offerings' in tag.get('type', '')
+        ]
+        features.extend(amenity_tags)
+
+    properties = entity.get('properties', {})
+    specialty_dishes = properties.get('specialty_dishes', [])
+    if specialty_dishes:
+        dish_names = [dish.get('name', '') for dish in specialty_dishes]
+        features.extend(dish_names)
+
+    good_for = properties.get('good_for', [])
+    if good_for:
+        good_for_tags = [item.get('name', '') for item in good_for]
+        features.extend(good_for_tags)
+
+    address = properties.get('address', '')
+    if address:
+        features.append(address)
+
+    entity_type = entity.get('type', '')
+    if entity_type:
+        features.append(entity_type)
+
+    return ' '.join(filter(None, features))
+
+
+def _number(value: Any) -> float:
+    return float(value) if isinstance(value, (int, float)) and not isinstance(value, bool) else 0.0
+
+
+class EntityFeatureStore:
+    def __init__(self, entities: List[Dict[str, Any]]):
+        n = len(entities)
+        self.entity_ids = [str(entity.get('entity_id', '')) for entity in entities]
+        self.feature_texts = [entity_feature_text(entity) for entity in entities]
+        self.name_lengths = np.array([len(entity.get('name', '').lower()) for entity in entities], dtype=np.int64)
+
+        # Tags interned once per distinct (type, name); the VW token's regex runs per distinct tag
+        self.tag_vocabulary: Dict[Tuple[str, str], int] = {}
+        tag_ids, tag_indptr = [], [0]
+        self.ratings = np.zeros(n)
+        self.prices = np.full(n, np.nan)
+        for i, entity in enumerate(entities):
+            for tag in entity.get('tags', []):
+                key = (tag.get('type', ''), tag.get('name', ''))
+                tag_ids.append(self.tag_vocabulary.setdefault(key, len(self.tag_vocabulary)))
+            tag_indptr.append(len(tag_ids))
+
+            properties = entity.get('properties', {})
+            self.ratings[i] = _number(properties.get('business_rating', 0))
+            price_range = properties.get('price_range', {})
+            if price_range:
+                self.prices[i] = (_number(price_range.get('from', 0)) + _number(price_range.get('to', 0))) / 2
+        self.tag_indptr = np.array(tag_indptr, dtype=np.int64)
+        self.tag_ids = np.array(tag_ids, dtype=np.int32)
+        self.tag_names = [name for _, name in self.tag_vocabulary]
+        self.tag_tokens = [
+            f"tag_{_NON_ALNUM.sub('_', tag_type)}_{_NON_ALNUM.sub('_', name)}" for tag_type, name in self.tag_vocabulary
+        ]
+
+        # -1 marks a missing rating or price, which the VW line leaves out
+        self.rating_buckets = np.where(self.ratings > 0, np.minimum(self.ratings.astype(np.int64), 5), -1)
+        has_price = ~np.isnan(self.prices)
+        self.price_buckets = np.full(n, -1, dtype=np.int64)
+        self.price_buckets[has_price] = np.minimum((self.prices[has_price] / 10).astype(np.int64), 10)
+        self._static_vw: Optional[List[str]] = None
+        self._vw_features: Optional[List[str]] = None
+        self._term_index: Optional[FallbackTermIndex] = None
+
+    def __len__(self) -> int:
+        return len(self.entity_ids)
+
+    def entity_tag_ids(self, row: int) -> np.ndarray:
+        return self.tag_ids[self.tag_indptr[row]:self.tag_indptr[row + 1]]
+
+    @property
+    def term_index(self) -> FallbackTermIndex:
+        """Fallback preference scorer over the feature texts and tag names"""
+        if self._term_index is None:
+            tag_names = [[self.tag_names[t] for t in self.entity_tag_ids(row)] for row in range(len(self))]
+            self._term_index = FallbackTermIndex(self.feature_texts, tag_names)
+        return self._term_index
+
+    def _static_vw_features(self) -> List[str]:
+        """Tag, rating and price part of every VW line, which does not depend on embeddings"""
+        if self._static_vw is None:
+            lines = []
+            for row in range(len(self)):
+                features = [self.tag_tokens[t] for t in self.entity_tag_ids(row)]
+                if self.rating_buckets[row] >= 0:
+                    features.append(f"rating_bucket:{self.rating_buckets[row]}")
+                if self.price_buckets[row] >= 0:
+                    features.append(f"price_bucket:{self.price_buckets[row]}")
+                lines.append(" ".join(features))
+            self._static_vw = lines
+        return self._static_vw
+
+    def vw_features(self, embeddings: np.ndarray) -> List[str]:
+        """The VW |entity namespace of every row; embeddings are the rows' raw vectors, stable for one engine, so the lines are built once"""
+        if self._vw_features is None:
+            # Truncation towards zero, in the embeddings' own dtype, as int(val * 10) did per value
+            buckets = (np.asarray(embeddings)[:, :VW_EMBEDDING_DIMS] * 10).astype(np.int64).tolist()
+            self._vw_features = [
+                " ".join(
+                    [f"name_len:{name_length}"]
+                    + [prefix + str(bucket) for prefix, bucket in zip(_VW_EMBEDDING_PREFIXES, row_buckets)]
+                    + ([static] if static else [])
+                )
+                for name_length, row_buckets, static in zip(
+                    self.name_lengths.tolist(), buckets, self._static_vw_features()
+                )
+            ]
+        return self._vw_features
+
+    def take(self, rows: np.ndarray) -> "EntityFeatureStore":
+        """Store of the given rows, in that order, sharing this store's tag vocabulary and compiled rows"""
+        rows = np.asarray(rows, dtype=np.int64)
+        index = rows.tolist()
+        subset = EntityFeatureStore.__new__(EntityFeatureStore)
+        subset.entity_ids = [self.entity_ids[i] for i in index]
+        subset.feature_texts = [self.feature_texts[i] for i in index]
+        subset.name_lengths = self.name_lengths[rows]
+        subset.tag_vocabulary = self.tag_vocabulary
+        subset.tag_names = self.tag_names
+        subset.tag_tokens = self.tag_tokens
+        subset.tag_indptr, subset.tag_ids = take_csr_rows(self.tag_indptr, self.tag_ids, rows)
+        subset.ratings = self.ratings[rows]
+        subset.prices = self.prices[rows]
+        subset.rating_buckets = self.rating_buckets[rows]
+        subset.price_buckets = self.price_buckets[rows]
+        subset._static_vw = [self._static_vw[i] for i in index] if self._static_vw is not None else None
+        subset._vw_features = [self._vw_features[i] for i in index] if self._vw_features is not None else None
+        subset._term_index = self._term_index.take(rows) if self._term_index is not None else None
+        return subset
@@ -0,0 +1,156 @@
+"""Spatial index over loaded entities for reverse-geocoding photo coordinates.
+
+Entities are bucketed into latitude bands (band_deg degrees high) and sorted
+by longitude inside each band. A radius query binary-searches the longitude
+window of every band overlapping the query's bounding box and ranks only those
+candidates by haversine distance, so "k nearest places within R km of this
+photo" touches a few contiguous slices instead of the whole catalogue.
+Coordinates come from location.lat/lon, falling back to a decoded geohash.
+"""
+import logging
+import math
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180.0
+_GEOHASH_ALPHABET = '0123456789bcdefghjkmnpqrstuvwxyz'
+
+
+def decode_geohash(geohash: str) -> Tuple[float, float]:
+    """Center (lat, lon) of a geohash cell"""
+    lat_range, lon_range = [-90.0, 90.0], [-180.0, 180.0]
+    even = True
+    for char in geohash.lower():
+        bits = _GEOHASH_ALPHABET.index(char)
+        for shift in range(4, -1, -1):
+            target = lon_range if even else lat_range
+            mid = (target[0] + target[1]) / 2
+            if bits >> shift & 1:
+                target[0] = mid
+            else:
+                target[1] = mid
+            even = not even
+    return (lat_range[0] + lat_range[1]) / 2, (lon_range[0] + lon_range[1]) / 2
+
+
+def entity_coordinates(entity: Dict[str, Any]) -> Optional[Tuple[float, float]]:
+    """(lat, lon) of a Qloo entity, or None when it carries no usable location"""
+    location = entity.get('location')
+    if isinstance(location, dict):
+        lat, lon = location.get('lat'), location.get('lon')
+        if isinstance(lat, (int, float)) and isinstance(lon, (int, float)):
+            return float(lat), float(lon)
+        geohash = location.get('geohash')
+    else:
+        geohash = None
+    geohash = geohash or entity.get('geohash')
+    if isinstance(geohash, str) and geohash:
+        try:
+            return decode_geohash(geohash)
+        except ValueError:
+            return None
+    return None
+
+
+def haversine_km(lat: float, lon: float, lats: np.ndarray, lons: np.ndarray) -> np.ndarray:
+    """Great-circle distance in km from one point to arrays of points, all in degrees"""
+    lat, lon = math.radians(lat), math.radians(lon)
+    lats, lons = np.radians(lats), np.radians(lons)
+    a = np.sin((lats - lat) / 2) ** 2 + math.cos(lat) * np.cos(lats) * np.sin((lons - lon) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+class GeoIndex:
+    def __init__(self, entities: List[Dict[str, Any]], band_deg: float = 0.1):
+        self.band_deg = band_deg
+        self.size = len(entities)
+        positions, lats, lons = [], [], []
+        for position, entity in enumerate(entities):
+            coordinates = entity_coordinates(entity)
+            if coordinates is not None:
+                positions.append(position)
+                lats.append(coordinates[0])
+                lons.append(coordinates[1])
+        lats = np.array(lats, dtype=np.float64)
+        lons = np.array(lons, dtype=np.float64)
+        bands = np.floor(lats / band_deg).astype(np.int64)
+
+        # Rows sorted by (band, lon) so every band is one contiguous, lon-sorted slice
+        order = np.lexsort((lons, bands))
+        self.positions = np.array(positions, dtype=np.int64)[order]
+        self.lats = lats[order]
+        self.lons = lons[order]
+        bands = bands[order]
+        band_ids, starts = np.unique(bands, return_index=True)
+        ends = np.append(starts[1:], len(bands))
+        self.bands = {int(band): (int(s), int(e)) for band, s, e in zip(band_ids, starts, ends)}
+        logger.info(f"Built geo index over {len(self.positions)} of {len(entities)} entities in {len(self.bands)} bands")
+
+    def __len__(self) -> int:
+        return len(self.positions)
+
+    def _lon_slice(self, start: int, end: int, low: float, high: float) -> Tuple[int, int]:
+        lons = self.lons[start:end]
+        return start + int(np.searchsorted(lons, low, 'left')), start + int(np.searchsorted(lons, high, 'right'))
+
+    def _candidate_rows(self, lat: float, lon: float, radius_km: Optional[float]) -> np.ndarray:
+        if radius_km is None:
+            return np.arange(len(self.positions))
+        dlat = radius_km / KM_PER_DEGREE
+        # Longitude degrees shrink towards the poles; near them just scan everything
+        max_lat = min(90.0, abs(lat) + dlat)
+        if max_lat >= 89.0:
+            return np.arange(len(self.positions))
+        dlon = dlat / math.cos(math.radians(max_lat))
+        if dlon >= 180.0:
+            return np.arange(len(self.positions))
+
+        # The longitude window, split in two where it crosses the antimeridian
+        windows = [(lon - dlon, lon + dlon)]
+        if lon - dlon < -180.0:
+            windows = [(-180.0, lon + dlon), (lon - dlon + 360.0, 180.0)]
+        elif lon + dlon > 180.0:
+            windows = [(lon - dlon, 180.0), (-180.0, lon + dlon - 360.0)]
+
+        slices = []
+        for band in range(int(math.floor((lat - dlat) / self.band_deg)), int(math.floor((lat + dlat) / self.band_deg)) + 1):
+            bounds = self.bands.get(band)
+            if bounds is None:
+                continue
+            for low, high in windows:
+                start, end = self._lon_slice(bounds[0], bounds[1], low, high)
+                if end > start:
+                    slices.append(np.arange(start, end))
+        return np.concatenate(slices) if slices else np.zeros(0, dtype=np.int64)
+
+    def query(
+        self,
+        lat: float,
+        lon: float,
+        k: Optional[int] = 10,
+        radius_km: Optional[float] = None
+    ) -> List[Tuple[int, float]]:
+        """(entity position, distance_km) pairs, nearest first, at most k and within radius_km when given"""
+        rows = self._candidate_rows(lat, lon, radius_km)
+        if not len(rows):
+            return []
+        distances = haversine_km(lat, lon, self.lats[rows], self.lons[rows])
+        if radius_km is not None:
+            inside = distances <= radius_km
+            rows, distances = rows[inside], distances[inside]
+        if k is not None and k < len(rows):
+            keep = np.argpartition(distances, k - 1)[:k]
+            rows, distances = rows[keep], distances[keep]
+        # Ties go to the entity that came first in the catalogue
+        order = np.lexsort((self.positions[rows], distances))
+        return [(int(self.positions[rows[i]]), float(distances[i])) for i in order]
+
+    def within(self, lat: float, lon: float, radius_km: float) -> np.ndarray:
+        """Sorted positions of every entity within radius_km, for use as a candidate pre-filter"""
+        rows = self._candidate_rows(lat, lon, radius_km)
+        inside = haversine_km(lat, lon, self.lats[rows], self.lons[rows]) <= radius_km
+        return np.sort(self.positions[rows[inside]])
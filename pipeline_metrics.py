@@ -0,0 +1,166 @@
+"""Per-request tracing and process-wide metrics for the diversification pipeline.
+
+run_diversification opens a Trace for each request. Engine code wraps its
+stages in stage('name') and bumps counters with count('name'); both act on the
+calling thread's active trace and do nothing outside one, so library callers
+pay nothing. A stage may contain another (the model's encode time is also part
+of the embed_entities stage that triggered it). Finished traces are returned
+in the results metadata and folded into a PipelineMetrics registry, which the
+server exports in Prometheus text format.
+"""
+import functools
+import logging
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, Optional
+
+logger = logging.getLogger(__name__)
+
+# Seconds; the upper bounds of the Prometheus stage histograms
+STAGE_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_local = threading.local()
+
+
+class Trace:
+    def __init__(self, trace_id: str = None):
+        self.trace_id = trace_id or uuid.uuid4().hex[:16]
+        self.stages: Dict[str, float] = {}
+        self.counters: Dict[str, int] = {}
+        self.total_seconds = 0.0
+        self._started = time.perf_counter()
+
+    def add_stage(self, name: str, seconds: float):
+        # A stage entered several times in one request (e.g. encode) accumulates
+        self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def count(self, name: str, n: int = 1):
+        self.counters[name] = self.counters.get(name, 0) + n
+
+    def finish(self):
+        self.total_seconds = time.perf_counter() - self._started
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {
+            'trace_id': self.trace_id,
+            'total_ms': round(self.total_seconds * 1000, 3),
+            'stages_ms': {name: round(seconds * 1000, 3) for name, seconds in self.stages.items()},
+            'counters': dict(self.counters)
+        }
+
+
+def current_trace() -> Optional[Trace]:
+    return getattr(_local, 'trace', None)
+
+
+@contextmanager
+def stage(name: str) -> Iterator[None]:
+    trace = current_trace()
+    if trace is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.add_stage(name, time.perf_counter() - start)
+
+
+def count(name: str, n: int = 1):
+    trace = current_trace()
+    if trace is not None:
+        trace.count(name, n)
+
+
+def traced(name: str) -> Callable:
+    """Decorator timing every call as stage name and counting it as name_calls"""
+    def decorator(fn: Callable) -> Callable:
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            count(f"{name}_calls")
+            with stage(name):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+class PipelineMetrics:
+    """Totals and stage latency histograms over every finished trace in this process"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.request_seconds = 0.0
+        self.counters: Dict[str, int] = {}
+        # stage -> [observations, total seconds, per-bucket counts]
+        self.stages: Dict[str, list] = {}
+
+    @contextmanager
+    def trace(self, trace_id: str = None) -> Iterator[Trace]:
+        """Make a new trace active on this thread for the duration of one request"""
+        previous = current_trace()
+        trace = Trace(trace_id)
+        _local.trace = trace
+        try:
+            yield trace
+        finally:
+            _local.trace = previous
+            trace.finish()
+            self.record(trace)
+            logger.info(
+                f"Trace {trace.trace_id}: {trace.total_seconds * 1000:.1f}ms "
+                + ' '.join(f"{name}={seconds * 1000:.1f}ms" for name, seconds in trace.stages.items())
+            )
+
+    def record(self, trace: Trace):
+        with self._lock:
+            self.requests += 1
+            self.request_seconds += trace.total_seconds
+            for name, n in trace.counters.items():
+                self.counters[name] = self.counters.get(name, 0) + n
+            for name, seconds in trace.stages.items():
+                observed = self.stages.setdefault(name, [0, 0.0, [0] * len(STAGE_BUCKETS)])
+                observed[0] += 1
+                observed[1] += seconds
+                for i, bound in enumerate(STAGE_BUCKETS):
+                    if seconds <= bound:
+                        observed[2][i] += 1
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'requests': self.requests,
+                'request_seconds': round(self.request_seconds, 6),
+                'counters': dict(self.counters),
+                'stage_seconds': {name: round(observed[1], 6) for name, observed in self.stages.items()}
+            }
+
+    def prometheus_text(self, prefix: str = 'cultour_diversify') -> str:
+        """Exposition-format text: request totals, one counter per pipeline counter, a histogram per stage"""
+        with self._lock:
+            lines = [
+                f"# HELP {prefix}_requests_total Traced diversification requests.",
+                f"# TYPE {prefix}_requests_total counter",
+                f"{prefix}_requests_total {self.requests}",
+                f"# HELP {prefix}_request_seconds_total Wall time of traced requests.",
+                f"# TYPE {prefix}_request_seconds_total counter",
+                f"{prefix}_request_seconds_total {self.request_seconds:.6f}",
+                f"# HELP {prefix}_events_total Pipeline counters (encodes, VW calls, cache hits) by name.",
+                f"# TYPE {prefix}_events_total counter"
+            ]
+            for name in sorted(self.counters):
+                lines.append(f'{prefix}_events_total{{event="{name}"}} {self.counters[name]}')
+            lines += [
+                f"# HELP {prefix}_stage_seconds Time spent per request in each pipeline stage.",
+                f"# TYPE {prefix}_stage_seconds histogram"
+            ]
+            for name in sorted(self.stages):
+                observations, total, buckets = self.stages[name]
+                for bound, n in zip(STAGE_BUCKETS, buckets):
+                    lines.append(f'{prefix}_stage_seconds_bucket{{stage="{name}",le="{bound}"}} {n}')
+                lines.append(f'{prefix}_stage_seconds_bucket{{stage="{name}",le="+Inf"}} {observations}')
+                lines.append(f'{prefix}_stage_seconds_sum{{stage="{name}"}} {total:.6f}')
+                lines.append(f'{prefix}_stage_seconds_count{{stage="{name}"}} {observations}')
+        return "\n".join(lines) + "\n"
@@ -0,0 +1,225 @@
+"""Request-level cache of diversification results.
+
+Keys are a canonical hash of the catalogue's content fingerprint, the
+normalised and sorted preference chips, the selection parameters, the encoder
+model name and a fingerprint of the interactions, so players who pick the same
+chips over the same catalogue share one computation, and edited entities
+under unchanged ids miss. Entries expire after a TTL and the in-memory tier
+evicts least recently used entries; an optional SQLite file lets several
+worker processes (spawned CLI runs, server replicas) reuse each other's
+results.
+"""
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_preferences(user_preferences: List[str]) -> List[str]:
+    """Case-, whitespace- and order-insensitive form of a preference chip list"""
+    return sorted({' '.join(str(pref).lower().split()) for pref in user_preferences} - {''})
+
+
+def interaction_fingerprint(interactions: Optional[List[Dict]]) -> str:
+    if not interactions:
+        return ''
+    return hashlib.sha1(json.dumps(interactions, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+
+def result_cache_key(
+    catalogue_fingerprint: str,
+    user_preferences: List[str],
+    parameters: Dict[str, Any],
+    model_name: str,
+    interactions: Optional[List[Dict]] = None
+) -> str:
+    """catalogue_fingerprint hashes the candidates' content in order (MMR breaks ties by position)"""
+    canonical = json.dumps({
+        'entities': catalogue_fingerprint,
+        'preferences': normalize_preferences(user_preferences),
+        'parameters': parameters,
+        'model': model_name,
+        'interactions': interaction_fingerprint(interactions)
+    }, sort_keys=True, default=str)
+    return hashlib.sha1(canonical.encode('utf-8')).hexdigest()
+
+
+class _SQLiteTier:
+    """Shared key -> JSON payload table; safe for several processes through SQLite's own locking"""
+
+    def __init__(self, path: str, max_entries: int):
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self.max_entries = max_entries
+        self._local = threading.local()
+        self._writes = 0
+        with self._connection() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS results ("
+                "key TEXT PRIMARY KEY, payload TEXT NOT NULL, created REAL NOT NULL, accessed REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS results_accessed ON results (accessed)")
+
+    def _connection(self) -> sqlite3.Connection:
+        # sqlite3 connections are per thread; server mode handles requests on several
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5.0)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, key: str, min_created: float) -> Optional[str]:
+        conn = self._connection()
+        row = conn.execute(
+            "SELECT payload FROM results WHERE key = ? AND created >= ?", (key, min_created)
+        ).fetchone()
+        if row is None:
+            return None
+        with conn:
+            conn.execute("UPDATE results SET accessed = ? WHERE key = ?", (time.time(), key))
+        return row[0]
+
+    def put(self, key: str, payload: str) -> int:
+        """Store one payload; returns the number of rows evicted to stay under max_entries"""
+        now = time.time()
+        conn = self._connection()
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO results (key, payload, created, accessed) VALUES (?, ?, ?, ?)",
+                (key, payload, now, now)
+            )
+        self._writes += 1
+        if self._writes % 64:
+            return 0
+        # Trimming is amortised over writes
+        with conn:
+            cursor = conn.execute(
+                "DELETE FROM results WHERE key IN ("
+                "SELECT key FROM results ORDER BY accessed DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,)
+            )
+        return cursor.rowcount
+
+    def expire(self, min_created: float) -> int:
+        conn = self._connection()
+        with conn:
+            return conn.execute("DELETE FROM results WHERE created < ?", (min_created,)).rowcount
+
+    def __len__(self) -> int:
+        return self._connection().execute("SELECT COUNT(*) FROM results").fetchone()[0]
+
+
+class ResultCache:
+    def __init__(
+        self,
+        max_entries: int = 1024,
+        ttl_seconds: float = 600.0,
+        sqlite_path: Optional[str] = None,
+        shared_max_entries: int = 100000
+    ):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        # key -> (created, serialized payload); payloads are stored as JSON so hits never alias caller state
+        self._memory: "OrderedDict[str, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._shared = None
+        if sqlite_path:
+            try:
+                self._shared = _SQLiteTier(sqlite_path, shared_max_entries)
+                self._shared.expire(time.time() - ttl_seconds)
+                logger.info(f"Shared result cache at {sqlite_path}")
+            except sqlite3.Error as e:
+                logger.warning(f"Shared result cache unavailable ({e}), using memory only")
+
+        self.hits = 0
+        self.memory_hits = 0
+        self.shared_hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None and now - entry[0] > self.ttl_seconds:
+                del self._memory[key]
+                self.expirations += 1
+                entry = None
+            if entry is not None:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                self.memory_hits += 1
+                return json.loads(entry[1])
+
+        payload = None
+        if self._shared is not None:
+            try:
+                payload = self._shared.get(key, now - self.ttl_seconds)
+            except sqlite3.Error as e:
+                logger.warning(f"Shared result cache read failed ({e})")
+        with self._lock:
+            if payload is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.shared_hits += 1
+            self._remember(key, now, payload)
+        return json.loads(payload)
+
+    def put(self, key: str, results: Dict[str, Any]):
+        payload = json.dumps(results, ensure_ascii=False, separators=(',', ':'), default=_json_default)
+        with self._lock:
+            self._remember(key, time.time(), payload)
+        if self._shared is not None:
+            try:
+                evicted = self._shared.put(key, payload)
+            except sqlite3.Error as e:
+                logger.warning(f"Shared result cache write failed ({e})")
+                return
+            with self._lock:
+                self.evictions += evicted
+
+    def _remember(self, key: str, created: float, payload: str):
+        self._memory[key] = (created, payload)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_entries:
+            self._memory.popitem(last=False)
+            self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._memory.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'memory_hits': self.memory_hits,
+                'shared_hits': self.shared_hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'evictions': self.evictions,
+                'expirations': self.expirations,
+                'memory_entries': len(self._memory),
+                'ttl_seconds': self.ttl_seconds,
+                'shared': self._shared.path if self._shared is not None else None
+            }
+
+
+def _json_default(value: Any) -> Any:
+    # numpy scalars and arrays in the metrics
+    if hasattr(value, 'tolist'):
+        return value.tolist()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
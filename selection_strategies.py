@@ -0,0 +1,254 @@
+"""Pluggable top-k selection over scored, embedded candidates.
+
+Every strategy takes a SimilarityMatrix, a relevance vector and k and returns
+the picked row indices in pick order:
+
+    mmr             one greedy MMR pass with lambda_param
+    two_phase       n_high_affinity picks at lambda_param, the rest at
+                    diversity_lambda (the engine's default scheme)
+    dpp             greedy MAP inference for a DPP whose kernel weights the
+                    cosine similarities by relevance (Chen et al., 2018)
+    category_quota  greedy MMR that takes at most diversify_take items per
+                    category, like the Qloo API's diversifyBy/diversifyTake
+
+A pick costs O(n) for the MMR strategies and O(n * picks so far) for dpp,
+so k picks cost O(n * k) and O(n * k^2) respectively.
+Strategies only read the similarity rows of items already picked, so
+SimilarityMatrix computes each row once on demand; materialize() fills the
+whole matrix in row-block tiles when one candidate set is selected from
+repeatedly and it fits under a memory cap.
+"""
+import logging
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from candidate_index import primary_cuisine
+
+logger = logging.getLogger(__name__)
+
+# Below this a DPP's remaining gain means the candidate is spanned by the picks
+_DPP_EPSILON = 1e-10
+
+
+class SimilarityMatrix:
+    """Cosine similarities between unit-normalized candidate embeddings"""
+
+    def __init__(self, embeddings: np.ndarray, block_size: int = 1024, max_dense_bytes: int = 256 * 1024 * 1024):
+        self.embeddings = embeddings
+        self.size = len(embeddings)
+        self.block_size = block_size
+        self.max_dense_bytes = max_dense_bytes
+        self.dense: Optional[np.ndarray] = None
+        self._rows: Dict[int, np.ndarray] = {}
+
+    def __len__(self) -> int:
+        return self.size
+
+    def row(self, i: int) -> np.ndarray:
+        if self.dense is not None:
+            return self.dense[i]
+        row = self._rows.get(i)
+        if row is None:
+            row = self._rows[i] = self.embeddings @ self.embeddings[i]
+        return row
+
+    def materialize(self) -> bool:
+        """Fill the full matrix a tile of block_size rows at a time; False when it would exceed max_dense_bytes"""
+        if self.dense is not None:
+            return True
+        dtype = np.result_type(self.embeddings.dtype, np.float32)
+        if self.size * self.size * dtype.itemsize > self.max_dense_bytes:
+            return False
+        dense = np.empty((self.size, self.size), dtype=dtype)
+        transposed = self.embeddings.T
+        for start in range(0, self.size, self.block_size):
+            stop = min(start + self.block_size, self.size)
+            np.matmul(self.embeddings[start:stop], transposed, out=dense[start:stop])
+        self.dense = dense
+        self._rows.clear()
+        return True
+
+
+def greedy_mmr(
+    similarity,
+    relevance: np.ndarray,
+    phases: List[Tuple[float, int]],
+    tracker=None,
+    diversity_weight: float = 0.0,
+    categories: np.ndarray = None,
+    take: int = None
+) -> List[int]:
+    """Incremental greedy MMR; similarity is a SimilarityMatrix or the unit-normalized embeddings.
+
+    phases is a list of (lambda, n_picks). A running max-similarity vector is
+    updated with one similarity row per pick, so selection costs O(n*k)
+    instead of re-scoring every candidate against the whole selected set.
+    With a tracker, diversity_weight times its per-candidate gain on the
+    diversity target is added to every score. With categories, a category
+    is closed once take of its items are picked, which can end selection
+    early.
+    """
+    if not isinstance(similarity, SimilarityMatrix):
+        similarity = SimilarityMatrix(similarity)
+    n = len(relevance)
+    available = np.ones(n, dtype=bool)
+    max_similarity = np.zeros(n, dtype=np.float64)
+    category_counts = {}
+    picks = []
+
+    for lambda_param, n_picks in phases:
+        for _ in range(min(n_picks, n - len(picks))):
+            if not available.any():
+                return picks
+            scores = lambda_param * relevance - (1 - lambda_param) * max_similarity
+            if tracker is not None and diversity_weight:
+                scores += diversity_weight * tracker.gain()
+            scores[~available] = -np.inf
+            # argmax returns the first maximum, matching the stable sort tie-break of the list-based MMR
+            best = int(np.argmax(scores))
+            picks.append(best)
+            available[best] = False
+            if tracker is not None:
+                tracker.add(best)
+            if categories is not None:
+                category = categories[best]
+                category_counts[category] = category_counts.get(category, 0) + 1
+                if category_counts[category] >= take:
+                    available[categories == category] = False
+            row = similarity.row(best)
+            if len(picks) == 1:
+                max_similarity = row.astype(np.float64)
+            else:
+                np.maximum(max_similarity, row, out=max_similarity)
+
+    return picks
+
+
+def mmr_strategy(similarity: SimilarityMatrix, relevance: np.ndarray, k: int, lambda_param: float = 0.7,
+                 tracker=None, diversity_weight: float = 0.0, **kwargs) -> List[int]:
+    return greedy_mmr(similarity, relevance, [(lambda_param, k)], tracker=tracker, diversity_weight=diversity_weight)
+
+
+def two_phase_strategy(similarity: SimilarityMatrix, relevance: np.ndarray, k: int, n_high_affinity: int = 3,
+                       lambda_param: float = 0.7, diversity_lambda: float = 0.3, tracker=None,
+                       diversity_weight: float = 0.0, **kwargs) -> List[int]:
+    # Phase 1: High-affinity items, Phase 2: Diversity focused items
+    n_phase1 = min(n_high_affinity, k)
+    return greedy_mmr(
+        similarity,
+        relevance,
+        [(lambda_param, n_phase1), (diversity_lambda, k - n_phase1)],
+        tracker=tracker,
+        diversity_weight=diversity_weight
+    )
+
+
+def dpp_strategy(similarity: SimilarityMatrix, relevance: np.ndarray, k: int, lambda_param: float = 0.7,
+                 tracker=None, diversity_weight: float = 0.0, **kwargs) -> List[int]:
+    """Greedy MAP for the kernel L = diag(q) S diag(q) with q = exp(alpha * relevance).
+
+    alpha = lambda / (2 * (1 - lambda)) trades relevance against diversity as
+    MMR's lambda does. Each pick extends an incremental Cholesky factor of
+    the picked rows, so the marginal log-det gain of every candidate is kept
+    up to date in O(n * picks so far): O(n * k^2) for k picks, against
+    O(n * k) for the MMR strategies. Once every remaining candidate is
+    spanned by the picks, the rest are filled by relevance. The kernel
+    already is the diversity objective, so diversity_weight is rejected.
+    """
+    if diversity_weight:
+        raise ValueError("dpp selection does not take a diversity_weight; use mmr, two_phase or category_quota")
+    n = len(relevance)
+    k = min(k, n)
+    if k <= 0:
+        return []
+    alpha = lambda_param / (2 * max(1 - lambda_param, 1e-3))
+    # Shifted by the max so exp never overflows; a constant factor leaves the argmax unchanged
+    quality = np.exp(alpha * (relevance - relevance.max()))
+    gains = quality ** 2
+    factors = np.zeros((k, n))
+    available = np.ones(n, dtype=bool)
+    picks = []
+    best = int(np.argmax(gains))
+    while len(picks) < k:
+        if gains[best] < _DPP_EPSILON:
+            break
+        j = len(picks)
+        picks.append(best)
+        available[best] = False
+        kernel_row = quality[best] * quality * similarity.row(best)
+        factors[j] = (kernel_row - factors[:j, best] @ factors[:j]) / np.sqrt(gains[best])
+        gains = gains - factors[j] ** 2
+        gains[~available] = -np.inf
+        best = int(np.argmax(gains))
+    if len(picks) < k:
+        remaining = np.flatnonzero(available)
+        picks.extend(remaining[np.argsort(-relevance[remaining], kind='stable')][:k - len(picks)].tolist())
+    return picks
+
+
+def category_quota_strategy(similarity: SimilarityMatrix, relevance: np.ndarray, k: int, categories: np.ndarray = None,
+                            diversify_take: int = 2, lambda_param: float = 0.7, tracker=None,
+                            diversity_weight: float = 0.0, **kwargs) -> List[int]:
+    if categories is None:
+        raise ValueError("category_quota selection needs a category per candidate")
+    return greedy_mmr(
+        similarity,
+        relevance,
+        [(lambda_param, k)],
+        tracker=tracker,
+        diversity_weight=diversity_weight,
+        categories=categories,
+        take=max(1, int(diversify_take))
+    )
+
+
+SELECTION_STRATEGIES: Dict[str, Callable[..., List[int]]] = {
+    'mmr': mmr_strategy,
+    'two_phase': two_phase_strategy,
+    'dpp': dpp_strategy,
+    'category_quota': category_quota_strategy
+}
+
+
+def select(strategy: str, similarity: SimilarityMatrix, relevance: np.ndarray, k: int, **options) -> List[int]:
+    if strategy not in SELECTION_STRATEGIES:
+        raise ValueError(f"Unknown selection strategy: {strategy} (choose from {', '.join(SELECTION_STRATEGIES)})")
+    return SELECTION_STRATEGIES[strategy](similarity, relevance, min(k, len(relevance)), **options)
+
+
+def _resolve_path(entity: Dict[str, Any], path: str) -> Any:
+    value = entity
+    for key in path.split('.'):
+        if isinstance(value, list):
+            value = value[0] if value else None
+        if not isinstance(value, dict):
+            return None
+        value = value.get(key)
+    if isinstance(value, list):
+        value = value[0] if value else None
+    if isinstance(value, dict):
+        value = value.get('name', value.get('id'))
+    return value
+
+
+def category_codes(entities: List[Dict[str, Any]], diversify_by: str = 'primary_cuisine') -> np.ndarray:
+    """One integer category per entity from a dotted field path (e.g. properties.geocode.city); entities missing it share one.
+
+    Raises ValueError when a field path resolves for none of the entities, which would collapse them into one category.
+    """
+    vocabulary: Dict[str, int] = {}
+    codes = []
+    resolved = 0
+    for entity in entities:
+        if diversify_by == 'primary_cuisine':
+            value = primary_cuisine(entity)
+        else:
+            value = _resolve_path(entity, diversify_by)
+        if value is not None:
+            resolved += 1
+        label = str(value) if value is not None else ''
+        codes.append(vocabulary.setdefault(label, len(vocabulary)))
+    if entities and not resolved and diversify_by != 'primary_cuisine':
+        raise ValueError(f"diversify_by path {diversify_by} is missing from every candidate")
+    return np.array(codes, dtype=np.int64)
@@ -2,11 +2,128 @@
 import { NextRequest, NextResponse } from 'next/server';
 import { spawn } from 'child_process';
 import path from 'path';
-import fs from 'fs/promises';
+import { randomUUID } from 'crypto';
+
+// One long-lived `diversification_server.py --frames` worker per server process.
+// Requests go to its stdin as 4-byte length-prefixed JSON frames; replies come
+// back the same way, possibly out of order, matched by id. Replies carry the
+// selected entity ids and positions, not the entities themselves.
+let worker = null;
+let pending = new Map();
+let buffered = Buffer.alloc(0);
+let nextId = 1;
+
+function failPending(message: string) {
+  const waiting = pending;
+  pending = new Map();
+  waiting.forEach(({ reject, timer }) => {
+    clearTimeout(timer);
+    reject(new Error(message));
+  });
+}
+
+function getWorker() {
+  if (worker) return worker;
+  
+  const tempDir = path.join(process.cwd(), 'temp');
+  const python = spawn('python', [
+    path.join(process.cwd(), 'diversification_server.py'),
+    '--frames',
+    // Shares identical-request results with other workers and restarts
+    '--result_cache_path', path.join(tempDir, 'result_cache.sqlite'),
+    // VW retrains in the background and is published for the next worker
+    '--vw_training', 'async',
+    '--vw_model_dir', path.join(tempDir, 'vw_models')
+  ], { cwd: process.cwd() });
+  buffered = Buffer.alloc(0);
+  
+  python.stdout.on('data', (chunk) => {
+    buffered = Buffer.concat([buffered, chunk]);
+    while (buffered.length >= 4) {
+      const length = buffered.readUInt32BE(0);
+      if (buffered.length < 4 + length) break;
+      const body = buffered.subarray(4, 4 + length).toString('utf-8');
+      buffered = buffered.subarray(4 + length);
+      let reply;
+      try {
+        reply = JSON.parse(body);
+      } catch (parseError) {
+        console.error('JSON parse error:', parseError, 'Raw frame:', body);
+        continue;
+      }
+      const entry = pending.get(reply.id);
+      if (!entry) continue;
+      pending.delete(reply.id);
+      clearTimeout(entry.timer);
+      entry.resolve(reply);
+    }
+  });
+  
+  python.stderr.on('data', (chunk) => {
+    console.error('Diversification worker:', chunk.toString());
+  });
+  
+  // Respawn lazily on the next request if the worker dies
+  // Only the first failure counts, so a late 'close' cannot fail a replacement worker's requests
+  let retired = false;
+  const reset = (reason: string) => {
+    if (retired) return;
+    retired = true;
+    if (worker === python) worker = null;
+    failPending(reason);
+  };
+  python.on('close', (code) => reset(`Diversification worker exited with code ${code}`));
+  python.on('error', (error) => {
+    console.error('Python spawn error:', error);
+    reset('Failed to start diversification worker');
+  });
+  // EPIPE from a worker that died mid-write would otherwise be an unhandled error that crashes the server
+  python.stdin.on('error', (error) => {
+    console.error('Diversification worker stdin error:', error);
+    reset(`Diversification worker stdin failed: ${error.message}`);
+    python.kill();
+  });
+  
+  worker = python;
+  return worker;
+}
+
+function diversifyFramed(message: any): Promise<any> {
+  return new Promise((resolve, reject) => {
+    const python = getWorker();
+    const id = nextId++;
+    const entry = { resolve, reject, timer: null };
+    entry.timer = setTimeout(() => {
+      pending.delete(id);
+      reject(new Error('Diversification worker timeout'));
+    }, 30000); // 30 second timeout
+    pending.set(id, entry);
+    
+    const body = Buffer.from(JSON.stringify({ ...message, id }), 'utf-8');
+    const header = Buffer.alloc(4);
+    header.writeUInt32BE(body.length, 0);
+    python.stdin.write(Buffer.concat([header, body]));
+  });
+}
+
+// Compact replies name the picks by position in the request's entities array
+function withEntities(data: any, entities: any[]) {
+  const { positions = [], entity_ids = [], ...rest } = data;
+  const byId = new Map(entities.map((entity) => [String(entity.entity_id), entity]));
+  return {
+    ...rest,
+    entity_ids,
+    diversified_recommendations: entity_ids.map((entityId, i) =>
+      positions[i] >= 0 ? entities[positions[i]] : byId.get(entityId)
+    ).filter(Boolean)
+  };
+}
 
 export async function POST(request: NextRequest) {
   try {
-    const { entities, userPreferences, interactions = [], options = {} } = await request.json();
+    const { entities, userPreferences, interactions = [], options = {}, userId } = await request.json();
+    // Echoed back in data.metadata with the engine's per-stage timings
+    const traceId = request.headers.get('x-trace-id') || randomUUID().replace(/-/g, '').slice(0, 16);
     
     // Validate input
     if (!entities || !Array.isArray(entities) || entities.length === 0) {
@@ -17,69 +134,44 @@ export async function POST(request: NextRequest) {
       return NextResponse.json({ error: 'User preferences array is required' }, { status: 400 });
     }
     
-    // Create temporary input file
-    const tempDir = path.join(process.cwd(), 'temp');
-    await fs.mkdir(tempDir, { recursive: true });
-    
-    const inputFile = path.join(tempDir, `input_${Date.now()}.json`);
-    const outputFile = path.join(tempDir, `output_${Date.now()}.json`);
-    
-    // Write entities to temporary file
-    await fs.writeFile(inputFile, JSON.stringify({ entities, interactions }));
-    
-    // python script arguments
-    const pythonScript = path.join(process.cwd(), 'diversification_engine.py');
-    const args = [
-        pythonScript,
-        '--input', inputFile,
-        '--output', outputFile,
-        '--preferences', JSON.stringify(userPreferences),
-        '--interactions', JSON.stringify(interactions),
-        '--n_total', (options.nTotal || 8).toString(),
-        '--n_high_affinity', (options.nHighAffinity || 3).toString(),
-        '--lambda_param', (options.lambdaParam || 0.7).toString()
-    ];
-    
-    // Execute Python script
-    const result = await new Promise<{ stdout: string; stderr: string }>((resolve, reject) => {
-      const python = spawn('python', args);
-      let stdout = '';
-      let stderr = '';
-      
-      python.stdout.on('data', (data) => {
-        stdout += data.toString();
+    // Prefer the warm diversification server (python diversification_server.py) when configured
+    const serverUrl = process.env.DIVERSIFICATION_SERVER_URL;
+    if (serverUrl) {
+      const response = await fetch(`${serverUrl.replace(/\/$/, '')}/diversify`, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json', 'X-Trace-Id': traceId },
+        body: JSON.stringify({ entities, userPreferences, interactions, options, userId, compact: true }),
+        signal: AbortSignal.timeout(30000)
       });
-      
-      python.stderr.on('data', (data) => {
-        stderr += data.toString();
+      const payload = await response.json();
+      if (!response.ok || !payload.success) {
+        throw new Error(`Diversification server error (${response.status}): ${payload.error}`);
+      }
+      return NextResponse.json({
+        success: true,
+        data: withEntities(payload.data, entities),
+        logs: ''
       });
-      
-      python.on('close', (code) => {
-        if (code === 0) {
-          resolve({ stdout, stderr });
-        } else {
-          reject(new Error(`Python script exited with code ${code}: ${stderr}`));
-        }
-      });
-      
-      // Set timeout
-      setTimeout(() => {
-        python.kill();
-        reject(new Error('Python script timeout'));
-      }, 30000);
-    });
-    
-    // Read results
-    const diversifiedResults = JSON.parse(await fs.readFile(outputFile, 'utf-8'));
+    }
     
-    // Cleanup temporary files
-    await fs.unlink(inputFile).catch(() => {});
-    await fs.unlink(outputFile).catch(() => {});
+    // Otherwise a persistent framed worker: no temp files, no arguments, only ids come back
+    const payload = await diversifyFramed({
+      op: 'diversify',
+      entities,
+      userPreferences,
+      interactions,
+      options,
+      userId,
+      traceId
+    });
+    if (!payload.success) {
+      throw new Error(`Diversification worker error (${payload.status_code}): ${payload.error}`);
+    }
     
     return NextResponse.json({
       success: true,
-      data: diversifiedResults,
-      logs: result.stdout
+      data: withEntities(payload.data, entities),
+      logs: ''
     });
     
   } catch (error) {
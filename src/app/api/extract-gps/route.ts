@@ -1,10 +1,92 @@
 // @ts-nocheck
 import { NextResponse } from 'next/server'
-import fs from 'fs/promises'
-import os from 'os'
-import path from 'path'
 import { spawn } from 'child_process'
 
+// One long-lived `extract_gps.py --serve` worker per server process. Images are
+// written to its stdin as length-prefixed frames (no temp file) and answers come
+// back as one JSON line per frame, in request order.
+let worker = null
+let pending = []
+let buffered = ''
+
+function failPending(message: string) {
+  const waiting = pending
+  pending = []
+  waiting.forEach(({ reject }) => reject(new Error(message)))
+}
+
+function getWorker() {
+  if (worker) return worker
+
+  const python = spawn('python3', ['extract_gps.py', '--serve'], {
+    cwd: process.cwd()
+  })
+  buffered = ''
+
+  python.stdout.on('data', (chunk) => {
+    buffered += chunk.toString()
+    let newline
+    while ((newline = buffered.indexOf('\n')) >= 0) {
+      const line = buffered.slice(0, newline)
+      buffered = buffered.slice(newline + 1)
+      const next = pending.shift()
+      if (!next) continue
+      clearTimeout(next.timer)
+      try {
+        next.resolve(JSON.parse(line))
+      } catch (parseError) {
+        console.error('JSON parse error:', parseError, 'Raw output:', line)
+        next.reject(new Error('Invalid response from GPS extraction'))
+      }
+    }
+  })
+
+  python.stderr.on('data', (chunk) => {
+    console.error('GPS worker:', chunk.toString())
+  })
+
+  // Respawn lazily on the next request if the worker dies
+  // Only the first failure counts, so a late 'close' cannot fail a replacement worker's requests
+  let retired = false
+  const reset = (reason: string) => {
+    if (retired) return
+    retired = true
+    if (worker === python) worker = null
+    failPending(reason)
+  }
+  python.on('close', (code) => reset(`GPS extraction worker exited with code ${code}`))
+  python.on('error', (error) => {
+    console.error('Python spawn error:', error)
+    reset('Failed to start GPS extraction process')
+  })
+  // EPIPE from a worker that died mid-write would otherwise be an unhandled error that crashes the server
+  python.stdin.on('error', (error) => {
+    console.error('GPS worker stdin error:', error)
+    reset(`GPS extraction worker stdin failed: ${error.message}`)
+    python.kill()
+  })
+
+  worker = python
+  return worker
+}
+
+function extractGps(data: Buffer): Promise<any> {
+  return new Promise((resolve, reject) => {
+    const python = getWorker()
+    const entry = { resolve, reject, timer: null }
+    // A stuck worker is killed so later requests get a fresh one
+    entry.timer = setTimeout(() => {
+      console.error('GPS extraction timed out, restarting worker')
+      python.kill()
+    }, 30000) // 30 second timeout
+    pending.push(entry)
+
+    const header = Buffer.alloc(4)
+    header.writeUInt32BE(data.length, 0)
+    python.stdin.write(Buffer.concat([header, data]))
+  })
+}
+
 export async function POST(request: Request) {
   try {
     const formData = await request.formData()
@@ -24,88 +106,25 @@ export async function POST(request: Request) {
       return NextResponse.json({ error: 'File too large (max 10MB)' }, { status: 400 })
     }
 
-    // Write to temporary file
-    const tmpDir = os.tmpdir()
-    const filename = `${Date.now()}-${file.name.replace(/[^a-zA-Z0-9.-]/g, '_')}`
-    const filePath = path.join(tmpDir, filename)
-    
-    const arrayBuffer = await file.arrayBuffer()
-    await fs.writeFile(filePath, Buffer.from(arrayBuffer))
-
-    return new Promise<NextResponse>((resolve) => {
-      const python = spawn('python3', ['extract_gps.py', filePath], { 
-        cwd: process.cwd(),
-        timeout: 30000 // 30 second timeout
-      })
-      
-      let stdout = ''
-      let stderr = ''
-      
-      python.stdout.on('data', (chunk) => {
-        stdout += chunk.toString()
-      })
-      
-      python.stderr.on('data', (chunk) => {
-        stderr += chunk.toString()
-      })
-      
-      python.on('close', async (code) => {
-        // Clean up temporary file
-        try {
-          await fs.unlink(filePath)
-        } catch (unlinkError) {
-          console.error('Error cleaning up temp file:', unlinkError)
-        }
-
-        if (code !== 0) {
-          console.error('Python script error:', stderr)
-          return resolve(
-            NextResponse.json(
-              { error: 'Failed to extract GPS data from image' }, 
-              { status: 500 }
-            )
-          )
-        }
-
-        try {
-          const result = JSON.parse(stdout.trim())
-          
-          if (result.error) {
-            return resolve(
-              NextResponse.json(
-                { error: result.error }, 
-                { status: 400 }
-              )
-            )
-          }
-          
-          return resolve(NextResponse.json(result))
-        } catch (parseError) {
-          console.error('JSON parse error:', parseError, 'Raw output:', stdout)
-          return resolve(
-            NextResponse.json(
-              { error: 'Invalid response from GPS extraction' }, 
-              { status: 500 }
-            )
-          )
-        }
-      })
+    let result
+    try {
+      result = await extractGps(Buffer.from(await file.arrayBuffer()))
+    } catch (workerError) {
+      console.error('GPS extraction error:', workerError)
+      return NextResponse.json(
+        { error: 'Failed to extract GPS data from image' }, 
+        { status: 500 }
+      )
+    }
 
-      python.on('error', async (error) => {
-        console.error('Python spawn error:', error)
-        try {
-          await fs.unlink(filePath)
-        } catch (unlinkError) {
-          console.error('Error cleaning up temp file after spawn error:', unlinkError)
-        }
-        resolve(
-          NextResponse.json(
-            { error: 'Failed to start GPS extraction process' }, 
-            { status: 500 }
-          )
-        )
-      })
-    })
+    if (result.error) {
+      return NextResponse.json(
+        { error: result.error }, 
+        { status: 400 }
+      )
+    }
+    
+    return NextResponse.json(result)
   } catch (error) {
     console.error('Request processing error:', error)
     return NextResponse.json(
@@ -113,4 +132,4 @@ export async function POST(request: Request) {
       { status: 500 }
     )
   }
-}
\ No newline at end of file
+}
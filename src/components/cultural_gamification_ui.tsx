@@ -830,6 +830,7 @@ const CulturalGamificationApp = () => {
           entities: entities,
           userPreferences: userPrefs,
           interactions: interactions,
+          userId: userProfile.userId,
           options: {
             nTotal: 8,
             nHighAffinity: 3,
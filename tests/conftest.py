@@ -0,0 +1,51 @@
+import os
+import sys
+
+# The engine modules live at the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import hashlib
+import re
+
+import numpy as np
+import pytest
+
+MODEL_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'saved_models', 'all-MiniLM-L6-v2')
+
+
+class HashEncoder:
+    """Deterministic stand-in for the sentence model: hashed bag of words, unit-normalized"""
+
+    dim = 64
+
+    def __init__(self):
+        self.calls = 0
+
+    def encode(self, texts, batch_size=32):
+        self.calls += 1
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            for word in re.findall(r'\w+', text.lower()):
+                vectors[row, int(hashlib.md5(word.encode('utf-8')).hexdigest(), 16) % self.dim] += 1.0
+        vectors[:, 0] += 0.01
+        return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+@pytest.fixture
+def make_engine(tmp_path, monkeypatch):
+    """DiversificationEngine factory using HashEncoder, so tests never load the real model"""
+    from diversification_engine import DiversificationEngine
+
+    monkeypatch.setenv('VW_PROBE_CACHE', str(tmp_path / 'vw_probe.json'))
+    engines = []
+
+    def make(**kwargs):
+        engine = DiversificationEngine(MODEL_PATH, **kwargs)
+        engine._encoder = HashEncoder()
+        engines.append(engine)
+        return engine
+
+    yield make
+    for engine in engines:
+        if engine.vw_trainer is not None:
+            engine.vw_trainer.close()
@@ -0,0 +1,96 @@
+import pytest
+
+from diversification_engine import run_diversification
+
+pytest.importorskip('vowpalwabbit')
+
+CUISINES = ['Thai', 'Mexican', 'Italian', 'Sushi', 'Cafe', 'Barbecue', 'Indian', 'Vegan']
+
+
+def _entities(n=24):
+    return [
+        {
+            'name': f"{CUISINES[i % len(CUISINES)]} place {i}",
+            'entity_id': f"E-{i}",
+            'properties': {'description': f"{CUISINES[i % len(CUISINES)].lower()} food spot", 'business_rating': 3 + i % 3},
+            'tags': [{'name': CUISINES[i % len(CUISINES)], 'type': 'urn:tag:genre:place:cuisine'}]
+        }
+        for i in range(n)
+    ]
+
+
+def _interactions(entities, n):
+    return [{'entity': entities[i], 'liked': i % 2 == 0} for i in range(n)]
+
+
+@pytest.fixture
+def engine(make_engine, tmp_path):
+    engine = make_engine(vw_training='async', vw_train_debounce_ms=0, vw_model_dir=str(tmp_path / 'models'))
+    if not engine.vw_available:
+        pytest.skip('VW backend unavailable')
+    return engine
+
+
+def _run(engine, entities, interactions):
+    return run_diversification(engine, entities, ['thai'], interactions, user_id='u1')
+
+
+def test_stale_snapshot_results_are_not_cached(engine):
+    entities = _entities()
+    history = _interactions(entities, 4)
+
+    cold = _run(engine, entities, history)
+    assert cold['metadata']['counters']['vw_snapshot_misses'] == 1
+    assert engine.finish_background_training(timeout=30)
+
+    # The snapshot now covers this history, so its result may be cached
+    warm = _run(engine, entities, history)
+    assert warm['metadata']['counters']['vw_snapshot_hits'] == 1
+    assert 'vw_snapshot_stale' not in warm['metadata']['counters']
+    assert _run(engine, entities, history)['result_cache']['hit']
+
+    # One more swipe: served from the old snapshot while the retrain is pending, and not cached
+    longer = _interactions(entities, 5)
+    stale = _run(engine, entities, longer)
+    assert stale['metadata']['counters']['vw_snapshot_stale'] == 1
+    assert not stale['result_cache']['hit']
+    assert engine.finish_background_training(timeout=30)
+
+    fresh = _run(engine, entities, longer)
+    assert not fresh['result_cache']['hit']
+    assert 'vw_snapshot_stale' not in fresh['metadata']['counters']
+
+
+def test_retrains_resume_from_the_previous_snapshot(engine):
+    entities = _entities()
+    _run(engine, entities, _interactions(entities, 4))
+    assert engine.finish_background_training(timeout=30)
+    _run(engine, entities, _interactions(entities, 7))
+    assert engine.finish_background_training(timeout=30)
+    stats = engine.vw_trainer.stats()
+    assert (stats['trainings'], stats['online_updates']) == (2, 1)
+
+    # The updated copy scores like a model trained on the whole history at once
+    lines = engine._vw_training_lines(_interactions(entities, 7), ['thai'])
+    full = engine.vw_scorer.train(lines)
+    probe = [line.split(' ', 1)[1] for line in lines]
+    try:
+        with engine.vw_trainer.lease('u1') as snapshot:
+            assert snapshot.applied == 7
+            assert snapshot.model.predict(probe) == pytest.approx(full.predict(probe), abs=1e-3)
+    finally:
+        full.close()
+
+    # A rewritten history cannot be resumed
+    _run(engine, entities, _interactions(entities, 7)[1:])
+    assert engine.finish_background_training(timeout=30)
+    assert engine.vw_trainer.stats()['online_updates'] == 1
+
+
+def test_anonymous_requests_train_a_throwaway_model(engine):
+    entities = _entities()
+    results = run_diversification(engine, entities, ['thai'], _interactions(entities, 4))
+    counters = results['metadata']['counters']
+    assert 'vw_snapshot_misses' not in counters and 'vw_snapshot_hits' not in counters
+    assert counters['vw_predictions'] == len(entities)
+    assert engine.vw_trainer.stats()['scheduled'] == 0
@@ -0,0 +1,94 @@
+import json
+import multiprocessing
+
+import pytest
+
+from batch_diversify import SharedCatalogue, load_checkpoint, read_profiles, run_batch
+from benchmark_engine import generate_entities
+
+
+def _write_profiles(path, profiles):
+    path.write_text(''.join(json.dumps(profile) + '\n' for profile in profiles), encoding='utf-8')
+    return list(read_profiles(str(path)))
+
+
+def _records(path):
+    return [json.loads(line) for line in open(path, encoding='utf-8')]
+
+
+def test_checkpoint_truncates_torn_line_and_skips_done(tmp_path):
+    output = tmp_path / 'out.jsonl'
+    good = json.dumps({'key': 'u1', 'success': True}) + '\n' + json.dumps({'key': 'u2', 'success': False}) + '\n'
+    output.write_text(good + '{"key": "u3", "succ', encoding='utf-8')
+    assert load_checkpoint(str(output)) == {'u1'}
+    assert output.read_text(encoding='utf-8') == good
+
+
+def test_resume_only_runs_missing_users(make_engine, tmp_path):
+    engine = make_engine()
+    catalogue = SharedCatalogue(engine, generate_entities(30, seed=4))
+    profiles = _write_profiles(tmp_path / 'profiles.jsonl', [
+        {'user_id': 'u1', 'preferences': ['Thai']},
+        {'user_id': 'u2', 'preferences': ['Cafe', 'Brunch']},
+        {'user_id': 'u3'}
+    ])
+    output = str(tmp_path / 'out.jsonl')
+    first = run_batch(catalogue, profiles, output, workers=1)
+    assert (first['users_succeeded'], first['users_failed']) == (2, 1)
+
+    second = run_batch(catalogue, profiles, output, workers=1)
+    assert (second['users_skipped'], second['users_succeeded'], second['users_failed']) == (2, 0, 1)
+    assert [record['key'] for record in _records(output)] == ['u1', 'u2', 'u3', 'u3']
+
+
+@pytest.mark.skipif('fork' not in multiprocessing.get_all_start_methods(), reason='needs fork')
+def test_forked_workers_never_encode(make_engine, tmp_path, monkeypatch):
+    pytest.importorskip('vowpalwabbit')
+    engine = make_engine()
+    if not engine.vw_available:
+        pytest.skip('VW backend unavailable')
+    entities = generate_entities(30, seed=5)
+    # Interactions on entities outside the catalogue train VW on embeddings nobody computed yet
+    outside = generate_entities(12, seed=6)
+    profiles = _write_profiles(tmp_path / 'profiles.jsonl', [
+        {'user_id': f"u{i}", 'preferences': ['Thai'], 'interactions': [
+            {'entity': outside[(i + j) % len(outside)], 'liked': j % 2 == 0} for j in range(4)
+        ]}
+        for i in range(4)
+    ])
+
+    output = str(tmp_path / 'out.jsonl')
+    summary = run_batch(SharedCatalogue(engine, entities), profiles, output, workers=2, chunksize=1)
+    assert summary['users_succeeded'] == 4
+    assert all(record['data']['vw_enhanced'] for record in _records(output))
+
+    # Without the parent's pass the workers refuse to encode rather than running the model after fork
+    monkeypatch.setattr(SharedCatalogue, 'embed_interactions', lambda self, interaction_sets: None)
+    engine.embedding_cache.clear()
+    output = str(tmp_path / 'refused.jsonl')
+    summary = run_batch(SharedCatalogue(engine, entities), profiles, output, workers=2, chunksize=1)
+    assert summary['users_failed'] == 4
+    assert all('embedded in the parent' in record['error'] for record in _records(output))
+
+
+def test_batch_payload_matches_the_server_and_keeps_no_user_models(make_engine, tmp_path):
+    from diversification_engine import run_diversification
+
+    engine = make_engine(result_cache_size=0)
+    entities = generate_entities(30, seed=7)
+    interactions = [{'entity': entities[i], 'liked': i % 2 == 0} for i in range(4)]
+    profiles = _write_profiles(tmp_path / 'profiles.jsonl', [
+        {'user_id': 'u1', 'preferences': ['Thai', 'Cafe'], 'interactions': interactions, 'options': {'nTotal': 5}}
+    ])
+    output = str(tmp_path / 'out.jsonl')
+    run_batch(SharedCatalogue(engine, entities), profiles, output, workers=1)
+    batch = _records(output)[0]['data']
+    assert engine.user_models.stats()['users'] == 0
+
+    served = json.loads(json.dumps(run_diversification(engine, entities, ['Thai', 'Cafe'], interactions, n_total=5)))
+    served.pop('metadata')
+    assert set(batch) == set(served)
+    assert batch['parameters'] == served['parameters']
+    assert [e['entity_id'] for e in batch['diversified_recommendations']] == \
+        [e['entity_id'] for e in served['diversified_recommendations']]
+    assert batch['scores'] == pytest.approx(served['scores'], abs=1e-6)
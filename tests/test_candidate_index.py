@@ -0,0 +1,53 @@
+import numpy as np
+
+from candidate_index import CandidateIndex, ExactIndex, IVFIndex
+
+
+def _clustered(n=4000, dim=32, clusters=40, seed=0):
+    rng = np.random.default_rng(seed)
+    centres = rng.normal(size=(clusters, dim))
+    points = centres[rng.integers(clusters, size=n)] + 0.3 * rng.normal(size=(n, dim))
+    points /= np.linalg.norm(points, axis=1, keepdims=True)
+    return points.astype(np.float32), rng
+
+
+def test_exact_index_returns_the_true_top_m():
+    embeddings, rng = _clustered(n=500)
+    query = embeddings[rng.integers(len(embeddings))]
+    expected = np.argsort(-(embeddings @ query), kind='stable')[:20]
+    np.testing.assert_array_equal(ExactIndex(embeddings).search(query, 20), expected)
+
+
+def test_ivf_recall_against_exact_top_m():
+    embeddings, rng = _clustered()
+    index = IVFIndex(embeddings, n_probe=8)
+    exact = ExactIndex(embeddings)
+    recalls = []
+    for query in embeddings[rng.choice(len(embeddings), size=50, replace=False)]:
+        approx = set(index.search(query, 100).tolist())
+        reference = set(exact.search(query, 100).tolist())
+        recalls.append(len(approx & reference) / len(reference))
+    assert np.mean(recalls) >= 0.9
+
+
+def test_ivf_search_with_every_list_probed_is_exact():
+    embeddings, rng = _clustered(n=1000)
+    index = IVFIndex(embeddings)
+    query = embeddings[rng.integers(len(embeddings))]
+    np.testing.assert_array_equal(
+        index.search(query, 50, n_probe=index.n_lists), ExactIndex(embeddings).search(query, 50)
+    )
+
+
+def test_shortlist_mixes_relevant_and_every_cuisine():
+    embeddings, rng = _clustered(n=1000)
+    categories = [f"cuisine-{i % 7}" for i in range(len(embeddings))]
+    index = CandidateIndex(embeddings, categories, backend='exact')
+    query = embeddings[0]
+    shortlist = index.shortlist(query, 50, diversity_fraction=0.2)
+
+    assert len(shortlist) == 50
+    assert len(set(shortlist.tolist())) == 50
+    np.testing.assert_array_equal(shortlist[:40], ExactIndex(embeddings).search(query, 40))
+    assert {categories[i] for i in shortlist[40:]} == set(categories)
+    assert index.recall_report(embeddings[:5], 40)['mean_recall'] == 1.0
@@ -0,0 +1,76 @@
+import copy
+
+from benchmark_engine import generate_entities
+
+
+def test_feature_store_follows_content_under_same_ids(make_engine):
+    engine = make_engine()
+    entities = generate_entities(20, seed=1)
+    store = engine.feature_store_for(entities)
+    assert engine.feature_store_for(copy.deepcopy(entities)) is store
+
+    edited = copy.deepcopy(entities)
+    edited[3]['properties']['description'] = 'now a late-night ramen counter'
+    edited[5]['tags'] = edited[5]['tags'][:1]
+    edited_store = engine.feature_store_for(edited)
+    assert edited_store is not store
+    assert 'ramen' in edited_store.feature_texts[3]
+    assert len(edited_store.entity_tag_ids(5)) == 1
+
+
+def test_geo_index_follows_moved_entities(make_engine):
+    engine = make_engine()
+    entities = generate_entities(10, seed=2)
+    before = engine.geo_index_for(entities)
+    moved = copy.deepcopy(entities)
+    moved[0]['location'] = {'lat': 51.5, 'lon': -0.12}
+    assert engine.geo_index_for(moved) is not before
+    nearest = engine.nearby_entities(moved, 51.5, -0.12, k=1)[0]
+    assert nearest['entity'] is moved[0]
+
+
+def test_anonymous_entities_of_equal_length_do_not_collide(make_engine):
+    engine = make_engine()
+    first = [{'properties': {'description': 'thai curry'}}, {'properties': {'description': 'tacos'}}]
+    second = [{'properties': {'description': 'sushi bar'}}, {'properties': {'description': 'bakery'}}]
+    assert engine.feature_store_for(first).feature_texts == ['thai curry', 'tacos']
+    assert engine.feature_store_for(second).feature_texts == ['sushi bar', 'bakery']
+
+
+def test_shortlist_reuses_catalogue_store(make_engine):
+    engine = make_engine()
+    entities = generate_entities(60, seed=3)
+    picks = engine.diversify_recommendations(entities, ['Thai'], candidate_top_m=20)
+    assert len(picks) == 8
+    assert engine._cached_feature_store(entities) is not None
+
+
+def test_a_held_catalogue_is_hashed_once(make_engine, monkeypatch):
+    import diversification_engine
+
+    engine = make_engine()
+    entities = generate_entities(15, seed=4)
+    hashed = []
+    fields = diversification_engine._catalogue_fields
+    monkeypatch.setattr(diversification_engine, '_catalogue_fields', lambda entity: hashed.append(1) or fields(entity))
+    for preferences in (['Thai'], ['Cafe'], ['Sushi']):
+        engine.diversify_recommendations(entities, preferences, n_total=4, candidate_top_m=8)
+    assert len(hashed) == len(entities)
+
+    # A new list with the same content is hashed again but still finds the cached store
+    store = engine.feature_store_for(entities)
+    assert engine.feature_store_for(copy.deepcopy(entities)) is store
+    assert len(hashed) == 2 * len(entities)
+
+
+def test_clear_caches_rebuilds_from_scratch(make_engine):
+    engine = make_engine()
+    entities = generate_entities(12, seed=5)
+    store = engine.feature_store_for(entities)
+    engine.diversify_recommendations(entities, ['Thai'], n_total=4)
+    assert engine.embedding_cache.stats()['memory_entries'] == len(entities)
+
+    engine.clear_caches()
+    assert engine.embedding_cache.stats()['memory_entries'] == 0
+    assert engine._cached_feature_store(entities) is None
+    assert engine.feature_store_for(entities) is not store
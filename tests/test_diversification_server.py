@@ -0,0 +1,69 @@
+import io
+import json
+
+import pytest
+
+from benchmark_engine import generate_entities
+from diversification_server import DiversificationService, parse_args, serve_stdio
+
+
+@pytest.fixture
+def service(make_engine):
+    service = DiversificationService()
+    service.engine = make_engine()
+    service._ready.set()
+    return service
+
+
+def _serve(service, requests):
+    stdin = io.StringIO(''.join(json.dumps(request) + '\n' for request in requests))
+    stdout = io.StringIO()
+    serve_stdio(service, max_workers=4, stdin=stdin, stdout=stdout)
+    return {reply['id']: reply for reply in map(json.loads, stdout.getvalue().splitlines())}
+
+
+def test_stdio_answers_every_request_by_id(service):
+    entities = generate_entities(20, seed=2)
+    replies = _serve(service, [
+        {'id': i, 'entities': entities, 'userPreferences': ['Thai'], 'options': {'nTotal': 4}}
+        for i in range(6)
+    ] + [{'id': 'health', 'op': 'health'}])
+    assert len(replies) == 7
+    picks = [
+        [entity['entity_id'] for entity in reply['data']['diversified_recommendations']]
+        for key, reply in replies.items() if key != 'health'
+    ]
+    assert all(ids == picks[0] and len(ids) == 4 for ids in picks)
+    assert replies['health']['status'] == 'ok'
+    assert service.requests_served == 6
+
+
+def test_bad_requests_get_client_errors(service):
+    replies = _serve(service, [
+        {'id': 1, 'op': 'explode'},
+        {'id': 2, 'userPreferences': ['Thai']},
+        {'id': 3, 'entities': generate_entities(3), 'userPreferences': 'Thai'},
+        {'id': 4, 'entities': generate_entities(3), 'userPreferences': ['Thai'], 'options': {'candidateTopM': None}},
+        {'id': 5, 'entities': generate_entities(3), 'userPreferences': ['Thai'], 'options': {'candidateTopM': 'many'}}
+    ])
+    assert [replies[i]['status_code'] for i in (1, 2, 3, 4, 5)] == [400] * 5
+    assert 'candidateTopM' in replies[5]['error']
+    assert not any(reply['success'] for reply in replies.values())
+
+
+def test_requests_before_warm_up_are_unavailable():
+    replies = _serve(DiversificationService(), [{'id': 1, 'entities': generate_entities(3), 'userPreferences': []}])
+    assert replies[1]['status_code'] == 503
+
+
+def test_candidate_top_m_accepts_numeric_strings(service):
+    replies = _serve(service, [
+        {'id': 1, 'entities': generate_entities(30, seed=4), 'userPreferences': ['Thai'], 'options': {'nTotal': 4, 'candidateTopM': '10'}}
+    ])
+    assert replies[1]['status_code'] == 200
+    assert len(replies[1]['data']['diversified_recommendations']) == 4
+
+
+def test_unknown_encoder_backend_is_rejected():
+    with pytest.raises(SystemExit):
+        parse_args(['--encoder_backend', 'tensorrt'])
@@ -0,0 +1,56 @@
+import pytest
+
+from benchmark_engine import generate_entities
+
+
+def _list_based_selection(engine, entities, preferences, n_total, n_high_affinity, lambda_param):
+    """The original selection: re-score every remaining candidate against the selected list for each pick"""
+    selected = []
+    remaining = entities.copy()
+    for _ in range(min(n_high_affinity, len(remaining))):
+        scores = engine.calculate_mmr_scores(remaining, preferences, selected, lambda_param)
+        scores.sort(key=lambda x: x[1], reverse=True)
+        selected.append(remaining.pop(scores[0][0]))
+    while len(selected) < min(n_total, len(entities)) and remaining:
+        scores = engine.calculate_mmr_scores(remaining, preferences, selected, 0.3)
+        scores.sort(key=lambda x: x[1], reverse=True)
+        selected.append(remaining.pop(scores[0][0]))
+    return selected
+
+
+@pytest.mark.parametrize('size, n_total, n_high_affinity, lambda_param', [
+    (40, 8, 3, 0.7),
+    (40, 5, 0, 0.7),
+    (25, 10, 5, 0.5),
+    (6, 8, 3, 0.9)
+])
+def test_incremental_mmr_matches_list_based_selection(make_engine, size, n_total, n_high_affinity, lambda_param):
+    engine = make_engine()
+    entities = generate_entities(size, tags_per_entity=6, seed=size)
+    preferences = ['Thai', 'outdoor seating', 'Brunch']
+    picks = engine.diversify_recommendations(
+        entities, preferences, n_total=n_total, n_high_affinity=n_high_affinity, lambda_param=lambda_param
+    )
+    expected = _list_based_selection(engine, entities, preferences, n_total, n_high_affinity, lambda_param)
+    assert [e['entity_id'] for e in picks] == [e['entity_id'] for e in expected]
+
+
+def test_each_entity_is_encoded_once(make_engine):
+    engine = make_engine()
+    encoded = []
+    encode = engine._encoder.encode
+    engine._encoder.encode = lambda texts, **kwargs: encoded.extend(texts) or encode(texts, **kwargs)
+    entities = generate_entities(30, seed=3)
+    features = sorted(engine.extract_entity_features(entity) for entity in entities)
+    engine.diversify_recommendations(entities, ['Thai'], n_total=8)
+    engine.diversify_recommendations(entities, ['Cafe'], n_total=8)
+    # Besides the two preference queries, every entity text goes through the model exactly once
+    assert sorted(text for text in encoded if text in features) == features
+    assert len(encoded) == len(features) + 2
+
+
+def test_empty_and_tiny_pools(make_engine):
+    engine = make_engine()
+    assert engine.diversify_recommendations([], ['Thai']) == []
+    entities = generate_entities(2, seed=1)
+    assert len(engine.diversify_recommendations(entities, ['Thai'], n_total=8)) == 2
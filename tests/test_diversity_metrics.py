@@ -0,0 +1,59 @@
+import math
+from collections import Counter
+
+import numpy as np
+import pytest
+
+from benchmark_engine import generate_entities
+from candidate_index import primary_cuisine
+from diversity_metrics import DiversityColumns, DiversityTracker
+
+
+@pytest.fixture
+def columns():
+    entities = generate_entities(60, tags_per_entity=3, seed=3)
+    # A few entities without any cuisine tag
+    for entity in entities[::7]:
+        entity['tags'] = []
+    embeddings = np.random.default_rng(0).normal(size=(len(entities), 16))
+    return entities, DiversityColumns(entities, embeddings)
+
+
+def _metric(columns, rows, target):
+    return columns.summarize(np.array(rows, dtype=np.int64)).get(target, 0.0)
+
+
+@pytest.mark.parametrize('target', DiversityTracker.TARGETS)
+def test_gain_matches_summarize_deltas(columns, target):
+    _, columns = columns
+    tracker = DiversityTracker(columns, target)
+    picks = np.random.default_rng(1).permutation(len(columns))[:12]
+    for pick in picks:
+        before = _metric(columns, tracker.rows, target)
+        gain = tracker.gain()
+        expected = [_metric(columns, tracker.rows + [row], target) - before for row in range(len(columns))]
+        np.testing.assert_allclose(gain, expected, atol=1e-9)
+        tracker.add(int(pick))
+    assert tracker.metrics()[target] == pytest.approx(_metric(columns, tracker.rows, target))
+
+
+def test_summarize_matches_direct_computation(columns):
+    entities, columns = columns
+    rows = list(range(0, 40, 3))
+    metrics = columns.summarize(np.array(rows))
+
+    cuisines = Counter(primary_cuisine(entities[row]) for row in rows if primary_cuisine(entities[row]))
+    total = sum(cuisines.values())
+    entropy = -sum(count / total * math.log2(count / total) for count in cuisines.values())
+    assert metrics['cuisine_entropy'] == pytest.approx(entropy)
+    assert metrics['cuisine_gini'] == pytest.approx(1 - sum((count / total) ** 2 for count in cuisines.values()))
+
+    unit = columns.embeddings[rows]
+    pairs = [(i, j) for i in range(len(rows)) for j in range(i + 1, len(rows))]
+    assert metrics['intra_list_diversity'] == pytest.approx(np.mean([1 - unit[i] @ unit[j] for i, j in pairs]))
+    assert metrics['total_entities'] == len(rows)
+
+
+def test_unknown_target_is_rejected(columns):
+    with pytest.raises(ValueError):
+        DiversityTracker(columns[1], 'novelty')
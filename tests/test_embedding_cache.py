@@ -0,0 +1,53 @@
+import numpy as np
+
+from embedding_cache import EmbeddingCache
+
+
+def _encode(texts):
+    return np.array([[len(text), text.count('a'), 1.0] for text in texts], dtype=np.float32)
+
+
+def test_disk_tier_survives_a_restart(tmp_path):
+    ids, texts = ['E-1', 'E-2', 'E-3'], ['thai noodles', 'pizza', 'banana bread']
+    expected = EmbeddingCache('m', disk_dir=str(tmp_path)).get_or_encode(ids, texts, _encode)
+
+    def fail(texts):
+        raise AssertionError(f"re-encoded {texts}")
+
+    reopened = EmbeddingCache('m', disk_dir=str(tmp_path))
+    np.testing.assert_array_equal(reopened.get_or_encode(ids, texts, fail), expected)
+    assert reopened.stats()['disk_hits'] == 3
+
+
+def test_disk_tier_is_keyed_by_model_and_text(tmp_path):
+    EmbeddingCache('m', disk_dir=str(tmp_path)).get_or_encode(['E-1'], ['thai noodles'], _encode)
+    reopened = EmbeddingCache('m', disk_dir=str(tmp_path))
+    reopened.get_or_encode(['E-1'], ['thai curry'], _encode)
+    other_model = EmbeddingCache('other', disk_dir=str(tmp_path))
+    other_model.get_or_encode(['E-1'], ['thai noodles'], _encode)
+    assert reopened.stats()['misses'] == 1
+    assert other_model.stats()['misses'] == 1
+
+
+def test_memory_tier_evicts_least_recently_used():
+    cache = EmbeddingCache('m', max_entries=2)
+    cache.get_or_encode(['a', 'b'], ['x', 'y'], _encode)
+    cache.get_or_encode(['a'], ['x'], _encode)
+    cache.get_or_encode(['c'], ['z'], _encode)
+
+    assert cache.stats()['evictions'] == 1
+    assert cache.get_many([cache.key('a', 'x')])[0] is not None
+    assert cache.get_many([cache.key('b', 'y')])[0] is None
+    assert cache.get_many([cache.key('c', 'z')])[0] is not None
+
+
+def test_duplicates_in_one_request_encode_once():
+    batches = []
+
+    def encode(texts):
+        batches.append(list(texts))
+        return _encode(texts)
+
+    vectors = EmbeddingCache('m').get_or_encode(['a', 'b', 'a'], ['x', 'y', 'x'], encode)
+    assert batches == [['x', 'y']]
+    np.testing.assert_array_equal(vectors[0], vectors[2])
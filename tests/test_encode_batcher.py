@@ -0,0 +1,74 @@
+import threading
+
+import numpy as np
+
+from encode_batcher import EncodeBatcher
+
+
+def _rows(texts):
+    """One row per text, identifiable from the text itself"""
+    rows = np.zeros((len(texts), 3), dtype=np.float32)
+    for row, text in zip(rows, texts):
+        if text:
+            row[:2] = [float(part) for part in text.split('-')]
+    return rows
+
+
+def _concurrently(batcher, n_callers, texts_per_caller):
+    results = [None] * n_callers
+    start = threading.Barrier(n_callers)
+
+    def call(caller):
+        start.wait()
+        results[caller] = batcher.encode([f"{caller}-{i}" for i in range(texts_per_caller)])
+
+    threads = [threading.Thread(target=call, args=(caller,)) for caller in range(n_callers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results
+
+
+def test_rows_scatter_back_to_their_callers():
+    batches = []
+
+    def encode(texts):
+        batches.append(len(texts))
+        return _rows(texts)
+
+    batcher = EncodeBatcher(encode, max_batch_size=64, max_wait_ms=50)
+    try:
+        results = _concurrently(batcher, 8, 3)
+    finally:
+        batcher.close()
+
+    for caller, rows in enumerate(results):
+        np.testing.assert_array_equal(rows, _rows([f"{caller}-{i}" for i in range(3)]))
+    assert sum(batches) == 24
+    assert len(batches) < 8
+
+
+def test_queue_depth_counts_requests_drained_into_the_batch():
+    batcher = EncodeBatcher(_rows, max_batch_size=64, max_wait_ms=200)
+    try:
+        _concurrently(batcher, 4, 1)
+        stats = batcher.stats()
+    finally:
+        batcher.close()
+    assert stats['batches'] == 1
+    assert stats['queue_depth_histogram'] == {'4': 1}
+
+
+def test_empty_encode_is_a_two_dimensional_matrix():
+    # SentenceTransformer returns shape (0,) for an empty list
+    def encode(texts):
+        return _rows(texts) if texts else np.zeros(0, dtype=np.float32)
+
+    batcher = EncodeBatcher(encode)
+    try:
+        assert batcher.encode([]).shape == (0, 3)
+        batcher.encode(['1-2'])
+        assert batcher.encode([]).shape == (0, 3)
+    finally:
+        batcher.close()
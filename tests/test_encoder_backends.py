@@ -0,0 +1,59 @@
+import os
+import threading
+
+import numpy as np
+import pytest
+
+from encoder_backends import export_onnx, mean_pool, quantize_onnx
+
+
+def _tiny_model(path):
+    onnx = pytest.importorskip('onnx')
+    from onnx import TensorProto, helper, numpy_helper
+
+    weights = numpy_helper.from_array(np.random.default_rng(0).normal(size=(16, 8)).astype(np.float32), 'w')
+    graph = helper.make_graph(
+        [helper.make_node('MatMul', ['x', 'w'], ['y'])],
+        'tiny',
+        [helper.make_tensor_value_info('x', TensorProto.FLOAT, [None, 16])],
+        [helper.make_tensor_value_info('y', TensorProto.FLOAT, [None, 8])],
+        [weights]
+    )
+    onnx.save(helper.make_model(graph, opset_imports=[helper.make_opsetid('', 14)], ir_version=8), path)
+
+
+def test_concurrent_quantization_leaves_one_complete_model(tmp_path):
+    pytest.importorskip('onnxruntime')
+    import onnxruntime
+
+    onnx_path = str(tmp_path / 'model.onnx')
+    _tiny_model(onnx_path)
+    errors = []
+
+    def run():
+        try:
+            quantize_onnx(onnx_path)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=run) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not errors
+    assert sorted(os.listdir(tmp_path)) == ['model.onnx', 'model_int8.onnx']
+    session = onnxruntime.InferenceSession(str(tmp_path / 'model_int8.onnx'), providers=['CPUExecutionProvider'])
+    assert session.run(None, {'x': np.ones((2, 16), dtype=np.float32)})[0].shape == (2, 8)
+
+
+def test_existing_export_is_reused(tmp_path):
+    (tmp_path / 'model.onnx').write_bytes(b'exported')
+    assert export_onnx('unused', str(tmp_path)) == str(tmp_path / 'model.onnx')
+
+
+def test_mean_pool_ignores_padding():
+    tokens = np.array([[[1.0, 0.0], [3.0, 0.0], [100.0, 100.0]]])
+    mask = np.array([[1, 1, 0]])
+    assert mean_pool(tokens, mask, normalize=False).tolist() == [[2.0, 0.0]]
+    assert mean_pool(tokens, mask).tolist() == [[1.0, 0.0]]
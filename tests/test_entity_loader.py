@@ -0,0 +1,66 @@
+import json
+
+import pytest
+
+from entity_loader import EntityStore, iter_entity_spans, project_entity
+
+ENTITIES = [
+    {
+        'name': 'Café Crème',
+        'entity_id': 'A-1',
+        'properties': {'description': 'Espresso — and croissants', 'keywords': [{'name': 'x'}]},
+        'tags': [{'name': 'Cafe', 'type': 'urn:tag:genre:place:cuisine', 'id': 'urn:tag:cafe'}]
+    },
+    {'name': 'Tatsumi Sushi', 'entity_id': 'B-2', 'properties': {'business_rating': 4.5}, 'tags': []}
+]
+
+
+@pytest.fixture(params=['\n', '\r\n'], ids=['lf', 'crlf'])
+def dump(tmp_path, request):
+    path = tmp_path / 'dump.json'
+    text = json.dumps({'results': {'entities': ENTITIES}}, indent=2, ensure_ascii=False)
+    path.write_bytes(text.replace('\n', request.param).encode('utf-8'))
+    return str(path)
+
+
+def test_spans_match_bytes_on_disk(dump):
+    with open(dump, 'rb') as f:
+        data = f.read()
+    spans = list(iter_entity_spans(dump))
+    assert [entity for entity, _, _ in spans] == ENTITIES
+    for entity, offset, length in spans:
+        assert json.loads(data[offset:offset + length]) == entity
+
+
+def test_full_records_round_trip(dump):
+    store = EntityStore.load(dump)
+    assert store.entities == [project_entity(entity) for entity in ENTITIES]
+    assert store.full_records(list(reversed(store.entities))) == list(reversed(ENTITIES))
+    assert store.get_full('B-2') == ENTITIES[1]
+
+
+def test_full_records_rejects_foreign_entity(dump):
+    store = EntityStore.load(dump)
+    with pytest.raises(KeyError):
+        store.full_records([{'name': 'elsewhere', 'entity_id': 'Z-9'}])
+
+
+@pytest.mark.parametrize('shape', [
+    lambda entities: entities,
+    lambda entities: {'entities': entities},
+    lambda entities: {'meta': {'entities': 'not these'}, 'results': {'entities': entities}}
+])
+def test_supported_shapes(tmp_path, shape):
+    path = tmp_path / 'dump.json'
+    path.write_text(json.dumps(shape(ENTITIES)), encoding='utf-8')
+    assert [entity for entity, _, _ in iter_entity_spans(str(path))] == ENTITIES
+
+
+def test_keep_paths_survive_projection():
+    entity = {
+        'name': 'x',
+        'properties': {'description': 'd', 'geocode': {'city': 'Austin', 'country_code': 'US'}, 'subtype': ['cafe']}
+    }
+    projected = project_entity(entity, ('properties.geocode.city', 'properties.subtype', 'properties.missing'))
+    assert projected['properties'] == {'description': 'd', 'geocode': {'city': 'Austin'}, 'subtype': ['cafe']}
+    assert 'geocode' not in project_entity(entity)['properties']
@@ -0,0 +1,119 @@
+import io
+import json
+import struct
+
+import pytest
+
+from extract_gps import extract_gps_from_bytes, extract_gps_from_image, find_exif_block, serve_frames
+
+# 30° 16' 2.4" N, 97° 44' 34.8" W
+LATITUDE = 30 + 16 / 60 + 2.4 / 3600
+LONGITUDE = -(97 + 44 / 60 + 34.8 / 3600)
+
+
+def _tiff(endian='<'):
+    """A minimal EXIF block: IFD0 holding only the GPS pointer, then a GPS IFD"""
+    def entry(tag, field_type, count, value):
+        return struct.pack(endian + 'HHL', tag, field_type, count) + value
+
+    def rationals(*pairs):
+        return b''.join(struct.pack(endian + 'LL', *pair) for pair in pairs)
+
+    gps_offset = 8 + 2 + 12 + 4
+    data_offset = gps_offset + 2 + 4 * 12 + 4
+    ifd0 = struct.pack(endian + 'H', 1) + entry(0x8825, 4, 1, struct.pack(endian + 'L', gps_offset)) + b'\0' * 4
+    gps = struct.pack(endian + 'H', 4)
+    gps += entry(1, 2, 2, b'N\0\0\0')
+    gps += entry(2, 5, 3, struct.pack(endian + 'L', data_offset))
+    gps += entry(3, 2, 2, b'W\0\0\0')
+    gps += entry(4, 5, 3, struct.pack(endian + 'L', data_offset + 24))
+    gps += b'\0' * 4
+    values = rationals((30, 1), (16, 1), (24, 10)) + rationals((97, 1), (44, 1), (348, 10))
+    header = (b'II*\0' if endian == '<' else b'MM\0*') + struct.pack(endian + 'L', 8)
+    return header + ifd0 + gps + values
+
+
+def _segment(code, payload):
+    return bytes([0xFF, code]) + struct.pack('>H', len(payload) + 2) + payload
+
+
+def _jpeg(exif, before=b''):
+    jfif = _segment(0xE0, b'JFIF\0\x01\x01\0\0\x01\0\x01\0\0')
+    xmp = _segment(0xE1, b'http://ns.adobe.com/xap/1.0/\0<x/>')
+    scan = b'\xff\xda' + b'\x00' * 64 + b'\xff\xd9'
+    return b'\xff\xd8' + jfif + before + xmp + _segment(0xE1, b'Exif\0\0' + exif) + scan
+
+
+def _chunk_png(chunk_type, data):
+    return struct.pack('>I', len(data)) + chunk_type + data + b'\0' * 4
+
+
+def _assert_point(result):
+    assert result.get('success'), result
+    assert result['latitude'] == pytest.approx(LATITUDE)
+    assert result['longitude'] == pytest.approx(LONGITUDE)
+
+
+@pytest.mark.parametrize('endian', ['<', '>'])
+def test_jpeg_marker_walk_skips_other_segments(endian):
+    # Fill bytes before a marker and an APP1 that is XMP rather than Exif
+    _assert_point(extract_gps_from_bytes(_jpeg(_tiff(endian), before=b'\xff\xff' + _segment(0xFE, b'comment')[1:])))
+
+
+def test_other_containers():
+    tiff = _tiff()
+    _assert_point(extract_gps_from_bytes(tiff))
+    png = b'\x89PNG\r\n\x1a\n' + _chunk_png(b'IHDR', b'\0' * 13) + _chunk_png(b'eXIf', tiff) + _chunk_png(b'IEND', b'')
+    _assert_point(extract_gps_from_bytes(png))
+    exif = b'Exif\0\0' + tiff + b'\0' * (len(tiff) % 2)
+    body = b'WEBP' + b'VP8 ' + struct.pack('<I', 3) + b'abc\0' + b'EXIF' + struct.pack('<I', len(exif)) + exif
+    _assert_point(extract_gps_from_bytes(b'RIFF' + struct.pack('<I', len(body)) + body))
+
+
+def test_exif_after_scan_start_is_not_read():
+    data = b'\xff\xd8' + b'\xff\xda' + b'\0' * 8 + _segment(0xE1, b'Exif\0\0' + _tiff())
+    assert find_exif_block(io.BytesIO(data)) is None
+    assert extract_gps_from_bytes(data) == {'error': 'No EXIF data found'}
+
+
+@pytest.mark.parametrize('data, error', [
+    (_jpeg(_tiff())[:40], 'Truncated image'),
+    (b'\xff\xd8\xff\xe1\x00', 'Truncated image'),
+    (b'GIF89a' + b'\0' * 20, 'Error processing image'),
+])
+def test_broken_inputs_report_errors(data, error):
+    assert error in extract_gps_from_bytes(data)['error']
+
+
+def test_no_gps_and_missing_file(tmp_path):
+    tiff = b'II*\0' + struct.pack('<LH', 8, 0) + b'\0' * 4
+    assert extract_gps_from_bytes(_jpeg(tiff)) == {'error': 'No GPS metadata found'}
+    assert 'Image not found' in extract_gps_from_image(str(tmp_path / 'missing.jpg'))['error']
+
+
+def test_matches_pillow_on_a_real_jpeg():
+    piexif = pytest.importorskip('piexif')
+    Image = pytest.importorskip('PIL.Image')
+    exif = piexif.dump({'GPS': {
+        piexif.GPSIFD.GPSLatitudeRef: b'N',
+        piexif.GPSIFD.GPSLatitude: ((30, 1), (16, 1), (24, 10)),
+        piexif.GPSIFD.GPSLongitudeRef: b'W',
+        piexif.GPSIFD.GPSLongitude: ((97, 1), (44, 1), (348, 10))
+    }})
+    buffer = io.BytesIO()
+    Image.new('RGB', (32, 32), 'red').save(buffer, 'JPEG', exif=exif)
+    _assert_point(extract_gps_from_bytes(buffer.getvalue()))
+
+
+def test_serve_frames_answers_in_request_order():
+    images = [_jpeg(_tiff()), b'not an image', _jpeg(_tiff('>'))]
+    stream = b''.join(struct.pack('>I', len(image)) + image for image in images)
+    # A torn trailing frame ends the stream without an answer
+    stream += struct.pack('>I', 50) + b'\xff\xd8'
+    output = io.BytesIO()
+    serve_frames(io.BytesIO(stream).read, output.write, workers=3)
+    replies = [json.loads(line) for line in output.getvalue().decode('utf-8').splitlines()]
+    assert len(replies) == 3
+    _assert_point(replies[0])
+    assert 'error' in replies[1]
+    _assert_point(replies[2])
@@ -0,0 +1,48 @@
+import numpy as np
+import pytest
+
+from benchmark_engine import generate_entities
+from feature_store import EntityFeatureStore
+
+PREFERENCE_SETS = [
+    [],
+    [''],
+    ['Thai'],
+    ['thai', 'Cafe', 'outdoor seating'],
+    ['Sushi', 'sushi', 'Brunch'],
+    ['a'],
+    ['not in any catalogue']
+]
+
+
+def _entities():
+    entities = generate_entities(60, tags_per_entity=6, seed=11)
+    # Duplicate tags count twice, and enough matches push the boost past the 1.0 cap
+    entities[0]['tags'] = entities[0]['tags'] * 3
+    entities.append({'name': '', 'tags': [{'name': ''}]})
+    entities.append({'name': 'Thai Thai THAI', 'properties': {'description': 'thai'}})
+    return entities
+
+
+@pytest.fixture
+def engine(make_engine):
+    return make_engine()
+
+
+@pytest.mark.parametrize('preferences', PREFERENCE_SETS)
+def test_scores_replay_per_entity_fallback_exactly(engine, preferences):
+    entities = _entities()
+    # The index the engine scores with, over the store's feature texts and tag names
+    index = EntityFeatureStore(entities).term_index
+    expected = np.array([engine._fallback_preference_scoring(entity, preferences) for entity in entities])
+    # Bit-for-bit, including the float sums of repeated 0.1 tag boosts
+    assert index.score(preferences).tolist() == expected.tolist()
+
+
+def test_take_matches_a_fresh_index_over_the_subset():
+    entities = _entities()
+    index = EntityFeatureStore(entities).term_index
+    rows = np.array([5, 0, 61, 5, 17])
+    fresh = EntityFeatureStore([entities[i] for i in rows]).term_index
+    for preferences in PREFERENCE_SETS:
+        assert index.take(rows).score(preferences).tolist() == fresh.score(preferences).tolist()
@@ -0,0 +1,78 @@
+import re
+
+import numpy as np
+import pytest
+
+from benchmark_engine import generate_entities
+from feature_store import EntityFeatureStore
+
+
+def _reference_vw_features(entity, embedding):
+    """The per-entity VW line the engine built before the feature store"""
+    features = [f"name_len:{len(entity.get('name', '').lower())}"]
+    for i, val in enumerate(embedding[:50]):
+        features.append(f"emb_{i}:{int(val * 10)}")
+    for tag in entity.get('tags', []):
+        tag_name = re.sub(r'[^a-zA-Z0-9]', '_', tag.get('name', ''))
+        tag_type = re.sub(r'[^a-zA-Z0-9]', '_', tag.get('type', ''))
+        features.append(f"tag_{tag_type}_{tag_name}")
+    props = entity.get('properties', {})
+    rating = props.get('business_rating', 0)
+    if rating > 0:
+        features.append(f"rating_bucket:{min(int(rating), 5)}")
+    price_range = props.get('price_range', {})
+    if price_range:
+        avg_price = (price_range.get('from', 0) + price_range.get('to', 0)) / 2
+        features.append(f"price_bucket:{min(int(avg_price / 10), 10)}")
+    return " ".join(features)
+
+
+def _entities():
+    entities = generate_entities(25, tags_per_entity=5, seed=8)
+    entities += [
+        {'name': 'İstanbul Grill', 'tags': [{'name': 'Döner & Kebab', 'type': 'urn:tag:genre:place:cuisine'}]},
+        {'name': 'No extras', 'properties': {'business_rating': 0, 'price_range': {}}},
+        {'name': 'Only from', 'properties': {'business_rating': 7.5, 'price_range': {'from': 250}}},
+        {'name': 'Repeated', 'tags': [{'name': 'Thai', 'type': 't'}] * 2}
+    ]
+    return entities
+
+
+@pytest.mark.parametrize('dtype', [np.float32, np.float64])
+def test_vw_lines_match_per_entity_vectorizer(dtype):
+    entities = _entities()
+    rng = np.random.default_rng(0)
+    embeddings = rng.uniform(-1, 1, size=(len(entities), 64)).astype(dtype)
+    # Values right at bucket edges must truncate towards zero like int() did
+    embeddings[0, :4] = [0.1, -0.1, 0.3, -0.95]
+    lines = EntityFeatureStore(entities).vw_features(embeddings)
+    assert lines == [_reference_vw_features(entity, row) for entity, row in zip(entities, embeddings)]
+
+
+def test_take_keeps_rows_and_lines():
+    entities = _entities()
+    embeddings = np.random.default_rng(1).uniform(-1, 1, size=(len(entities), 64))
+    store = EntityFeatureStore(entities)
+    rows = np.array([27, 3, 3, 0])
+    subset = store.take(rows)
+    fresh = EntityFeatureStore([entities[i] for i in rows])
+    assert subset.feature_texts == fresh.feature_texts
+    assert subset.entity_ids == fresh.entity_ids
+    assert subset.vw_features(embeddings[rows]) == fresh.vw_features(embeddings[rows])
+
+
+def test_vw_lines_train_and_predict():
+    pytest.importorskip('vowpalwabbit')
+    from vw_scorer import VWScorer
+
+    entities = _entities()
+    embeddings = np.random.default_rng(2).uniform(-1, 1, size=(len(entities), 64))
+    lines = EntityFeatureStore(entities).vw_features(embeddings)
+    scorer = VWScorer(prefer_pyvw=True)
+    if scorer.backend is None:
+        pytest.skip('VW backend unavailable')
+    model = scorer.train([f"{1.0 if i % 2 else -0.5} |context pref_thai |entity {line}" for i, line in enumerate(lines)])
+    try:
+        assert model.predict([f"|context pref_thai |entity {line}" for line in lines]).shape == (len(lines),)
+    finally:
+        model.close()
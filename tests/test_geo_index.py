@@ -0,0 +1,62 @@
+import math
+
+import numpy as np
+import pytest
+
+from geo_index import EARTH_RADIUS_KM, GeoIndex, decode_geohash, entity_coordinates
+
+
+def _haversine(lat1, lon1, lat2, lon2):
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(min(a, 1.0)))
+
+
+def _scatter(lat, lon, n=3000, spread=1.5, seed=0):
+    """Entities around (lat, lon), wrapped into [-180, 180), some without a location"""
+    rng = np.random.default_rng(seed)
+    entities = []
+    for i in range(n):
+        point_lon = (lon + rng.uniform(-spread, spread) + 180.0) % 360.0 - 180.0
+        location = {'lat': lat + rng.uniform(-spread, spread), 'lon': point_lon} if i % 10 else {}
+        entities.append({'name': f"place {i}", 'location': location})
+    return entities
+
+
+def _brute_force(entities, lat, lon, radius_km):
+    hits = []
+    for position, entity in enumerate(entities):
+        coordinates = entity_coordinates(entity)
+        if coordinates is not None:
+            distance = _haversine(lat, lon, *coordinates)
+            if distance <= radius_km:
+                hits.append((position, distance))
+    return sorted(hits, key=lambda hit: (hit[1], hit[0]))
+
+
+@pytest.mark.parametrize('lat, lon', [(40.7, -74.0), (-16.5, 179.9), (-16.5, -179.95), (65.0, 20.0)])
+@pytest.mark.parametrize('radius_km', [5.0, 40.0])
+def test_radius_query_matches_brute_force(lat, lon, radius_km):
+    entities = _scatter(lat, lon)
+    index = GeoIndex(entities)
+    expected = _brute_force(entities, lat, lon, radius_km)
+    assert expected
+
+    found = index.query(lat, lon, k=None, radius_km=radius_km)
+    assert [position for position, _ in found] == [position for position, _ in expected]
+    np.testing.assert_allclose([d for _, d in found], [d for _, d in expected], rtol=1e-9)
+    assert index.within(lat, lon, radius_km).tolist() == sorted(position for position, _ in expected)
+
+
+def test_k_nearest_within_radius():
+    entities = _scatter(-16.5, 179.9, seed=1)
+    found = GeoIndex(entities).query(-16.5, 179.9, k=5, radius_km=40.0)
+    assert [position for position, _ in found] == [position for position, _ in _brute_force(entities, -16.5, 179.9, 40.0)[:5]]
+
+
+def test_geohash_fallback():
+    lat, lon = decode_geohash('dr5ru7')
+    assert lat == pytest.approx(40.76, abs=0.01)
+    assert lon == pytest.approx(-73.98, abs=0.01)
+    assert entity_coordinates({'location': {'geohash': 'dr5ru7'}}) == (lat, lon)
+    assert entity_coordinates({'location': {'geohash': 'a!'}}) is None
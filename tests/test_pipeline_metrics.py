@@ -0,0 +1,69 @@
+import re
+
+from pipeline_metrics import STAGE_BUCKETS, PipelineMetrics, Trace, count, current_trace, stage
+
+SAMPLE = re.compile(r'^([a-z_]+)(\{[^}]*\})? (\S+)$')
+
+
+def _samples(text):
+    samples = {}
+    for line in text.splitlines():
+        if line.startswith('#'):
+            assert re.match(r'^# (HELP|TYPE) [a-z_]+ .+$', line), line
+            continue
+        match = SAMPLE.match(line)
+        assert match, line
+        samples[match.group(1) + (match.group(2) or '')] = float(match.group(3))
+    return samples
+
+
+def _trace(stages, counters):
+    trace = Trace()
+    trace.stages.update(stages)
+    trace.counters.update(counters)
+    trace.total_seconds = sum(stages.values())
+    return trace
+
+
+def test_stage_and_count_are_noops_outside_a_trace():
+    assert current_trace() is None
+    with stage('encode'):
+        count('encode_calls')
+
+
+def test_trace_collects_nested_stages_and_counters():
+    metrics = PipelineMetrics()
+    with metrics.trace('abc') as trace:
+        with stage('embed_entities'):
+            with stage('encode'):
+                count('encode_calls')
+            with stage('encode'):
+                count('encode_calls')
+    assert trace.trace_id == 'abc'
+    assert trace.counters == {'encode_calls': 2}
+    assert set(trace.stages) == {'embed_entities', 'encode'}
+    assert trace.stages['embed_entities'] >= trace.stages['encode']
+    assert current_trace() is None
+    assert metrics.stats()['requests'] == 1
+
+
+def test_prometheus_text_exports_counters_and_cumulative_histograms():
+    metrics = PipelineMetrics()
+    metrics.record(_trace({'encode': 0.003, 'mmr_selection': 0.2}, {'encode_calls': 2, 'result_cache_hits': 1}))
+    metrics.record(_trace({'encode': 0.04}, {'encode_calls': 1}))
+    metrics.record(_trace({'encode': 30.0}, {}))
+    samples = _samples(metrics.prometheus_text(prefix='test'))
+
+    assert samples['test_requests_total'] == 3
+    assert samples['test_events_total{event="encode_calls"}'] == 3
+    assert samples['test_events_total{event="result_cache_hits"}'] == 1
+
+    buckets = [samples[f'test_stage_seconds_bucket{{stage="encode",le="{bound}"}}'] for bound in STAGE_BUCKETS]
+    assert buckets == sorted(buckets)
+    assert samples['test_stage_seconds_bucket{stage="encode",le="0.005"}'] == 1
+    assert samples['test_stage_seconds_bucket{stage="encode",le="0.05"}'] == 2
+    assert samples['test_stage_seconds_bucket{stage="encode",le="10.0"}'] == 2
+    assert samples['test_stage_seconds_bucket{stage="encode",le="+Inf"}'] == 3
+    assert samples['test_stage_seconds_count{stage="encode"}'] == 3
+    assert abs(samples['test_stage_seconds_sum{stage="encode"}'] - 30.043) < 1e-6
+    assert samples['test_stage_seconds_count{stage="mmr_selection"}'] == 1
@@ -0,0 +1,69 @@
+import copy
+
+from diversification_engine import run_diversification
+from result_cache import ResultCache, result_cache_key
+
+CUISINES = ['Thai', 'Mexican', 'Italian', 'Sushi', 'Cafe', 'Barbecue', 'Indian', 'Vegan']
+
+
+def _entities(n=20, with_ids=True):
+    entities = []
+    for i in range(n):
+        entity = {
+            'name': f"{CUISINES[i % len(CUISINES)]} place {i}",
+            'properties': {'description': f"{CUISINES[i % len(CUISINES)].lower()} food spot", 'business_rating': 3 + i % 3},
+            'tags': [{'name': CUISINES[i % len(CUISINES)], 'type': 'urn:tag:genre:place:cuisine'}]
+        }
+        if with_ids:
+            entity['entity_id'] = f"E-{i}"
+        entities.append(entity)
+    return entities
+
+
+def test_entries_expire_after_ttl(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr('result_cache.time.time', lambda: now[0])
+    cache = ResultCache(ttl_seconds=10)
+    cache.put('k', {'value': 1})
+    now[0] += 9
+    assert cache.get('k') == {'value': 1}
+    now[0] += 2
+    assert cache.get('k') is None
+    assert cache.stats()['expirations'] == 1
+
+
+def test_sqlite_tier_is_shared_between_instances(tmp_path):
+    path = str(tmp_path / 'cache.sqlite')
+    ResultCache(sqlite_path=path).put('k', {'value': [1, 2]})
+    other = ResultCache(sqlite_path=path)
+    assert other.get('k') == {'value': [1, 2]}
+    assert other.stats()['shared_hits'] == 1
+
+
+def test_key_follows_catalogue_content(make_engine):
+    engine = make_engine()
+    entities = _entities()
+    edited = copy.deepcopy(entities)
+    edited[3]['properties']['description'] = 'now a noodle bar'
+    keys = [
+        result_cache_key(engine._catalogue_fingerprint(catalogue), ['thai'], {}, 'm')
+        for catalogue in (entities, copy.deepcopy(entities), edited)
+    ]
+    assert keys[0] == keys[1]
+    assert keys[0] != keys[2]
+
+
+def test_hit_returns_the_requests_own_entities(make_engine):
+    engine = make_engine()
+    entities = _entities(with_ids=False)
+    first = run_diversification(engine, entities, ['thai'], n_total=5)
+    assert not first['result_cache']['hit']
+
+    # Equal content in fresh dicts: the hit must hand back these objects, not deserialized copies
+    again = copy.deepcopy(entities)
+    second = run_diversification(engine, again, ['thai'], n_total=5)
+    assert second['result_cache']['hit']
+    assert [entity['name'] for entity in second['diversified_recommendations']] == \
+        [entity['name'] for entity in first['diversified_recommendations']]
+    positions = {id(entity) for entity in again}
+    assert all(id(entity) in positions for entity in second['diversified_recommendations'])
@@ -0,0 +1,125 @@
+import numpy as np
+import pytest
+
+from benchmark_engine import generate_entities
+from selection_strategies import SimilarityMatrix, category_codes, select
+
+
+def _entities():
+    cities = ['Austin', 'Austin', 'Austin', 'Round Rock', 'Round Rock', 'Cedar Park']
+    return [
+        {'name': f"place {i}", 'properties': {'geocode': {'city': city}}, 'tags': []}
+        for i, city in enumerate(cities)
+    ]
+
+
+def test_category_codes_from_field_path():
+    codes = category_codes(_entities(), 'properties.geocode.city')
+    assert codes.tolist() == [0, 0, 0, 1, 1, 2]
+
+
+def test_category_codes_reject_path_missing_everywhere():
+    with pytest.raises(ValueError, match='properties.geocode.town'):
+        category_codes(_entities(), 'properties.geocode.town')
+
+
+def test_category_quota_caps_each_category():
+    rng = np.random.default_rng(0)
+    embeddings = rng.normal(size=(6, 8))
+    embeddings /= np.linalg.norm(embeddings, axis=1, keepdims=True)
+    relevance = np.array([0.9, 0.8, 0.7, 0.6, 0.5, 0.4])
+    categories = category_codes(_entities(), 'properties.geocode.city')
+    picks = select('category_quota', SimilarityMatrix(embeddings), relevance, 8, categories=categories, diversify_take=1)
+    assert sorted(categories[picks].tolist()) == [0, 1, 2]
+    picks = select('category_quota', SimilarityMatrix(embeddings), relevance, 8, categories=categories, diversify_take=2)
+    assert len(picks) == 5
+    assert max(np.bincount(categories[picks])) == 2
+
+
+def _unit_rows(n, dim=8, seed=0):
+    rng = np.random.default_rng(seed)
+    embeddings = rng.normal(size=(n, dim))
+    return embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True), rng.uniform(size=n)
+
+
+def _reference_mmr(embeddings, relevance, phases):
+    picks = []
+    for lambda_param, n_picks in phases:
+        for _ in range(min(n_picks, len(relevance) - len(picks))):
+            scores = []
+            for i in range(len(relevance)):
+                if i in picks:
+                    continue
+                redundancy = max((float(embeddings[i] @ embeddings[j]) for j in picks), default=0.0)
+                scores.append((i, lambda_param * relevance[i] - (1 - lambda_param) * redundancy))
+            scores.sort(key=lambda x: x[1], reverse=True)
+            picks.append(scores[0][0])
+    return picks
+
+
+def _reference_dpp(embeddings, relevance, k, lambda_param):
+    """Greedy MAP that recomputes the log-determinant of every candidate set"""
+    quality = np.exp(lambda_param / (2 * (1 - lambda_param)) * relevance)
+    kernel = quality[:, None] * (embeddings @ embeddings.T) * quality[None, :]
+    picks = []
+    for _ in range(k):
+        gains = [
+            (np.linalg.slogdet(kernel[np.ix_(picks + [i], picks + [i])])[1], i)
+            for i in range(len(relevance)) if i not in picks
+        ]
+        picks.append(max(gains, key=lambda gain: (gain[0], -gain[1]))[1])
+    return picks
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_incremental_mmr_matches_list_reference(seed):
+    embeddings, relevance = _unit_rows(30, seed=seed)
+    for dense in (False, True):
+        similarity = SimilarityMatrix(embeddings)
+        if dense:
+            assert similarity.materialize()
+        assert select('two_phase', similarity, relevance, 8, n_high_affinity=3) == \
+            _reference_mmr(embeddings, relevance, [(0.7, 3), (0.3, 5)])
+        assert select('mmr', similarity, relevance, 40, lambda_param=0.5) == \
+            _reference_mmr(embeddings, relevance, [(0.5, 30)])
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_dpp_matches_brute_force_log_determinant(seed):
+    # Fewer picks than dimensions, so every candidate set stays full rank
+    embeddings, relevance = _unit_rows(20, dim=12, seed=seed)
+    picks = select('dpp', SimilarityMatrix(embeddings), relevance, 6, lambda_param=0.7)
+    assert picks == _reference_dpp(embeddings, relevance, 6, 0.7)
+
+
+def test_dpp_fills_by_relevance_once_the_picks_span_everything():
+    embeddings, relevance = _unit_rows(10, dim=3, seed=1)
+    picks = select('dpp', SimilarityMatrix(embeddings), relevance, 6)
+    assert len(picks) == len(set(picks)) == 6
+    rest = picks[3:]
+    assert rest == sorted(rest, key=lambda i: -relevance[i])
+
+
+def test_materialize_respects_memory_cap():
+    embeddings, _ = _unit_rows(50)
+    similarity = SimilarityMatrix(embeddings, block_size=7, max_dense_bytes=1024)
+    assert not similarity.materialize()
+    similarity.max_dense_bytes = 1 << 20
+    assert similarity.materialize()
+    assert np.allclose(similarity.dense, embeddings @ embeddings.T)
+
+
+def test_unknown_strategy_is_rejected():
+    embeddings, relevance = _unit_rows(5)
+    with pytest.raises(ValueError, match='Unknown selection strategy'):
+        select('random', SimilarityMatrix(embeddings), relevance, 3)
+
+
+def test_dpp_rejects_diversity_weight(make_engine):
+    embeddings, relevance = _unit_rows(10)
+    with pytest.raises(ValueError, match='diversity_weight'):
+        select('dpp', SimilarityMatrix(embeddings), relevance, 3, diversity_weight=0.5)
+
+    engine = make_engine()
+    with pytest.raises(ValueError, match='diversity_weight'):
+        engine.diversify_recommendations(generate_entities(10), ['Thai'], selection_strategy='dpp', diversity_weight=0.5)
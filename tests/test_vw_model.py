@@ -0,0 +1,114 @@
+import os
+import threading
+import time
+
+import pytest
+
+from vw_scorer import VW_MODEL_MB, UserModelStore, VWModel, VWScorer, max_models_for_memory
+
+
+class _SingleThreadedWorkspace:
+    """Records whether two threads were ever inside the workspace at once, as pyvw must never be"""
+
+    def __init__(self):
+        self.active = 0
+        self.overlapped = False
+        self.learned = []
+
+    def _enter(self):
+        self.active += 1
+        self.overlapped |= self.active > 1
+        time.sleep(0.001)
+        self.active -= 1
+
+    def predict(self, line):
+        self._enter()
+        return 0.5
+
+    def learn(self, line):
+        self._enter()
+        self.learned.append(line)
+
+    def finish(self):
+        pass
+
+
+def test_shared_workspace_is_used_by_one_thread_at_a_time():
+    workspace = _SingleThreadedWorkspace()
+    model = VWModel(workspace=workspace)
+    lines = [f"| f{i}:1" for i in range(5)]
+
+    def work(i):
+        for _ in range(5):
+            if i % 4 == 0:
+                model.learn([f"1 {line}" for line in lines])
+            else:
+                assert model.predict(lines).tolist() == [0.5] * len(lines)
+
+    threads = [threading.Thread(target=work, args=(i,)) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not workspace.overlapped
+
+
+class _FakeScorer:
+    def __init__(self):
+        self.trained = []
+
+    def train(self, lines):
+        self.trained.append(list(lines))
+        return VWModel(workspace=_SingleThreadedWorkspace())
+
+
+def test_default_caps_are_sized_by_memory():
+    assert max_models_for_memory(512) == 512 // VW_MODEL_MB
+    assert max_models_for_memory(1) == 1
+    assert UserModelStore(_FakeScorer()).max_users == max_models_for_memory()
+
+
+def test_idle_models_are_swept_without_further_requests():
+    store = UserModelStore(_FakeScorer(), ttl_seconds=0.05)
+    try:
+        with store.lease('u1', 'ctx', ['a'], lambda start: ['1 | a'][start:]) as model:
+            assert model is not None
+        deadline = time.monotonic() + 5
+        while store.stats()['users'] and time.monotonic() < deadline:
+            time.sleep(0.01)
+        assert store.stats() == dict(store.stats(), users=0, evictions=1)
+        assert model.workspace is None
+    finally:
+        store.close()
+
+
+def test_online_updates_learn_only_new_interactions():
+    scorer = _FakeScorer()
+    store = UserModelStore(scorer, ttl_seconds=0)
+    history = [f"1 | i{i}" for i in range(5)]
+    keys = [f"i{i}" for i in range(5)]
+    with store.lease('u1', 'ctx', keys[:3], lambda start: history[start:3]):
+        pass
+    with store.lease('u1', 'ctx', keys, lambda start: history[start:]) as model:
+        assert model.workspace.learned == history[3:]
+    assert scorer.trained == [history[:3]]
+    assert store.stats()['online_updates'] == 1
+    store.close()
+    assert model.workspace is None
+
+
+def test_saved_models_load_from_paths_with_spaces(tmp_path):
+    pytest.importorskip('vowpalwabbit')
+    scorer = VWScorer(str(tmp_path))
+    if scorer.backend != 'pyvw':
+        pytest.skip('pyvw unavailable')
+    model = scorer.train(["1 |context pref_a |entity x:1", "-0.5 |context pref_b |entity y:1"])
+    path = str(tmp_path / 'with space' / 'model.vw')
+    os.makedirs(os.path.dirname(path))
+    model.save(path)
+    loaded = scorer.load(path)
+    try:
+        assert loaded.predict(["|context pref_a |entity x:1"]).tolist() == model.predict(["|context pref_a |entity x:1"]).tolist()
+    finally:
+        model.close()
+        loaded.close()
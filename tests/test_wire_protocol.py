@@ -0,0 +1,82 @@
+import io
+import struct
+
+import numpy as np
+import pytest
+
+from benchmark_engine import generate_entities
+from diversification_server import DiversificationService, serve_frames
+from wire_protocol import (
+    JSON, MAX_FRAME_BYTES, MSGPACK, FrameError, compact_results, decode_body, encode_frame, entity_positions, read_frame
+)
+
+
+def _frames(data):
+    stream = io.BytesIO(data)
+    bodies = []
+    while True:
+        body = read_frame(stream.read)
+        if body is None:
+            return bodies
+        bodies.append(body)
+
+
+def test_json_frames_round_trip_numpy_values():
+    message = {'id': 7, 'name': 'Café', 'scores': np.array([0.5, 0.25]), 'count': np.int64(3)}
+    bodies = _frames(encode_frame(message) + encode_frame({'id': 8}))
+    assert decode_body(bodies[0]) == ({'id': 7, 'name': 'Café', 'scores': [0.5, 0.25], 'count': 3}, JSON)
+    assert decode_body(bodies[1]) == ({'id': 8}, JSON)
+
+
+def test_msgpack_frames_round_trip():
+    pytest.importorskip('msgpack')
+    frame = encode_frame({'id': 1, 'scores': np.array([1.5])}, MSGPACK)
+    assert decode_body(_frames(frame)[0]) == ({'id': 1, 'scores': [1.5]}, MSGPACK)
+
+
+@pytest.mark.parametrize('data, message', [
+    (b'\x00\x00', 'inside a frame header'),
+    (struct.pack('>I', 10) + b'{"id"', 'inside a frame body'),
+    (struct.pack('>I', MAX_FRAME_BYTES + 1), 'byte limit')
+])
+def test_torn_or_oversized_frames_raise(data, message):
+    with pytest.raises(FrameError, match=message):
+        _frames(data)
+
+
+def test_a_frame_must_hold_an_object():
+    msgpack = pytest.importorskip('msgpack')
+    with pytest.raises(FrameError, match='one object'):
+        decode_body(msgpack.packb([1, 2]))
+
+
+def test_positions_prefer_identity_then_entity_id():
+    entities = [{'entity_id': 'a'}, {'entity_id': 'b'}, {'entity_id': 'a'}]
+    selected = [entities[2], {'entity_id': 'b'}, {'entity_id': 'z'}]
+    assert entity_positions(entities, selected) == [2, 1, -1]
+    compact = compact_results({'diversified_recommendations': selected, 'metrics': 1}, entities)
+    assert compact == {'metrics': 1, 'entity_ids': ['a', 'b', 'z'], 'positions': [2, 1, -1]}
+
+
+def test_serve_frames_replies_in_the_request_codec(make_engine):
+    service = DiversificationService()
+    service.engine = make_engine()
+    service._ready.set()
+    entities = generate_entities(12, seed=9)
+    requests = encode_frame({'id': 1, 'entities': entities, 'userPreferences': ['Thai'], 'options': {'nTotal': 3}})
+    requests += encode_frame({'id': 2, 'op': 'nope'})
+    # A torn trailing frame closes the stream after the complete ones are answered
+    requests += struct.pack('>I', 100) + b'{'
+    replies = {}
+    output = io.BytesIO()
+    serve_frames(service, 2, io.BytesIO(requests).read, output.write)
+    for body in _frames(output.getvalue()):
+        reply, codec = decode_body(body)
+        assert codec == JSON
+        replies[reply['id']] = reply
+    assert set(replies) == {1, 2}
+    assert replies[2]['status_code'] == 400
+    data = replies[1]['data']
+    assert 'diversified_recommendations' not in data
+    assert [entities[i]['entity_id'] for i in data['positions']] == data['entity_ids']
+    assert len(data['entity_ids']) == 3
@@ -0,0 +1,796 @@
+"""Batched Vowpal Wabbit training and scoring for the diversification engine.
+
+A request trains its preference model once and scores every candidate in a
+single pass. The pyvw bindings (vowpalwabbit package) are used in-process when
+installed; otherwise the vw CLI is driven over stdin/stdout, one process to
+train and one to predict, with no data files on disk.
+
+UserModelStore keeps one model per user id and applies only interactions it
+has not seen yet, so a warm engine serves many users without retraining.
+BackgroundTrainer instead takes training off the request path entirely:
+requests score with the last published snapshot while a debounced worker
+retrains, and snapshots can be published to disk for other processes.
+
+Which backend exists is probed on first use, not at construction, and the
+probe result is cached on disk keyed by the interpreter and the mtimes of the
+vowpalwabbit package and vw binary, so CLI runs skip `vw --version`.
+"""
+import hashlib
+import importlib.util
+import json
+import logging
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+import numpy as np
+
+from pipeline_metrics import traced
+
+logger = logging.getLogger(__name__)
+
+VW_TRAIN_ARGS = [
+    "--loss_function", "squared",
+    "--learning_rate", "0.1",
+    "--l2", "0.001",
+    "--interactions", "ce",  # context-entity interactions
+    "--quiet"
+]
+
+# Resident size of one pyvw workspace trained with VW_TRAIN_ARGS (default 18-bit weight table)
+VW_MODEL_MB = 9
+DEFAULT_VW_MEMORY_MB = 512
+
+
+def max_models_for_memory(memory_mb: float = DEFAULT_VW_MEMORY_MB) -> int:
+    """How many resident VW models fit in memory_mb"""
+    return max(1, int(memory_mb // VW_MODEL_MB))
+
+
+def pyvw_available() -> bool:
+    try:
+        from vowpalwabbit import Workspace  # noqa: F401
+        return True
+    except ImportError:
+        return False
+
+
+def vw_cli_available() -> bool:
+    if shutil.which('vw') is None:
+        return False
+    try:
+        result = subprocess.run(['vw', '--version'], capture_output=True, text=True, timeout=5)
+        return result.returncode == 0
+    except (subprocess.CalledProcessError, OSError, subprocess.TimeoutExpired):
+        return False
+
+
+def default_probe_cache_path() -> str:
+    cache_home = os.environ.get('XDG_CACHE_HOME') or os.path.join(os.path.expanduser('~'), '.cache')
+    return os.environ.get('VW_PROBE_CACHE', os.path.join(cache_home, 'cultour', 'vw_probe.json'))
+
+
+def _probe_key() -> str:
+    """Changes whenever the interpreter, the vowpalwabbit package or the vw binary changes"""
+    spec = importlib.util.find_spec('vowpalwabbit')  # locates the package without importing it
+    parts = [sys.executable, sys.version]
+    for path in (spec.origin if spec else None, shutil.which('vw')):
+        if path and os.path.exists(path):
+            stat = os.stat(path)
+            parts.append(f"{path}:{stat.st_mtime_ns}:{stat.st_size}")
+        else:
+            parts.append('-')
+    return hashlib.sha1("\n".join(parts).encode('utf-8')).hexdigest()
+
+
+def probe_vw_backends(cache_path: Optional[str] = None) -> Dict[str, bool]:
+    """{'pyvw': bool, 'cli': bool}, from the on-disk probe cache when it is still valid"""
+    cache_path = cache_path or default_probe_cache_path()
+    key = _probe_key()
+    try:
+        with open(cache_path, 'r', encoding='utf-8') as f:
+            cached = json.load(f)
+        if cached.get('key') == key:
+            return cached['backends']
+    except (OSError, ValueError, KeyError):
+        pass
+
+    backends = {'pyvw': pyvw_available(), 'cli': vw_cli_available()}
+    try:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'key': key, 'backends': backends}, f)
+        os.replace(tmp_path, cache_path)
+    except OSError as e:
+        logger.debug(f"Could not write VW probe cache {cache_path}: {e}")
+    return backends
+
+
+def normalize_vw_scores(raw_scores: np.ndarray) -> np.ndarray:
+    """Map VW regression output from roughly [-1, 1] onto [0, 1]"""
+    return np.clip((np.asarray(raw_scores, dtype=np.float64) + 1) / 2, 0, 1)
+
+
+class VWModel:
+    """A trained preference model, held in memory by pyvw or as a regressor file for the vw CLI"""
+
+    def __init__(self, workspace=None, regressor_path: str = None, owns_file: bool = True):
+        self.workspace = workspace
+        self.regressor_path = regressor_path
+        # Published snapshot files are shared with other processes and must outlive this handle
+        self.owns_file = owns_file
+        # A pyvw workspace is not thread-safe and leased snapshots are shared by concurrent requests
+        self._lock = threading.Lock()
+
+    @traced('vw_predict')
+    def predict(self, lines: List[str]) -> np.ndarray:
+        """Raw predictions for unlabeled VW lines, in order"""
+        if not lines:
+            return np.zeros(0, dtype=np.float64)
+        if self.workspace is not None:
+            with self._lock:
+                return np.array([self.workspace.predict(line) for line in lines], dtype=np.float64)
+
+        cmd = [
+            "vw",
+            "--initial_regressor", self.regressor_path,
+            "--testonly",
+            "--predictions", "/dev/stdout",
+            "--quiet"
+        ]
+        result = subprocess.run(
+            cmd, input="\n".join(lines) + "\n", capture_output=True, text=True, check=True, timeout=10
+        )
+        predictions = [float(line.split()[0]) for line in result.stdout.splitlines() if line.strip()]
+        if len(predictions) != len(lines):
+            raise RuntimeError(f"vw returned {len(predictions)} predictions for {len(lines)} examples")
+        return np.array(predictions, dtype=np.float64)
+
+    @traced('vw_update')
+    def learn(self, lines: List[str]):
+        """Online update with additional labeled lines"""
+        if not lines:
+            return
+        if self.workspace is not None:
+            with self._lock:
+                for line in lines:
+                    self.workspace.learn(line)
+            return
+
+        fd, updated_path = tempfile.mkstemp(suffix='.vw', dir=os.path.dirname(self.regressor_path))
+        os.close(fd)
+        # Hyperparameters and learner state come from the --save_resume regressor
+        cmd = [
+            "vw",
+            "--initial_regressor", self.regressor_path,
+            "--final_regressor", updated_path,
+            "--save_resume",
+            "--quiet"
+        ]
+        try:
+            subprocess.run(cmd, input="\n".join(lines) + "\n", text=True, check=True, capture_output=True, timeout=30)
+        except Exception:
+            os.remove(updated_path)
+            raise
+        os.replace(updated_path, self.regressor_path)
+
+    def save(self, path: str):
+        """Write the regressor to path; written beside it and renamed, so path is always a complete model"""
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        if self.workspace is not None:
+            with self._lock:
+                self.workspace.save(tmp_path)
+        else:
+            shutil.copyfile(self.regressor_path, tmp_path)
+        os.replace(tmp_path, path)
+
+    def close(self):
+        with self._lock:
+            if self.workspace is not None:
+                self.workspace.finish()
+                self.workspace = None
+        if self.owns_file and self.regressor_path and os.path.exists(self.regressor_path):
+            os.remove(self.regressor_path)
+
+
+_UNRESOLVED = object()
+
+
+class VWScorer:
+    def __init__(self, work_dir: str = None, prefer_pyvw: bool = True, probe_cache_path: str = None):
+        self.work_dir = work_dir or tempfile.mkdtemp()
+        self.prefer_pyvw = prefer_pyvw
+        self.probe_cache_path = probe_cache_path
+        self._backend = _UNRESOLVED
+        self._backend_lock = threading.Lock()
+
+    @property
+    def backend(self) -> Optional[str]:
+        """'pyvw', 'cli' or None, probed on first access"""
+        if self._backend is _UNRESOLVED:
+            with self._backend_lock:
+                if self._backend is _UNRESOLVED:
+                    backends = probe_vw_backends(self.probe_cache_path)
+                    if self.prefer_pyvw and backends['pyvw']:
+                        self._backend = 'pyvw'
+                    elif backends['cli']:
+                        self._backend = 'cli'
+                    else:
+                        self._backend = None
+                        logger.warning("Vowpal Wabbit (vw) not found. Falling back to embedding-only recommendations.")
+                    logger.info(f"VW available: {self._backend is not None} (backend: {self._backend})")
+        return self._backend
+
+    @property
+    def available(self) -> bool:
+        return self.backend is not None
+
+    @traced('vw_train')
+    def train(self, lines: List[str]) -> Optional[VWModel]:
+        """Train a fresh model on labeled VW lines in one pass"""
+        if not self.available or not lines:
+            return None
+        try:
+            if self.backend == 'pyvw':
+                from vowpalwabbit import Workspace
+                workspace = Workspace(arg_list=VW_TRAIN_ARGS)
+                for line in lines:
+                    workspace.learn(line)
+                return VWModel(workspace=workspace)
+
+            fd, regressor_path = tempfile.mkstemp(suffix='.vw', dir=self.work_dir)
+            os.close(fd)
+            cmd = ["vw", "--final_regressor", regressor_path, "--save_resume"] + VW_TRAIN_ARGS
+            try:
+                subprocess.run(cmd, input="\n".join(lines) + "\n", text=True, check=True, capture_output=True, timeout=30)
+            except Exception:
+                os.remove(regressor_path)
+                raise
+            return VWModel(regressor_path=regressor_path)
+        except Exception as e:
+            # pyvw surfaces parse/learn errors as plain exceptions
+            logger.warning(f"VW training failed: {e}")
+            return None
+
+
+    def copy(self, model: VWModel) -> Optional[VWModel]:
+        """An independent model with the same weights and learner state, for updating without touching the original"""
+        if not self.available:
+            return None
+        fd, path = tempfile.mkstemp(suffix='.vw', dir=self.work_dir)
+        os.close(fd)
+        try:
+            model.save(path)
+        except Exception:
+            os.remove(path)
+            raise
+        if self.backend != 'pyvw':
+            return VWModel(regressor_path=path)
+        try:
+            from vowpalwabbit import Workspace
+            return VWModel(workspace=Workspace(arg_list=["--quiet", "--initial_regressor", path]))
+        finally:
+            os.remove(path)
+
+    def load(self, path: str) -> Optional[VWModel]:
+        """Open a saved regressor for scoring without taking ownership of the file"""
+        if not self.available:
+            return None
+        if self.backend == 'pyvw':
+            from vowpalwabbit import Workspace
+            return VWModel(workspace=Workspace(arg_list=["--quiet", "--initial_regressor", path]))
+        return VWModel(regressor_path=path, owns_file=False)
+
+
+def _digest(keys: List[str]) -> str:
+    return hashlib.sha1("\n".join(keys).encode('utf-8')).hexdigest()
+
+
+def _resumable(context: str, applied: int, digest: str, new_context: str, keys: List[str]) -> bool:
+    """Whether a model trained on the first applied keys under context can learn the rest of keys instead of retraining"""
+    return context == new_context and applied <= len(keys) and _digest(keys[:applied]) == digest
+
+
+class _UserModel:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.model: Optional[VWModel] = None
+        self.context = None
+        self.applied = 0
+        self.digest = _digest([])
+        self.last_used = time.monotonic()
+        self.evicted = False
+
+
+class UserModelStore:
+    """Per-user preference models with online updates and TTL/LRU eviction.
+    
+    Each user has its own lock, so different users train and score in parallel
+    while requests for the same user are serialized against one model. The
+    default cap is sized by memory (see max_models_for_memory), and a sweeper
+    thread closes models idle for ttl_seconds even when no other user arrives.
+    """
+
+    def __init__(self, scorer: VWScorer, max_users: int = None, ttl_seconds: float = 3600.0):
+        self.scorer = scorer
+        self.max_users = max_users or max_models_for_memory()
+        self.ttl_seconds = ttl_seconds
+        self._users: "OrderedDict[str, _UserModel]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._sweeper = None
+        self._closed = threading.Event()
+        self.full_trains = 0
+        self.online_updates = 0
+        self.reused = 0
+        self.evictions = 0
+
+    @contextmanager
+    def lease(
+        self,
+        user_id: str,
+        context: str,
+        interaction_keys: List[str],
+        build_lines: Callable[[int], List[str]]
+    ) -> Iterator[Optional[VWModel]]:
+        """Bring the user's model up to date and hold it for scoring.
+        
+        interaction_keys identify each interaction in history order; when the
+        history still starts with what the model has already seen, only
+        build_lines(applied) is learned, otherwise the model is retrained from
+        build_lines(0).
+        """
+        self._start_sweeper()
+        while True:
+            entry = self._entry(user_id)
+            entry.lock.acquire()
+            if not entry.evicted:
+                break
+            entry.lock.release()
+        try:
+            entry.last_used = time.monotonic()
+            self._sync(entry, context, interaction_keys, build_lines)
+            yield entry.model
+        finally:
+            entry.lock.release()
+
+    def _entry(self, user_id: str) -> _UserModel:
+        with self._lock:
+            entry = self._users.get(user_id)
+            if entry is None:
+                entry = self._users[user_id] = _UserModel()
+            self._users.move_to_end(user_id)
+            self._evict_locked(keep=user_id)
+            return entry
+
+    def _sync(self, entry: _UserModel, context: str, keys: List[str], build_lines: Callable[[int], List[str]]):
+        applied = entry.applied
+        if entry.model is not None and _resumable(entry.context, applied, entry.digest, context, keys):
+            if applied == len(keys):
+                self.reused += 1
+                return
+            try:
+                entry.model.learn(build_lines(applied))
+                self.online_updates += 1
+                entry.applied = len(keys)
+                entry.digest = _digest(keys)
+                return
+            except Exception as e:
+                logger.warning(f"VW online update failed ({e}), retraining from full history")
+
+        if entry.model is not None:
+            entry.model.close()
+        entry.model = self.scorer.train(build_lines(0))
+        self.full_trains += 1
+        entry.context = context
+        entry.applied = len(keys) if entry.model is not None else 0
+        entry.digest = _digest(keys[:entry.applied])
+
+    def _evict_locked(self, keep: str = None):
+        now = time.monotonic()
+        for user_id in list(self._users):
+            over_capacity = len(self._users) > self.max_users
+            entry = self._users[user_id]
+            idle = now - entry.last_used > self.ttl_seconds
+            if user_id == keep:
+                continue
+            # Entries are in LRU order, so the rest are fresher than this one
+            if not (over_capacity or idle):
+                break
+            # Models being scored right now are skipped and retried on a later access
+            if not entry.lock.acquire(blocking=False):
+                continue
+            try:
+                entry.evicted = True
+                if entry.model is not None:
+                    entry.model.close()
+                    entry.model = None
+            finally:
+                entry.lock.release()
+            del self._users[user_id]
+            self.evictions += 1
+
+    def evict_idle(self):
+        with self._lock:
+            self._evict_locked()
+
+    def _start_sweeper(self):
+        if self._sweeper is not None or not self.ttl_seconds:
+            return
+        with self._lock:
+            if self._sweeper is not None:
+                return
+            # Only a weak reference, so an abandoned store and its models can still be collected
+            store = weakref.ref(self)
+            closed = self._closed
+            interval = min(60.0, max(self.ttl_seconds / 4, 0.01))
+
+            def sweep():
+                while not closed.wait(interval):
+                    current = store()
+                    if current is None:
+                        return
+                    current.evict_idle()
+                    del current
+
+            self._sweeper = threading.Thread(target=sweep, name="vw-user-sweeper", daemon=True)
+            self._sweeper.start()
+
+    def close(self):
+        """Stop the sweeper and close every model not being scored right now"""
+        self._closed.set()
+        with self._lock:
+            max_users, self.max_users = self.max_users, 0
+            self._evict_locked()
+            self.max_users = max_users
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                'users': len(self._users),
+                'full_trains': self.full_trains,
+                'online_updates': self.online_updates,
+                'reused': self.reused,
+                'evictions': self.evictions
+            }
+
+
+class ModelSnapshot:
+    """One published model version; never updated in place, closed once replaced and no longer leased"""
+
+    def __init__(self, model: VWModel, version: int, context: str, digest: str, applied: int, pointer_mtime: int = None):
+        self.model = model
+        self.version = version
+        self.context = context
+        self.digest = digest
+        self.applied = applied
+        self.pointer_mtime = pointer_mtime
+        self.readers = 0
+        self.retired = False
+
+    def covers(self, context: str, interaction_keys: List[str]) -> bool:
+        """Whether this version was trained on exactly this context and interaction history"""
+        return self.context == context and self.digest == _digest(interaction_keys)
+
+
+class _TrainingJob:
+    def __init__(self, due: float, context: str, keys: List[str], build_lines: Callable[[int], List[str]]):
+        self.due = due
+        self.context = context
+        self.keys = keys
+        self.digest = _digest(keys)
+        self.applied = len(keys)
+        self.build_lines = build_lines
+
+
+class BackgroundTrainer:
+    """Debounced VW training off the request path, serving atomically swapped model snapshots.
+
+    schedule() records a key's latest interaction history. Once
+    debounce_seconds pass without a newer schedule for that key, a worker
+    thread copies the current snapshot and learns only the interactions it has
+    not seen, or retrains from the full history when the history was
+    rewritten, so a burst of swipes costs one short update. lease()
+    hands out the last published snapshot, or None until one exists so the
+    caller can fall back to embedding scores. With a model_dir every snapshot
+    is also written as <key hash>/<version>.vw plus a CURRENT pointer, both by
+    rename, so other processes only ever open complete versions.
+    """
+
+    def __init__(
+        self,
+        scorer: VWScorer,
+        debounce_seconds: float = 2.0,
+        model_dir: str = None,
+        max_keys: int = None,
+        keep_versions: int = 2
+    ):
+        self.scorer = scorer
+        self.debounce_seconds = debounce_seconds
+        self.model_dir = model_dir
+        self.max_keys = max_keys or max_models_for_memory()
+        self.keep_versions = keep_versions
+        self._snapshots: "OrderedDict[str, ModelSnapshot]" = OrderedDict()
+        self._jobs: Dict[str, _TrainingJob] = {}
+        self._active = 0
+        self._flushing = False
+        self._closed = False
+        self._cond = threading.Condition()
+        self._worker = None
+        self.scheduled = 0
+        self.coalesced = 0
+        self.trainings = 0
+        self.online_updates = 0
+        self.failures = 0
+        self.published = 0
+        self.disk_loads = 0
+        self.cold_misses = 0
+
+    def schedule(
+        self,
+        key: str,
+        context: str,
+        interaction_keys: List[str],
+        build_lines: Callable[[int], List[str]]
+    ) -> bool:
+        """Queue a retrain unless the current snapshot already covers this history; True when one is pending"""
+        digest = _digest(interaction_keys)
+        with self._cond:
+            snapshot = self._snapshots.get(key)
+            if snapshot is not None and snapshot.digest == digest and snapshot.context == context:
+                return False
+            if key in self._jobs:
+                self.coalesced += 1
+            self.scheduled += 1
+            self._jobs[key] = _TrainingJob(
+                time.monotonic() + self.debounce_seconds, context, list(interaction_keys), build_lines
+            )
+            if self._worker is None:
+                self._worker = threading.Thread(target=self._run, name="vw-trainer", daemon=True)
+                self._worker.start()
+            self._cond.notify_all()
+        return True
+
+    @contextmanager
+    def lease(self, key: str) -> Iterator[Optional[ModelSnapshot]]:
+        """The key's last published snapshot, held so its model is not closed mid-prediction; None when there is none yet"""
+        snapshot = self._acquire(key)
+        if snapshot is None:
+            with self._cond:
+                self.cold_misses += 1
+            yield None
+            return
+        try:
+            yield snapshot
+        finally:
+            self._release(snapshot)
+
+    def _release(self, snapshot: ModelSnapshot):
+        with self._cond:
+            snapshot.readers -= 1
+            close = snapshot.retired and snapshot.readers == 0
+        if close:
+            snapshot.model.close()
+
+    def _acquire(self, key: str) -> Optional[ModelSnapshot]:
+        pointer_mtime = self._pointer_mtime(key)
+        with self._cond:
+            snapshot = self._snapshots.get(key)
+            # Another process may have published a newer version
+            if snapshot is not None and (pointer_mtime is None or snapshot.pointer_mtime in (None, pointer_mtime)):
+                self._snapshots.move_to_end(key)
+                snapshot.readers += 1
+                return snapshot
+        loaded = self._load_published(key) if pointer_mtime is not None else None
+        to_close = []
+        with self._cond:
+            current = self._snapshots.get(key)
+            if loaded is not None and (current is None or loaded.version > current.version):
+                to_close = self._install(key, loaded)
+                current = loaded
+            elif loaded is not None:
+                to_close = [loaded]
+            if current is not None:
+                current.readers += 1
+        for snapshot in to_close:
+            snapshot.model.close()
+        return current
+
+    def _install(self, key: str, snapshot: ModelSnapshot) -> List[ModelSnapshot]:
+        """Swap in a new snapshot (lock held); returns retired snapshots nobody is reading, for closing"""
+        retired = []
+        old = self._snapshots.get(key)
+        self._snapshots[key] = snapshot
+        self._snapshots.move_to_end(key)
+        if old is not None:
+            retired.append(old)
+        while len(self._snapshots) > self.max_keys:
+            retired.append(self._snapshots.popitem(last=False)[1])
+        for old in retired:
+            old.retired = True
+        return [old for old in retired if old.readers == 0]
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while True:
+                    if self._closed:
+                        return
+                    if not self._jobs:
+                        self._cond.wait()
+                        continue
+                    key, job = min(self._jobs.items(), key=lambda item: item[1].due)
+                    delay = job.due - time.monotonic()
+                    if delay > 0 and not self._flushing:
+                        self._cond.wait(delay)
+                        continue
+                    del self._jobs[key]
+                    self._active += 1
+                    break
+            try:
+                self._train(key, job)
+            finally:
+                with self._cond:
+                    self._active -= 1
+                    self._cond.notify_all()
+
+    def _train(self, key: str, job: _TrainingJob):
+        try:
+            model = self._resume(key, job) or self.scorer.train(job.build_lines(0))
+        except Exception as e:
+            logger.warning(f"Background VW training for {key} failed: {e}")
+            model = None
+        if model is None:
+            with self._cond:
+                self.failures += 1
+            return
+
+        snapshot = ModelSnapshot(model, time.time_ns(), job.context, job.digest, job.applied)
+        if self.model_dir:
+            try:
+                snapshot.pointer_mtime = self._publish(key, snapshot)
+            except OSError as e:
+                logger.warning(f"Could not publish VW snapshot for {key}: {e}")
+        with self._cond:
+            to_close = self._install(key, snapshot)
+            self.trainings += 1
+        for old in to_close:
+            old.model.close()
+        logger.info(f"VW snapshot {snapshot.version} ready for {key} ({job.applied} interactions)")
+
+    def _resume(self, key: str, job: _TrainingJob) -> Optional[VWModel]:
+        """A copy of the current snapshot updated with only the interactions it has not seen, or None to retrain"""
+        previous = self._acquire(key)
+        if previous is None:
+            return None
+        try:
+            if not _resumable(previous.context, previous.applied, previous.digest, job.context, job.keys):
+                return None
+            model = self.scorer.copy(previous.model)
+        except Exception as e:
+            logger.warning(f"Could not copy VW snapshot for {key} ({e}), retraining from full history")
+            return None
+        finally:
+            self._release(previous)
+        if model is None:
+            return None
+        try:
+            model.learn(job.build_lines(previous.applied))
+        except Exception as e:
+            logger.warning(f"VW online update for {key} failed ({e}), retraining from full history")
+            model.close()
+            return None
+        with self._cond:
+            self.online_updates += 1
+        return model
+
+    def _key_dir(self, key: str) -> str:
+        return os.path.join(self.model_dir, hashlib.sha1(key.encode('utf-8')).hexdigest()[:20])
+
+    def _pointer_mtime(self, key: str) -> Optional[int]:
+        if not self.model_dir:
+            return None
+        try:
+            return os.stat(os.path.join(self._key_dir(key), 'CURRENT')).st_mtime_ns
+        except OSError:
+            return None
+
+    def _publish(self, key: str, snapshot: ModelSnapshot) -> int:
+        """Write the model, then repoint CURRENT at it; both renames, so readers see old or new, never partial"""
+        directory = self._key_dir(key)
+        os.makedirs(directory, exist_ok=True)
+        filename = f"{snapshot.version}.vw"
+        snapshot.model.save(os.path.join(directory, filename))
+        pointer = os.path.join(directory, 'CURRENT')
+        tmp_pointer = f"{pointer}.{os.getpid()}.tmp"
+        with open(tmp_pointer, 'w', encoding='utf-8') as f:
+            json.dump({
+                'version': snapshot.version,
+                'file': filename,
+                'context': snapshot.context,
+                'digest': snapshot.digest,
+                'applied': snapshot.applied
+            }, f)
+        os.replace(tmp_pointer, pointer)
+        with self._cond:
+            self.published += 1
+
+        # Older versions stay briefly for readers in other processes that resolved CURRENT just before
+        versions = sorted((name for name in os.listdir(directory) if name.endswith('.vw')), reverse=True)
+        for name in versions[self.keep_versions:]:
+            try:
+                os.remove(os.path.join(directory, name))
+            except OSError:
+                pass
+        return os.stat(pointer).st_mtime_ns
+
+    def _load_published(self, key: str) -> Optional[ModelSnapshot]:
+        directory = self._key_dir(key)
+        pointer = os.path.join(directory, 'CURRENT')
+        try:
+            pointer_mtime = os.stat(pointer).st_mtime_ns
+            with open(pointer, 'r', encoding='utf-8') as f:
+                meta = json.load(f)
+            model = self.scorer.load(os.path.join(directory, meta['file']))
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"Could not load published VW snapshot for {key}: {e}")
+            return None
+        if model is None:
+            return None
+        with self._cond:
+            self.disk_loads += 1
+        return ModelSnapshot(model, meta['version'], meta['context'], meta['digest'], meta['applied'], pointer_mtime)
+
+    def drain(self, timeout: float = None) -> bool:
+        """Train everything still pending now, ignoring the debounce; True when all of it finished in time"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            self._flushing = True
+            self._cond.notify_all()
+            try:
+                while self._jobs or self._active:
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        return False
+                    self._cond.wait(remaining)
+                return True
+            finally:
+                self._flushing = False
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+            snapshots = list(self._snapshots.values())
+            self._snapshots.clear()
+            for snapshot in snapshots:
+                snapshot.retired = True
+        for snapshot in snapshots:
+            if snapshot.readers == 0:
+                snapshot.model.close()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            return {
+                'snapshots': len(self._snapshots),
+                'pending': len(self._jobs),
+                'training': self._active,
+                'scheduled': self.scheduled,
+                'coalesced': self.coalesced,
+                'trainings': self.trainings,
+                'online_updates': self.online_updates,
+                'failures': self.failures,
+                'published': self.published,
+                'disk_loads': self.disk_loads,
+                'cold_misses': self.cold_misses,
+                'debounce_seconds': self.debounce_seconds,
+                'model_dir': self.model_dir
+            }
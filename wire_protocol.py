@@ -0,0 +1,104 @@
+"""Length-prefixed binary framing for the diversification server.
+
+Every message is a 4-byte big-endian length followed by one encoded object,
+the framing extract_gps.py's persistent mode uses for images. A body that
+starts with '{' is JSON; anything else is MessagePack, which needs
+`pip install msgpack` and is only imported once a MessagePack frame arrives.
+Replies use the codec of the request they answer, so a client without a
+MessagePack library can speak JSON frames to the same worker.
+
+Framed diversify replies are compact: selected entity ids, their positions in
+the request's entities array and relevance scores, plus the diversity
+metrics and trace metadata, instead of echoing every selected entity.
+"""
+import json
+import struct
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+JSON = 'json'
+MSGPACK = 'msgpack'
+
+_HEADER = struct.Struct('>I')
+# Refuse absurd lengths from a desynchronised stream instead of trying to allocate them
+MAX_FRAME_BYTES = 256 * 1024 * 1024
+
+
+class FrameError(ValueError):
+    pass
+
+
+def _msgpack():
+    try:
+        import msgpack
+    except ImportError:
+        raise FrameError("MessagePack frame received but msgpack is not installed (pip install msgpack)")
+    return msgpack
+
+
+def _default(value: Any) -> Any:
+    # NumPy scalars and arrays in the metrics
+    if hasattr(value, 'tolist'):
+        return value.tolist()
+    raise TypeError(f"Object of type {type(value).__name__} is not serializable")
+
+
+def detect_codec(body: bytes) -> str:
+    return JSON if body[:1] == b'{' else MSGPACK
+
+
+def decode_body(body: bytes) -> Tuple[Dict[str, Any], str]:
+    """The request object in a frame body and the codec it was written in"""
+    codec = detect_codec(body)
+    if codec == JSON:
+        message = json.loads(body)
+    else:
+        message = _msgpack().unpackb(body, raw=False)
+    if not isinstance(message, dict):
+        raise FrameError("A frame must hold one object")
+    return message, codec
+
+
+def encode_frame(message: Dict[str, Any], codec: str = JSON) -> bytes:
+    if codec == MSGPACK:
+        body = _msgpack().packb(message, default=_default, use_bin_type=True)
+    else:
+        body = json.dumps(message, ensure_ascii=False, separators=(',', ':'), default=_default).encode('utf-8')
+    return _HEADER.pack(len(body)) + body
+
+
+def read_frame(read: Callable[[int], bytes]) -> Optional[bytes]:
+    """Next frame body, or None at a clean end of stream"""
+    header = read(_HEADER.size)
+    if not header:
+        return None
+    if len(header) < _HEADER.size:
+        raise FrameError("Stream ended inside a frame header")
+    length = _HEADER.unpack(header)[0]
+    if length > MAX_FRAME_BYTES:
+        raise FrameError(f"Frame of {length} bytes exceeds the {MAX_FRAME_BYTES} byte limit")
+    body = read(length)
+    if len(body) < length:
+        raise FrameError("Stream ended inside a frame body")
+    return body
+
+
+def entity_positions(entities: List[Dict[str, Any]], selected: List[Dict[str, Any]]) -> List[int]:
+    """Index of each selected entity in the request's array; -1 when it cannot be found"""
+    # Selected entities are the request's own dicts, except on result cache hits
+    by_identity = {id(entity): i for i, entity in enumerate(entities)}
+    by_entity_id = {}
+    for i, entity in enumerate(entities):
+        by_entity_id.setdefault(str(entity.get('entity_id', '')), i)
+    return [
+        by_identity.get(id(entity), by_entity_id.get(str(entity.get('entity_id', '')), -1))
+        for entity in selected
+    ]
+
+
+def compact_results(results: Dict[str, Any], entities: List[Dict[str, Any]]) -> Dict[str, Any]:
+    """run_diversification results without the selected entities, which the caller already holds"""
+    compact = {key: value for key, value in results.items() if key != 'diversified_recommendations'}
+    selected = results.get('diversified_recommendations', [])
+    compact['entity_ids'] = [str(entity.get('entity_id', '')) for entity in selected]
+    compact['positions'] = entity_positions(entities, selected)
+    return compact